@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app import config, database
+from app.crud import flag_cache, user_cache
+
+logger = logging.getLogger(__name__)
+
+# Resume tokens older than the oplog window can no longer be used
+CHANGE_STREAM_HISTORY_LOST = 286
+
+# Flagging sets words.<word> to 0 and unflagging removes it, so plain counter increments are filtered out by the server
+SERVER_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace", "delete"]}},
+        {"operationType": "update", "updateDescription.removedFields.0": {"$exists": True}},
+        {"operationType": "update",
+         "$expr": {"$in": [0, {"$map": {"input": {"$objectToArray": "$updateDescription.updatedFields"},
+                                        "in": "$$this.v"}}]}},
+    ]}},
+    {"$project": {"operationType": 1, "documentKey": 1}},
+]
+
+
+# Every profile write reaches every worker, and each worker drops only the _ids it has cached. Filtering on the server
+# by cached _id cannot cover profiles cached after the stream was opened, and the list would grow with the cache.
+USER_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}},
+    {"$project": {"operationType": 1, "documentKey": 1}},
+]
+
+
+async def on_server_change(change: dict):
+    # Only flag changes get this far, so looking up the server id is cheap compared to fetching the full document
+    document = await database.servers.find_one({"_id": change["documentKey"]["_id"]}, {"discord_server_id": 1})
+    if document is None:
+        # The document is gone, and the caches are not keyed by _id
+        flag_cache.cache.clear()
+        user_cache.cache.clear()
+    else:
+        flag_cache.cache.invalidate(document["discord_server_id"])
+        user_cache.cache.invalidate_server(document["discord_server_id"])
+
+
+async def on_user_change(change: dict):
+    user_cache.cache.invalidate_id(change["documentKey"]["_id"])
+
+
+class Watcher:
+    def __init__(self, collection, pipeline: list[dict], handler, retry_delay: float):
+        self.collection = collection
+        self.pipeline = pipeline
+        self.handler = handler
+        self.retry_delay = retry_delay
+        self.resume_token = None
+
+    async def _watch(self):
+        async with self.collection.watch(self.pipeline, resume_after=self.resume_token) as stream:
+            logger.info("Watching %s for changes", self.collection.name)
+            while stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    await self.handler(change)
+                # Also advances on empty batches, so a reopened stream does not rescan filtered out history
+                self.resume_token = stream.resume_token
+
+    async def run(self):
+        while True:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAM_HISTORY_LOST:
+                    logger.exception("Change stream on %s failed", self.collection.name)
+                else:
+                    logger.warning("Change stream on %s lost its history, clearing caches", self.collection.name)
+                    self.resume_token = None
+                    flag_cache.cache.clear()
+                    user_cache.cache.clear()
+            except PyMongoError:
+                logger.exception("Change stream on %s failed", self.collection.name)
+            await asyncio.sleep(self.retry_delay)
+
+
+tasks: list[asyncio.Task] = []
+
+
+async def start():
+    if not config.CHANGE_STREAMS_ENABLED:
+        return
+    if config.STORAGE_BACKEND == "memory":
+        logger.warning("Change streams are not supported by the memory backend")
+        return
+
+    watchers = []
+    if flag_cache.cache.enabled or user_cache.cache.enabled:
+        watchers.append(Watcher(database.servers, SERVER_PIPELINE, on_server_change, config.CHANGE_STREAMS_RETRY_DELAY))
+    if user_cache.cache.enabled:
+        watchers.append(Watcher(database.users, USER_PIPELINE, on_user_change, config.CHANGE_STREAMS_RETRY_DELAY))
+
+    for watcher in watchers:
+        tasks.append(asyncio.create_task(watcher.run()))
+
+
+async def stop():
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    tasks.clear()
@@ -0,0 +1,145 @@
+import os
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+WRITE_BUFFER_ENABLED = env_bool("WRITE_BUFFER_ENABLED")
+WRITE_BUFFER_FLUSH_INTERVAL = env_float("WRITE_BUFFER_FLUSH_INTERVAL", 1.0)
+WRITE_BUFFER_MAX_KEYS = env_int("WRITE_BUFFER_MAX_KEYS", 5000)
+WRITE_BUFFER_MAX_RETRY_DELAY = env_float("WRITE_BUFFER_MAX_RETRY_DELAY", 30.0)
+
+FLAG_CACHE_SIZE = env_int("FLAG_CACHE_SIZE", 10000)
+FLAG_CACHE_TTL = env_float("FLAG_CACHE_TTL", 30.0)
+
+INDEX_MODE = os.environ.get("INDEX_MODE", "create").strip().lower()
+
+SPARSE_FLAGS = env_bool("SPARSE_FLAGS")
+
+SERVER_COUNTER_SHARDS = env_int("SERVER_COUNTER_SHARDS", 0)
+SERVER_COUNTER_SHARD_MODE = os.environ.get("SERVER_COUNTER_SHARD_MODE", "random").strip().lower()
+SERVER_COUNTER_COMPACT_INTERVAL = env_float("SERVER_COUNTER_COMPACT_INTERVAL", 60.0)
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "motor").strip().lower()
+
+MATCHER_CACHE_SIZE = env_int("MATCHER_CACHE_SIZE", 1000)
+
+FAST_RESPONSES = env_bool("FAST_RESPONSES")
+
+COALESCE_READS = env_bool("COALESCE_READS", True)
+
+USER_CACHE_MAX_BYTES = env_int("USER_CACHE_MAX_BYTES", 0)
+USER_CACHE_TTL = env_float("USER_CACHE_TTL", 5.0)
+
+CHANGE_STREAMS_ENABLED = env_bool("CHANGE_STREAMS_ENABLED")
+CHANGE_STREAMS_RETRY_DELAY = env_float("CHANGE_STREAMS_RETRY_DELAY", 1.0)
+
+JOBS_BATCH_SIZE = env_int("JOBS_BATCH_SIZE", 500)
+JOBS_CONCURRENCY = env_int("JOBS_CONCURRENCY", 4)
+JOBS_MAX_RUNNING = env_int("JOBS_MAX_RUNNING", 2)
+JOBS_LEASE = env_float("JOBS_LEASE", 60.0)
+JOBS_POLL_INTERVAL = env_float("JOBS_POLL_INTERVAL", 5.0)
+JOBS_MAX_ATTEMPTS = env_int("JOBS_MAX_ATTEMPTS", 5)
+
+SERVER_REMOVAL_GRACE_PERIOD = env_float("SERVER_REMOVAL_GRACE_PERIOD", 0.0)
+SERVER_REMOVAL_BATCH_SIZE = env_int("SERVER_REMOVAL_BATCH_SIZE", 1000)
+SERVER_REMOVAL_BATCH_DELAY = env_float("SERVER_REMOVAL_BATCH_DELAY", 0.1)
+
+ARCHIVE_INACTIVE_DAYS = env_float("ARCHIVE_INACTIVE_DAYS", 0.0)
+ARCHIVE_BATCH_SIZE = env_int("ARCHIVE_BATCH_SIZE", 500)
+ARCHIVE_BATCH_DELAY = env_float("ARCHIVE_BATCH_DELAY", 0.1)
+
+ONBOARD_CHUNK_SIZE = env_int("ONBOARD_CHUNK_SIZE", 1000)
+ONBOARD_CONCURRENCY = env_int("ONBOARD_CONCURRENCY", 4)
+
+PROFILING_ENABLED = env_bool("PROFILING_ENABLED")
+PROFILING_HEADER = os.environ.get("PROFILING_HEADER", "X-Profile").strip().lower()
+PROFILING_INTERVAL = env_float("PROFILING_INTERVAL", 0.001)
+PROFILING_RING_SIZE = env_int("PROFILING_RING_SIZE", 20)
+
+
+class MongoSettings(BaseModel):
+    uri: str | None = None
+    name: str = "wordbot"
+    max_pool_size: int = Field(100, ge=0)
+    min_pool_size: int = Field(0, ge=0)
+    max_connecting: int = Field(2, ge=1)
+    max_idle_time_ms: int | None = Field(None, ge=0)
+    wait_queue_timeout_ms: int | None = Field(None, ge=0)
+    compressors: list[Literal["zstd", "snappy", "zlib"]] = []
+    zlib_compression_level: int | None = Field(None, ge=-1, le=9)
+    server_selection_timeout_ms: int = Field(30000, ge=0)
+    connect_timeout_ms: int = Field(20000, ge=0)
+    socket_timeout_ms: int | None = Field(None, ge=0)
+    read_preference: Literal["primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"] = "primary"
+    write_concern_w: int | str | None = None
+    write_concern_journal: bool | None = None
+    write_concern_timeout_ms: int | None = Field(None, ge=0)
+    warmup: bool = True
+
+    @model_validator(mode="after")
+    def check_pool_bounds(self):
+        if self.max_pool_size != 0 and self.min_pool_size > self.max_pool_size:
+            raise ValueError("MONGO_MIN_POOL_SIZE must not exceed MONGO_MAX_POOL_SIZE")
+        return self
+
+    @classmethod
+    def from_env(cls) -> "MongoSettings":
+        values = {}
+        for name in cls.model_fields:
+            value = os.environ.get(name.upper() if name in ("uri", "name") else f"MONGO_{name.upper()}")
+            if value is None or value.strip() == "":
+                continue
+            if name == "compressors":
+                values[name] = [item.strip() for item in value.split(",") if item.strip() != ""]
+            elif name == "write_concern_w":
+                values[name] = int(value) if value.strip().isdigit() else value.strip()
+            else:
+                values[name] = value.strip()
+        return cls(**values)
+
+    def client_kwargs(self) -> dict:
+        kwargs = {"maxPoolSize": self.max_pool_size,
+                  "minPoolSize": self.min_pool_size,
+                  "maxConnecting": self.max_connecting,
+                  "maxIdleTimeMS": self.max_idle_time_ms,
+                  "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+                  "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+                  "connectTimeoutMS": self.connect_timeout_ms,
+                  "socketTimeoutMS": self.socket_timeout_ms,
+                  "readPreference": self.read_preference}
+        if len(self.compressors) > 0:
+            kwargs["compressors"] = ",".join(self.compressors)
+        if self.zlib_compression_level is not None:
+            kwargs["zlibCompressionLevel"] = self.zlib_compression_level
+        if self.write_concern_w is not None:
+            kwargs["w"] = self.write_concern_w
+        if self.write_concern_journal is not None:
+            kwargs["journal"] = self.write_concern_journal
+        if self.write_concern_timeout_ms is not None:
+            kwargs["wTimeoutMS"] = self.write_concern_timeout_ms
+        return kwargs
+
+
+MONGO = MongoSettings.from_env()
@@ -0,0 +1,39 @@
+import asyncio
+import logging
+
+from pymongo.errors import PyMongoError
+
+from app import config, database
+from app.crud import server_counters
+
+logger = logging.getLogger(__name__)
+
+task: asyncio.Task | None = None
+
+
+async def _run(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await server_counters.compact(database.servers)
+        except PyMongoError:
+            logger.exception("Server counter compaction failed")
+
+
+async def start():
+    global task
+
+    if server_counters.enabled() and config.SERVER_COUNTER_COMPACT_INTERVAL > 0:
+        task = asyncio.create_task(_run(config.SERVER_COUNTER_COMPACT_INTERVAL))
+
+
+async def stop():
+    global task
+
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        task = None
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app import config
+from app.crud import user_cache, versions
+from app.storage.base import Collection
+
+COLLECTION = "user_profiles_archive"
+
+FIELD = "last_active"
+
+
+def enabled() -> bool:
+    return config.ARCHIVE_INACTIVE_DAYS > 0
+
+
+def archive_collection(user_profiles: Collection) -> Collection:
+    return user_profiles.database[COLLECTION]
+
+
+def now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def touch(update: dict) -> dict:
+    return {**update, "$set": {**update.get("$set", {}), FIELD: now()}}
+
+
+def initial(document: dict) -> dict:
+    return {**document, FIELD: now()}
+
+
+def cutoff(inactive_days: float) -> datetime:
+    return now() - timedelta(days=inactive_days)
+
+
+def inactive_filter(before: datetime) -> dict:
+    # Profiles written before activity was tracked count as inactive since their creation
+    return {"$or": [{FIELD: {"$lt": before}},
+                    {FIELD: {"$exists": False}, "_id": {"$lt": ObjectId.from_datetime(before)}}]}
+
+
+def _members_query(members: dict[int, list[int]]) -> dict:
+    return {"$or": [{"discord_server_id": dc_server_id, "discord_user_id": {"$in": dc_user_ids}}
+                    for dc_server_id, dc_user_ids in members.items()]}
+
+
+async def find_one(user_profiles: Collection, query: dict, projection: dict | None = None) -> dict | None:
+    document = await user_profiles.find_one(query, projection)
+    if document is None and enabled():
+        document = await archive_collection(user_profiles).find_one(query, projection)
+    return document
+
+
+async def restore(user_profiles: Collection, members: dict[int, list[int]]) -> set[tuple[int, int]]:
+    archived = archive_collection(user_profiles)
+    documents = await archived.find(_members_query(members)).to_list(None) if len(members) > 0 else []
+    if len(documents) == 0:
+        return set()
+
+    try:
+        await user_profiles.insert_many([initial(document) for document in documents], ordered=False)
+    except BulkWriteError as bwe:
+        # Restored by a concurrent write, or left behind by an interrupted archival, either way the hot copy is newer
+        if any(err["code"] != 11000 for err in bwe.details["writeErrors"]):
+            raise
+    finally:
+        for document in documents:
+            user_cache.cache.invalidate(document["discord_server_id"], document["discord_user_id"])
+
+    await archived.delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+    return {(document["discord_server_id"], document["discord_user_id"]) for document in documents}
+
+
+async def archive_profiles(user_profiles: Collection, ids: list, before: datetime) -> int:
+    archived = archive_collection(user_profiles)
+    documents = await user_profiles.find({"_id": {"$in": ids}, **inactive_filter(before)}).to_list(None)
+    if len(documents) == 0:
+        return 0
+
+    moved = [document["_id"] for document in documents]
+    try:
+        await archived.delete_many({"_id": {"$in": moved}})
+        await archived.insert_many(documents, ordered=False)
+
+        # A profile written to after it was copied keeps its newer version in the hot collection
+        result = await user_profiles.bulk_write([pymongo.DeleteOne({"_id": document["_id"],
+                                                                    versions.FIELD: document.get(versions.FIELD)})
+                                                 for document in documents], ordered=False)
+        if result.deleted_count < len(documents):
+            remaining = [document["_id"] async for document in user_profiles.find({"_id": {"$in": moved}}, {"_id": 1})]
+            await archived.delete_many({"_id": {"$in": remaining}})
+
+        return result.deleted_count
+
+    finally:
+        for document in documents:
+            user_cache.cache.invalidate(document["discord_server_id"], document["discord_user_id"])
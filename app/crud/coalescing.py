@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import inspect
+
+from app import config, metrics
+
+
+def _server_id_getter(func):
+    names = list(inspect.signature(func).parameters)
+    if "dc_server_id" not in names:
+        return lambda args, kwargs: None
+
+    index = names.index("dc_server_id")
+    return lambda args, kwargs: args[index] if len(args) > index else kwargs.get("dc_server_id")
+
+
+def _key_part(value):
+    if isinstance(value, (list, set, frozenset, tuple)):
+        return tuple(_key_part(item) for item in value)
+    if isinstance(value, (int, str, bool, float)) or value is None:
+        return value
+    # Collections and other handles are shared module-level objects, so identity tells them apart
+    return ("id", id(value))
+
+
+# Servers share a fixed number of counters, so memory stays flat however many servers are written to
+SERVER_GENERATION_SLOTS = 4096
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.generation = 0
+        self.server_generations = [0] * SERVER_GENERATION_SLOTS
+        self._flights: dict[tuple, tuple[tuple[int, int], asyncio.Task]] = {}
+
+    @staticmethod
+    def _slot(dc_server_id: int) -> int:
+        return hash(dc_server_id) % SERVER_GENERATION_SLOTS
+
+    def _generation(self, dc_server_id) -> tuple[int, int]:
+        if dc_server_id is None:
+            return self.generation, 0
+        return self.generation, self.server_generations[self._slot(dc_server_id)]
+
+    def invalidate(self, dc_server_id: int | None = None):
+        if dc_server_id is None:
+            self.generation = self.generation + 1
+        else:
+            slot = self._slot(dc_server_id)
+            self.server_generations[slot] = self.server_generations[slot] + 1
+
+    async def run(self, name: str, key: tuple, dc_server_id, call):
+        generation = self._generation(dc_server_id)
+        flight = self._flights.get(key)
+        if flight is not None and flight[0] == generation:
+            metrics.coalesced_reads.inc(name, "joined")
+            return await asyncio.shield(flight[1])
+
+        metrics.coalesced_reads.inc(name, "leader")
+        task = asyncio.ensure_future(call())
+        self._flights[key] = (generation, task)
+
+        def done(finished: asyncio.Task):
+            if self._flights.get(key, (None, None))[1] is finished:
+                del self._flights[key]
+            if not finished.cancelled():
+                finished.exception()
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+
+flights = SingleFlight(enabled=config.COALESCE_READS)
+
+
+def reads(func):
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+    server_id = _server_id_getter(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not flights.enabled:
+            return await func(*args, **kwargs)
+
+        key = (name, _key_part(args), _key_part(tuple(sorted(kwargs.items()))))
+        return await flights.run(name, key, server_id(args, kwargs), lambda: func(*args, **kwargs))
+
+    return wrapper
+
+
+def writes(func):
+    server_id = _server_id_getter(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            # Reads started before the write finished must not be shared with callers that arrive after it
+            flights.invalidate(server_id(args, kwargs))
+
+    return wrapper
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+from app import config
+
+
+class FlagSetCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: OrderedDict[int, tuple[float, frozenset[str]]] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, dc_server_id: int) -> frozenset[str] | None:
+        entry = self._entries.get(dc_server_id)
+        if entry is None:
+            return None
+
+        expires, flags = entry
+        if self.ttl > 0 and expires < time.monotonic():
+            del self._entries[dc_server_id]
+            return None
+
+        self._entries.move_to_end(dc_server_id)
+        return flags
+
+    def put(self, dc_server_id: int, flags: frozenset[str], generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+
+        self._entries[dc_server_id] = (time.monotonic() + self.ttl, flags)
+        self._entries.move_to_end(dc_server_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, dc_server_id: int):
+        self.generation = self.generation + 1
+        self._entries.pop(dc_server_id, None)
+
+    def clear(self):
+        self.generation = self.generation + 1
+        self._entries.clear()
+
+
+cache = FlagSetCache(max_size=config.FLAG_CACHE_SIZE, ttl=config.FLAG_CACHE_TTL)
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+
+from app.Exceptions.database_exceptions import DatabaseException
+from app.schemas import job_schemas as schema
+from app.storage.base import Collection
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+UNFINISHED = [QUEUED, RUNNING]
+
+
+def now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def create_job(jobs: Collection, job_type: str, dc_server_id: int | None, params: dict,
+                     run_after: datetime | None = None) -> dict:
+    created_at = now()
+    document = {"type": job_type,
+                "status": QUEUED,
+                "discord_server_id": dc_server_id,
+                "params": params,
+                "cursor": None,
+                "processed": 0,
+                "total": None,
+                "attempts": 0,
+                "error": None,
+                "owner": None,
+                "run_after": run_after,
+                "lease_until": run_after or created_at,
+                "created_at": created_at,
+                "updated_at": created_at,
+                "finished_at": None}
+    await jobs.insert_one(document)
+    return document
+
+
+async def get_job(jobs: Collection, job_id: str) -> schema.Job:
+    try:
+        document = await jobs.find_one({"_id": ObjectId(job_id)})
+        if document is None:
+            raise DatabaseException("Job with provided ID does not exist")
+
+        return schema.Job(id=str(document["_id"]), **document)
+
+    except InvalidId:
+        raise DatabaseException("Provided job ID is not valid")
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
+
+
+async def find_claimable(jobs: Collection, limit: int) -> list[dict]:
+    cursor = jobs.find({"status": {"$in": UNFINISHED}, "lease_until": {"$lte": now()}})
+    return await cursor.sort("created_at", 1).limit(limit).to_list(limit)
+
+
+async def has_unfinished(jobs: Collection, job_type: str) -> bool:
+    try:
+        return await jobs.count_documents({"type": job_type, "status": {"$in": UNFINISHED}}, limit=1) > 0
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
+
+
+async def has_earlier_job(jobs: Collection, job: dict) -> bool:
+    # Jobs of one server run in submission order, so an unflag never races the flag it undoes
+    if job["discord_server_id"] is None:
+        return False
+    return await jobs.count_documents({"discord_server_id": job["discord_server_id"],
+                                       "status": {"$in": UNFINISHED},
+                                       "created_at": {"$lt": job["created_at"]}}, limit=1) > 0
+
+
+async def claim(jobs: Collection, job: dict, owner: str, lease: float) -> bool:
+    query = {"_id": job["_id"], "status": {"$in": UNFINISHED}, "lease_until": job["lease_until"]}
+    result = await jobs.update_one(query,
+                                   {"$set": {"status": RUNNING, "owner": owner,
+                                             "lease_until": now() + timedelta(seconds=lease), "updated_at": now()},
+                                    "$inc": {"attempts": 1}})
+    return result.modified_count == 1
+
+
+async def set_total(jobs: Collection, job_id: ObjectId, owner: str, total: int):
+    await jobs.update_one({"_id": job_id, "owner": owner}, {"$set": {"total": total, "updated_at": now()}})
+
+
+async def save_progress(jobs: Collection, job_id: ObjectId, owner: str, cursor, processed: int, lease: float) -> bool:
+    result = await jobs.update_one({"_id": job_id, "owner": owner, "status": RUNNING},
+                                   {"$set": {"cursor": cursor, "lease_until": now() + timedelta(seconds=lease),
+                                             "updated_at": now()},
+                                    "$inc": {"processed": processed}})
+    return result.matched_count == 1
+
+
+async def finish(jobs: Collection, job_id: ObjectId, owner: str, status: str, error: str | None = None):
+    await jobs.update_one({"_id": job_id, "owner": owner},
+                          {"$set": {"status": status, "error": error, "owner": None, "updated_at": now(),
+                                    "finished_at": now()}})
+
+
+async def release(jobs: Collection, job_id: ObjectId, owner: str, delay: float = 0.0, error: str | None = None):
+    await jobs.update_one({"_id": job_id, "owner": owner},
+                          {"$set": {"owner": None, "error": error, "lease_until": now() + timedelta(seconds=delay),
+                                    "updated_at": now()}})
+
+
+async def cancel(jobs: Collection, job_id: ObjectId) -> bool:
+    try:
+        # Only jobs that have not been taken by a runner yet can be cancelled
+        result = await jobs.update_one({"_id": job_id, "status": QUEUED},
+                                       {"$set": {"status": CANCELLED, "updated_at": now(), "finished_at": now()}})
+        return result.modified_count == 1
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
@@ -0,0 +1,163 @@
+import random
+import zlib
+
+import pymongo
+from bson import ObjectId
+
+from app import config
+from app.crud import coalescing, versions
+from app.storage.base import Collection
+
+COLLECTION = "server_counter_shards"
+
+# Ids of the shard snapshots already folded into a server profile, keyed by shard number
+APPLIED = "compacted_shards"
+
+READ_ATTEMPTS = 5
+
+
+def enabled() -> bool:
+    return config.SERVER_COUNTER_SHARDS > 1
+
+
+def shards_collection(server_profiles: Collection) -> Collection:
+    return server_profiles.database[COLLECTION]
+
+
+def pick_shard(dc_user_id: int | None = None) -> int:
+    if config.SERVER_COUNTER_SHARD_MODE == "hash" and dc_user_id is not None:
+        return zlib.crc32(str(dc_user_id).encode()) % config.SERVER_COUNTER_SHARDS
+    return random.randrange(config.SERVER_COUNTER_SHARDS)
+
+
+def increment_op(dc_server_id: int, inc_data: dict[str, int], dc_user_id: int | None = None) -> pymongo.UpdateOne:
+    return pymongo.UpdateOne({"discord_server_id": dc_server_id, "shard": pick_shard(dc_user_id)},
+                             {"$inc": {**inc_data, versions.FIELD: 1}}, upsert=True)
+
+
+async def increment(server_profiles: Collection, dc_server_id: int, inc_data: dict[str, int],
+                    dc_user_id: int | None = None):
+    await shards_collection(server_profiles).update_one({"discord_server_id": dc_server_id,
+                                                         "shard": pick_shard(dc_user_id)},
+                                                        {"$inc": {**inc_data, versions.FIELD: 1}}, upsert=True)
+
+
+def _add(totals: dict, counters: dict):
+    totals["total_words"] = totals["total_words"] + counters.get("total_words", 0)
+    totals["total_flagged_words"] = totals["total_flagged_words"] + counters.get("total_flagged_words", 0)
+    for key, val in counters.get("words", {}).items():
+        totals["words"][key] = totals["words"].get(key, 0) + val
+
+
+async def _applied(server_profiles: Collection, dc_server_id: int) -> dict:
+    server = await server_profiles.find_one({"discord_server_id": dc_server_id}, {"_id": 0, APPLIED: 1})
+    return (server or {}).get(APPLIED, {})
+
+
+async def sum_shards(server_profiles: Collection, dc_server_id: int, applied: dict) -> dict:
+    totals = {"total_words": 0, "total_flagged_words": 0, "words": {}}
+    async for shard in shards_collection(server_profiles).find({"discord_server_id": dc_server_id}, {"_id": 0}):
+        _add(totals, shard)
+        pending = shard.get("pending")
+        # A snapshot already folded into the profile must not be counted twice
+        if pending is not None and applied.get(str(shard["shard"])) != pending["id"]:
+            _add(totals, pending)
+    return totals
+
+
+async def sum_versions(server_profiles: Collection, dc_server_id: int) -> int:
+    version = 0
+    projection = {"_id": 0, versions.FIELD: 1}
+    async for shard in shards_collection(server_profiles).find({"discord_server_id": dc_server_id}, projection):
+        version = version + shard.get(versions.FIELD, 0)
+    return version
+
+
+def _merge(profile: dict, totals: dict) -> dict:
+    for key in ("total_words", "total_flagged_words"):
+        if key in profile:
+            profile[key] = profile[key] + totals[key]
+    if "words" in profile:
+        words = profile["words"]
+        for key in words.keys():
+            words[key] = words[key] + totals["words"].get(key, 0)
+    return profile
+
+
+async def find_profile(server_profiles: Collection, dc_server_id: int, projection: dict) -> dict | None:
+    query = {"discord_server_id": dc_server_id}
+    if not enabled():
+        return await server_profiles.find_one(query, projection)
+
+    # The markers are read with the counters they describe. A snapshot folded and cleared after the profile was read
+    # is in neither read, so the shards are summed again whenever the markers changed in the meantime
+    projection = {**projection, APPLIED: 1}
+    for _ in range(READ_ATTEMPTS):
+        profile = await server_profiles.find_one(query, projection)
+        if profile is None:
+            return None
+        applied = profile.pop(APPLIED, {})
+        totals = await sum_shards(server_profiles, dc_server_id, applied)
+        if await _applied(server_profiles, dc_server_id) == applied:
+            break
+    return _merge(profile, totals)
+
+
+async def _begin(shards: Collection, shard: dict) -> dict | None:
+    if "pending" in shard:
+        return shard["pending"]
+
+    words = {key: val for key, val in shard.get("words", {}).items() if val != 0}
+    if len(words) == 0 and shard.get("total_words", 0) == 0 and shard.get("total_flagged_words", 0) == 0:
+        return None
+
+    pending = {"id": ObjectId(),
+               "total_words": shard.get("total_words", 0),
+               "total_flagged_words": shard.get("total_flagged_words", 0),
+               "words": words}
+    # Moving the counters into the snapshot is a single write, increments that arrive meanwhile stay in the shard
+    dec_data = {"total_words": -pending["total_words"], "total_flagged_words": -pending["total_flagged_words"]}
+    dec_data.update({f"words.{key}": -val for key, val in words.items()})
+    result = await shards.update_one({"_id": shard["_id"], "pending": {"$exists": False}},
+                                     {"$inc": {**dec_data, versions.FIELD: 1}, "$set": {"pending": pending}})
+    return pending if result.modified_count == 1 else None
+
+
+async def _fold(server_profiles: Collection, shards: Collection, shard: dict, pending: dict):
+    dc_server_id = shard["discord_server_id"]
+    server = await server_profiles.find_one({"discord_server_id": dc_server_id}, {"_id": 0, "words": 1})
+    if server is not None:
+        flags = server.get("words", {})
+        inc_data = {}
+        total_flagged = pending["total_flagged_words"]
+        for key, val in pending["words"].items():
+            if key in flags:
+                inc_data.update({f"words.{key}": val})
+            else:
+                total_flagged = total_flagged - val
+        inc_data.update({"total_words": pending["total_words"], "total_flagged_words": total_flagged})
+
+        # The marker makes folding idempotent, so a compaction interrupted after this write can be resumed
+        marker = f"{APPLIED}.{shard['shard']}"
+        await server_profiles.update_one({"discord_server_id": dc_server_id, marker: {"$ne": pending["id"]}},
+                                         versions.bump({"$inc": inc_data, "$set": {marker: pending["id"]}}))
+
+    await shards.update_one({"_id": shard["_id"], "pending.id": pending["id"]},
+                            {"$unset": {"pending": ""}, "$inc": {versions.FIELD: 1}})
+
+
+@coalescing.writes
+async def compact(server_profiles: Collection, dc_server_id: int | None = None) -> int:
+    shards = shards_collection(server_profiles)
+    query = {} if dc_server_id is None else {"discord_server_id": dc_server_id}
+
+    # Counters are never decremented before they are added to the profile, and versions only ever grow
+    compacted = 0
+    async for shard in shards.find(query):
+        pending = await _begin(shards, shard)
+        if pending is None:
+            continue
+        await _fold(server_profiles, shards, shard, pending)
+        compacted = compacted + 1
+
+    return compacted
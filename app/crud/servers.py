@@ -1,11 +1,18 @@
-from motor.core import AgnosticCollection
+from datetime import datetime
+
+from pymongo import ASCENDING
 from pymongo.errors import PyMongoError
 from app.Exceptions.database_exceptions import DatabaseException
-from app.utility import conv, validate_and_transform, ValidationError
+from app.crud import archive, coalescing, flag_cache, server_counters, user_cache, versions
+from app.utility import conv, shape, validate_and_transform, ValidationError
 from app.schemas import server_schemas as schema
+from app.storage.base import Collection
+
+MEMBERS_BATCH_SIZE = 1000
 
 
-async def check_if_exists(server_profiles: AgnosticCollection, dc_server_id: int) -> schema.ServerExists:
+@coalescing.reads
+async def check_if_exists(server_profiles: Collection, dc_server_id: int) -> schema.ServerExists:
     try:
         profile = await server_profiles.find_one({"discord_server_id": dc_server_id})
         if profile:
@@ -17,10 +24,11 @@ async def check_if_exists(server_profiles: AgnosticCollection, dc_server_id: int
         raise DatabaseException("Failure processing the request")
 
 
-async def get_word_count(server_profiles: AgnosticCollection, dc_server_id: int, word: str) -> schema.ServerWordCount:
+@coalescing.reads
+async def get_word_count(server_profiles: Collection, dc_server_id: int, word: str) -> schema.ServerWordCount:
     try:
         projection = {f"words.{word}": 1, "_id": 0}
-        result = await server_profiles.find_one({"discord_server_id": dc_server_id}, projection)
+        result = await server_counters.find_profile(server_profiles, dc_server_id, projection)
 
         if result:
             if len(result["words"]) == 0:
@@ -34,23 +42,31 @@ async def get_word_count(server_profiles: AgnosticCollection, dc_server_id: int,
         raise DatabaseException("Failure processing the request")
 
 
-async def get_profile(server_profiles: AgnosticCollection, dc_server_id: int) -> schema.ServerProfile:
+@coalescing.reads
+async def get_profile_document(server_profiles: Collection, dc_server_id: int) -> dict:
     try:
-        projection = {f"_id": 0}
-        result = await server_profiles.find_one({"discord_server_id": dc_server_id}, projection)
+        projection = {"_id": 0, **{name: 1 for name in schema.ServerProfile.model_fields}}
+        result = await server_counters.find_profile(server_profiles, dc_server_id, projection)
         if result:
-            return schema.ServerProfile(**result)
+            return shape(result, schema.ServerProfile)
         else:
             raise DatabaseException("Profile not found")
 
+    except ValidationError as e:
+        raise DatabaseException(f"Error when processing stored data: {e.message}")
     except PyMongoError:
         raise DatabaseException("Failure processing the request")
 
 
-async def get_total_words(server_profiles: AgnosticCollection, dc_server_id: int) -> schema.ServerTotalWords:
+async def get_profile(server_profiles: Collection, dc_server_id: int) -> schema.ServerProfile:
+    return schema.ServerProfile(**await get_profile_document(server_profiles, dc_server_id))
+
+
+@coalescing.reads
+async def get_total_words(server_profiles: Collection, dc_server_id: int) -> schema.ServerTotalWords:
     try:
         projection = {f"total_words": 1, "_id": 0}
-        result = await server_profiles.find_one({"discord_server_id": dc_server_id}, projection)
+        result = await server_counters.find_profile(server_profiles, dc_server_id, projection)
         if result:
             return schema.ServerTotalWords(**result)
         else:
@@ -60,11 +76,12 @@ async def get_total_words(server_profiles: AgnosticCollection, dc_server_id: int
         raise DatabaseException("Failure processing the request")
 
 
-async def get_total_flagged_words(server_profiles: AgnosticCollection,
+@coalescing.reads
+async def get_total_flagged_words(server_profiles: Collection,
                                   dc_server_id: int) -> schema.ServerTotalFlaggedWords:
     try:
         projection = {f"total_flagged_words": 1, "_id": 0}
-        result = await server_profiles.find_one({"discord_server_id": dc_server_id}, projection)
+        result = await server_counters.find_profile(server_profiles, dc_server_id, projection)
         if result:
             return schema.ServerTotalFlaggedWords(**result)
         else:
@@ -74,12 +91,13 @@ async def get_total_flagged_words(server_profiles: AgnosticCollection,
         raise DatabaseException("Failure processing the request")
 
 
-async def get_flagged_words(server_profiles: AgnosticCollection, dc_server_id: int) -> schema.ServerFlaggedWords:
+@coalescing.reads
+async def get_flagged_words_document(server_profiles: Collection, dc_server_id: int) -> dict:
     try:
         projection = {"_id": 0, "words": 1}
-        result = await server_profiles.find_one({"discord_server_id": dc_server_id}, projection)
+        result = await server_counters.find_profile(server_profiles, dc_server_id, projection)
         if result:
-            return schema.ServerFlaggedWords(**result)
+            return {"words": result.get("words", {})}
         else:
             raise DatabaseException("Profile not found")
 
@@ -87,11 +105,66 @@ async def get_flagged_words(server_profiles: AgnosticCollection, dc_server_id: i
         raise DatabaseException("Failure processing the request")
 
 
-async def create_profile(server_profiles: AgnosticCollection,
+async def get_flagged_words(server_profiles: Collection, dc_server_id: int) -> schema.ServerFlaggedWords:
+    return schema.ServerFlaggedWords(**await get_flagged_words_document(server_profiles, dc_server_id))
+
+
+@coalescing.reads
+async def get_etag(server_profiles: Collection, dc_server_id: int) -> str:
+    try:
+        result = await server_profiles.find_one({"discord_server_id": dc_server_id}, {"_id": 1, versions.FIELD: 1})
+        if result:
+            version = result.get(versions.FIELD, 0)
+            if server_counters.enabled():
+                version = version + await server_counters.sum_versions(server_profiles, dc_server_id)
+            return versions.etag(result["_id"], version)
+        else:
+            raise DatabaseException("Profile not found")
+
+    except PyMongoError:
+        raise DatabaseException("Failure processing the request")
+
+
+async def get_flag_sets(server_profiles: Collection, dc_server_ids) -> dict[int, frozenset[str]]:
+    try:
+        flag_sets = {}
+        missing = []
+        for dc_server_id in dc_server_ids:
+            flags = flag_cache.cache.get(dc_server_id)
+            if flags is None:
+                missing.append(dc_server_id)
+            else:
+                flag_sets[dc_server_id] = flags
+
+        if len(missing) > 0:
+            generation = flag_cache.cache.generation
+            projection = {"_id": 0, "discord_server_id": 1, "words": 1}
+            async for server in server_profiles.find({"discord_server_id": {"$in": missing}}, projection):
+                flags = frozenset(server.get("words", {}).keys())
+                flag_sets[server["discord_server_id"]] = flags
+                flag_cache.cache.put(server["discord_server_id"], flags, generation)
+
+        return flag_sets
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+async def get_flag_set(server_profiles: Collection, dc_server_id: int) -> frozenset[str]:
+    flag_sets = await get_flag_sets(server_profiles, [dc_server_id])
+    if dc_server_id in flag_sets:
+        return flag_sets[dc_server_id]
+    else:
+        raise DatabaseException("Profile not found")
+
+
+@coalescing.writes
+async def create_profile(server_profiles: Collection,
                          dc_server_id: int) -> schema.ServerCreateResult:
     try:
         profile = schema.ServerProfile(discord_server_id=dc_server_id)
-        server_result = await server_profiles.insert_one(profile.dict())
+        server_result = await server_profiles.insert_one(versions.initial(profile.dict()))
+        flag_cache.cache.invalidate(dc_server_id)
 
         if server_result:
             return schema.ServerCreateResult(created=True)
@@ -100,7 +173,8 @@ async def create_profile(server_profiles: AgnosticCollection,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def flag_words(server_profiles: AgnosticCollection,
+@coalescing.writes
+async def flag_words(server_profiles: Collection,
                      dc_server_id: int,
                      words: list[str]) -> schema.ServerFlagWordsResult:
     if len(words) == 0:
@@ -124,7 +198,8 @@ async def flag_words(server_profiles: AgnosticCollection,
         if len(query) == 0:
             raise DatabaseException("Provided data already exists in the server profile")
 
-        await server_profiles.update_one({"discord_server_id": dc_server_id}, {"$set": query})
+        await server_profiles.update_one({"discord_server_id": dc_server_id}, versions.bump({"$set": query}))
+        flag_cache.cache.invalidate(dc_server_id)
 
         return schema.ServerFlagWordsResult(flagged_count=len(flagged),
                                             conflicts_count=len(conflicts),
@@ -137,7 +212,8 @@ async def flag_words(server_profiles: AgnosticCollection,
         raise DatabaseException(f"Error when processing the request: {e}")
 
 
-async def unflag_words(server_profiles: AgnosticCollection,
+@coalescing.writes
+async def unflag_words(server_profiles: Collection,
                        dc_server_id: int,
                        words: list[str]) -> schema.ServerUnflagWordsResult:
     if len(words) == 0:
@@ -151,6 +227,8 @@ async def unflag_words(server_profiles: AgnosticCollection,
 
         unset_data = {}
         flagged_count_remove = 0
+        if server_counters.enabled():
+            await server_counters.compact(server_profiles, dc_server_id)
         server_flags = await get_flagged_words(server_profiles, dc_server_id)
         for del_word in input_words:
             if del_word in server_flags.words.keys():
@@ -165,7 +243,9 @@ async def unflag_words(server_profiles: AgnosticCollection,
 
         inc_data = {"total_flagged_words": flagged_count_remove * -1}
 
-        await server_profiles.update_one({"discord_server_id": dc_server_id}, {"$unset": unset_data, "$inc": inc_data})
+        await server_profiles.update_one({"discord_server_id": dc_server_id},
+                                         versions.bump({"$unset": unset_data, "$inc": inc_data}))
+        flag_cache.cache.invalidate(dc_server_id)
 
         return schema.ServerUnflagWordsResult(unflagged_count=len(unflagged),
                                               ignored_count=len(ignored),
@@ -178,12 +258,18 @@ async def unflag_words(server_profiles: AgnosticCollection,
         raise DatabaseException(f"Error when processing the request: {e}")
 
 
-async def update_total_words_count(server_profiles: AgnosticCollection,
+@coalescing.writes
+async def update_total_words_count(server_profiles: Collection,
                                    dc_server_id: int,
-                                   difference: int) -> schema.ServerUpdateTotalWordsResult:
+                                   difference: int,
+                                   dc_user_id: int | None = None) -> schema.ServerUpdateTotalWordsResult:
     try:
         query = {"$inc": {"total_words": difference}}
-        result = server_profiles.update_one({"discord_server_id": dc_server_id}, update=query)
+        if server_counters.enabled():
+            await server_counters.increment(server_profiles, dc_server_id, query["$inc"], dc_user_id)
+            return schema.ServerUpdateTotalWordsResult(success=True)
+
+        result = await server_profiles.update_one({"discord_server_id": dc_server_id}, update=versions.bump(query))
         if result:
             return schema.ServerUpdateTotalWordsResult(success=True)
 
@@ -191,22 +277,28 @@ async def update_total_words_count(server_profiles: AgnosticCollection,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def update_flags(server_profiles: AgnosticCollection,
+@coalescing.writes
+async def update_flags(server_profiles: Collection,
                        dc_server_id: int,
-                       data: dict[str, int]) -> schema.ServerUpdateFlagsResult:
+                       data: dict[str, int],
+                       dc_user_id: int | None = None) -> schema.ServerUpdateFlagsResult:
     try:
-        flags = await get_flagged_words(server_profiles, dc_server_id)
+        flags = await get_flag_set(server_profiles, dc_server_id)
 
         inc_data = {}
         total_count = 0
         for key, val in data.items():
-            if key in flags.words.keys():
+            if key in flags:
                 total_count = total_count + val
                 inc_data.update({f"words.{key}": val})
 
         query = {"$inc": inc_data}
         inc_data.update({"total_flagged_words": total_count})
-        result = server_profiles.update_one({"discord_server_id": dc_server_id}, update=query)
+        if server_counters.enabled():
+            await server_counters.increment(server_profiles, dc_server_id, inc_data, dc_user_id)
+            return schema.ServerUpdateFlagsResult(success=True)
+
+        result = await server_profiles.update_one({"discord_server_id": dc_server_id}, update=versions.bump(query))
         if result:
             return schema.ServerUpdateFlagsResult(success=True)
 
@@ -214,17 +306,127 @@ async def update_flags(server_profiles: AgnosticCollection,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def get_members_ids(user_profiles: AgnosticCollection,
-                          dc_server_id: int) -> schema.ServerGetMembersIds:
+@coalescing.writes
+async def schedule_removal(server_profiles: Collection, dc_server_id: int, delete_after: datetime):
+    try:
+        result = await server_profiles.update_one({"discord_server_id": dc_server_id,
+                                                   "pending_removal": {"$exists": False}},
+                                                  versions.bump({"$set": {"pending_removal": {
+                                                      "delete_after": delete_after, "job_id": None}}}))
+        if result.matched_count == 0:
+            if await server_profiles.count_documents({"discord_server_id": dc_server_id}, limit=1) == 0:
+                raise DatabaseException("Profile not found")
+            raise DatabaseException("Server is already scheduled for removal")
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+async def set_removal_job(server_profiles: Collection, dc_server_id: int, job_id):
+    try:
+        await server_profiles.update_one({"discord_server_id": dc_server_id},
+                                         {"$set": {"pending_removal.job_id": job_id}})
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+async def get_pending_removal(server_profiles: Collection, dc_server_id: int) -> dict:
+    try:
+        profile = await server_profiles.find_one({"discord_server_id": dc_server_id}, {"_id": 0, "pending_removal": 1})
+        if profile is None:
+            raise DatabaseException("Profile not found")
+        if "pending_removal" not in profile:
+            raise DatabaseException("Server is not scheduled for removal")
+        return profile["pending_removal"]
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+@coalescing.writes
+async def cancel_removal(server_profiles: Collection, dc_server_id: int):
+    try:
+        await server_profiles.update_one({"discord_server_id": dc_server_id},
+                                         versions.bump({"$unset": {"pending_removal": ""}}))
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+@coalescing.writes
+async def remove_profile(server_profiles: Collection, dc_server_id: int):
+    try:
+        await server_profiles.delete_one({"discord_server_id": dc_server_id})
+        # Shards may be left over from a time when sharding was enabled
+        await server_counters.shards_collection(server_profiles).delete_many({"discord_server_id": dc_server_id})
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+    finally:
+        flag_cache.cache.invalidate(dc_server_id)
+        user_cache.cache.invalidate_server(dc_server_id)
+
+
+@coalescing.reads
+async def get_members_ids(user_profiles: Collection,
+                          dc_server_id: int,
+                          after_id: int | None = None,
+                          limit: int | None = None) -> schema.ServerGetMembersIds:
+    if limit is not None and limit <= 0:
+        raise DatabaseException("Limit must be a positive number")
+
     try:
         data = []
-        async for user in user_profiles.find({"discord_server_id": dc_server_id}):
-            data.append(str(user["discord_user_id"]))
+        async for dc_user_id in iter_members_ids(user_profiles, dc_server_id, after_id, limit):
+            data.append(str(dc_user_id))
 
-        if len(data) == 0:
+        if len(data) == 0 and after_id is None:
             raise DatabaseException("There are no users registered for this server")
-        else:
-            return schema.ServerGetMembersIds(ids=data)
+
+        next_after_id = data[-1] if limit is not None and len(data) == limit else None
+        return schema.ServerGetMembersIds(ids=data, next_after_id=next_after_id)
 
     except PyMongoError as e:
         raise DatabaseException(f"Database error: {e}")
+
+
+async def _iter_collection_ids(collection: Collection, query: dict, limit: int | None):
+    projection = {"_id": 0, "discord_user_id": 1}
+    cursor = collection.find(query, projection).sort("discord_user_id", ASCENDING).batch_size(MEMBERS_BATCH_SIZE)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    async for user in cursor:
+        yield user["discord_user_id"]
+
+
+async def iter_members_ids(user_profiles: Collection,
+                           dc_server_id: int,
+                           after_id: int | None = None,
+                           limit: int | None = None):
+    query = {"discord_server_id": dc_server_id}
+    if after_id is not None:
+        query.update({"discord_user_id": {"$gt": after_id}})
+
+    if not archive.enabled():
+        async for dc_user_id in _iter_collection_ids(user_profiles, query, limit):
+            yield dc_user_id
+        return
+
+    # Both collections are read in ID order and merged, a member being moved can briefly be in both
+    streams = [_iter_collection_ids(user_profiles, query, limit),
+               _iter_collection_ids(archive.archive_collection(user_profiles), query, limit)]
+    heads = [await anext(stream, None) for stream in streams]
+    count = 0
+    while limit is None or count < limit:
+        pending = [head for head in heads if head is not None]
+        if len(pending) == 0:
+            return
+
+        dc_user_id = min(pending)
+        for i, head in enumerate(heads):
+            if head == dc_user_id:
+                heads[i] = await anext(streams[i], None)
+        yield dc_user_id
+        count = count + 1
@@ -0,0 +1,155 @@
+import sys
+import time
+from collections import OrderedDict
+
+from app import config, metrics
+
+PROJECTION = {"_id": 1, "discord_server_id": 1, "discord_user_id": 1, "total_words": 1, "total_flagged_words": 1,
+              "words": 1, "version": 1}
+
+ENTRY_OVERHEAD = 400
+
+# Writes to different users and servers bump different counters, the fixed number keeps memory flat however many
+# there are
+KEY_GENERATION_SLOTS = 4096
+
+# Uncached _ids invalidated by other workers are remembered for reads of them that are still in flight
+RECENT_IDS_SIZE = 10000
+
+
+def estimate_size(document: dict) -> int:
+    words = document.get("words", {})
+    return ENTRY_OVERHEAD + sys.getsizeof(words) + sum(sys.getsizeof(key) + 32 for key in words)
+
+
+class UserProfileCache:
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = 0
+        self.server_generations = [0] * KEY_GENERATION_SLOTS
+        self.key_generations = [0] * KEY_GENERATION_SLOTS
+        self.id_generation = 0
+        self._recent_ids: OrderedDict = OrderedDict()
+        self._recent_floor = 0
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._entries: OrderedDict[tuple[int, int], tuple[float, int, dict]] = OrderedDict()
+        self._servers: dict[int, set[int]] = {}
+        self._ids: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _slot(*key) -> int:
+        return hash(key) % KEY_GENERATION_SLOTS
+
+    def generation_of(self, dc_server_id: int, dc_user_id: int) -> tuple[int, int, int, int]:
+        return (self.generation, self.server_generations[self._slot(dc_server_id)],
+                self.key_generations[self._slot(dc_server_id, dc_user_id)], self.id_generation)
+
+    def _invalidated_since(self, id, id_generation: int) -> bool:
+        if id_generation == self.id_generation:
+            return False
+        # An _id invalidated after the read started may have been forgotten already
+        if id_generation < self._recent_floor:
+            return True
+        return self._recent_ids.get(id, 0) > id_generation
+
+    def _remove(self, key: tuple[int, int]):
+        _, size, document = self._entries.pop(key)
+        self.bytes = self.bytes - size
+        self._ids.pop(document.get("_id"), None)
+        members = self._servers.get(key[0])
+        if members is not None:
+            members.discard(key[1])
+            if len(members) == 0:
+                del self._servers[key[0]]
+
+    def get(self, dc_server_id: int, dc_user_id: int) -> dict | None:
+        key = (dc_server_id, dc_user_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] = self.stats["misses"] + 1
+            return None
+
+        if self.ttl > 0 and entry[0] < time.monotonic():
+            self._remove(key)
+            self.stats["expirations"] = self.stats["expirations"] + 1
+            self.stats["misses"] = self.stats["misses"] + 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats["hits"] = self.stats["hits"] + 1
+        return entry[2]
+
+    def put(self, dc_server_id: int, dc_user_id: int, document: dict, generation: tuple[int, int, int, int]):
+        # A read that overlapped a write of the same user, its server or the whole cache may return stale data
+        if not self.enabled or generation[:3] != self.generation_of(dc_server_id, dc_user_id)[:3]:
+            return
+        if self._invalidated_since(document.get("_id"), generation[3]):
+            return
+
+        size = estimate_size(document)
+        if size > self.max_bytes:
+            return
+
+        key = (dc_server_id, dc_user_id)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, document)
+        self._servers.setdefault(dc_server_id, set()).add(dc_user_id)
+        if "_id" in document:
+            self._ids[document["_id"]] = key
+        self.bytes = self.bytes + size
+
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] = self.stats["evictions"] + 1
+
+    def invalidate(self, dc_server_id: int, dc_user_id: int):
+        slot = self._slot(dc_server_id, dc_user_id)
+        self.key_generations[slot] = self.key_generations[slot] + 1
+        key = (dc_server_id, dc_user_id)
+        if key in self._entries:
+            self._remove(key)
+            self.stats["invalidations"] = self.stats["invalidations"] + 1
+
+    def invalidate_id(self, id):
+        key = self._ids.get(id)
+        if key is None:
+            self.id_generation = self.id_generation + 1
+            self._recent_ids[id] = self.id_generation
+            self._recent_ids.move_to_end(id)
+            while len(self._recent_ids) > RECENT_IDS_SIZE:
+                _, self._recent_floor = self._recent_ids.popitem(last=False)
+        else:
+            self.invalidate(*key)
+
+    def invalidate_server(self, dc_server_id: int):
+        slot = self._slot(dc_server_id)
+        self.server_generations[slot] = self.server_generations[slot] + 1
+        for dc_user_id in list(self._servers.get(dc_server_id, ())):
+            self._remove((dc_server_id, dc_user_id))
+            self.stats["invalidations"] = self.stats["invalidations"] + 1
+
+    def clear(self):
+        self.generation = self.generation + 1
+        self._entries.clear()
+        self._servers.clear()
+        self._ids.clear()
+        self._recent_ids.clear()
+        self._recent_floor = self.id_generation
+        self.bytes = 0
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+cache = UserProfileCache(max_bytes=config.USER_CACHE_MAX_BYTES, ttl=config.USER_CACHE_TTL)
+
+metrics.registry.register(metrics.Gauge(
+    "wordbot_user_cache", "User profile cache statistics: hits, misses, evictions, expirations, invalidations, "
+    "entries and bytes", ("stat",), lambda: {(key,): value for key, value in cache.snapshot().items()}))
@@ -1,16 +1,105 @@
+import asyncio
+from typing import AsyncIterator
+
 import pymongo
-from motor.core import AgnosticCollection
 from pymongo.errors import PyMongoError, BulkWriteError
 
+from app import config, matcher
 from app.Exceptions.database_exceptions import DatabaseException
-from app.crud import servers as crud_server
-from app.utility import validate_and_transform, ValidationError
+from app.crud import archive, coalescing, server_counters, servers as crud_server, user_cache, versions
+from app.utility import build_increment, check_int64, shape, validate_and_transform, ValidationError
 from app.schemas import user_schemas as schema
+from app.storage.base import Collection
+
+
+async def _fill_flags(server_profiles: Collection, dc_server_id: int, words: dict) -> dict:
+    if not config.SPARSE_FLAGS:
+        return words
+
+    filled = dict(words)
+    for key in await crud_server.get_flag_set(server_profiles, dc_server_id):
+        filled.setdefault(key, 0)
+    return filled
+
+
+def _flag_pipeline(words: list[str]) -> list[dict]:
+    # Members that already count a word keep their count, so a batch can safely be applied twice
+    return [{"$set": {f"words.{word}": {"$ifNull": [f"$words.{word}", 0]} for word in words}}, versions.PIPELINE_BUMP]
+
+
+def _unflag_pipeline(words: list[str]) -> list[dict]:
+    removed_count = {"$add": [{"$ifNull": [f"$words.{word}", 0]} for word in words]}
+    return [
+        {"$set": {"total_flagged_words": {"$subtract": ["$total_flagged_words", removed_count]}}},
+        {"$unset": [f"words.{word}" for word in words]},
+        versions.PIPELINE_BUMP,
+    ]
+
 
+async def _find_user(user_profiles: Collection, dc_server_id: int, dc_user_id: int, projection: dict) -> dict | None:
+    query = {"discord_server_id": dc_server_id, "discord_user_id": dc_user_id}
+    if not user_cache.cache.enabled:
+        return await archive.find_one(user_profiles, query, projection)
 
-async def check_if_exists(user_profiles: AgnosticCollection, dc_server_id: int, dc_user_id: int) -> schema.UserExists:
+    # Cached documents are shared between callers and must not be modified
+    user = user_cache.cache.get(dc_server_id, dc_user_id)
+    if user is None:
+        generation = user_cache.cache.generation_of(dc_server_id, dc_user_id)
+        user = await archive.find_one(user_profiles, query, user_cache.PROJECTION)
+        if user is not None:
+            user_cache.cache.put(dc_server_id, dc_user_id, user, generation)
+    return user
+
+
+async def _find_members(user_profiles: Collection, dc_server_id: int, dc_user_ids: list[int], projection: dict):
+    found = set()
+    query = {"discord_server_id": dc_server_id, "discord_user_id": {"$in": dc_user_ids}}
+    async for user in user_profiles.find(query, projection):
+        found.add(user["discord_user_id"])
+        yield user
+
+    missing = [dc_user_id for dc_user_id in dc_user_ids if dc_user_id not in found]
+    if archive.enabled() and len(missing) > 0:
+        query = {"discord_server_id": dc_server_id, "discord_user_id": {"$in": missing}}
+        async for user in archive.archive_collection(user_profiles).find(query, projection):
+            yield user
+
+
+async def _update_user(user_profiles: Collection, dc_server_id: int, dc_user_id: int, update: dict):
+    query = {"discord_server_id": dc_server_id, "discord_user_id": dc_user_id}
+    result = await user_profiles.update_one(query, update=archive.touch(update))
+    if result.matched_count == 0 and archive.enabled():
+        # Archived profiles become active again on their next write, a concurrent write may have restored it already
+        await archive.restore(user_profiles, {dc_server_id: [dc_user_id]})
+        result = await user_profiles.update_one(query, update=archive.touch(update))
+    return result
+
+
+@coalescing.reads
+async def get_etag(user_profiles: Collection,
+                   server_profiles: Collection,
+                   dc_server_id: int,
+                   dc_user_id: int) -> str:
     try:
-        profile = await user_profiles.find_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id})
+        result = await _find_user(user_profiles, dc_server_id, dc_user_id, {"_id": 1, versions.FIELD: 1})
+        if result is None:
+            raise DatabaseException("Profile not found")
+
+        if config.SPARSE_FLAGS:
+            # Sparse profiles read missing flagged words as zeros, so the server's flag list is part of the response
+            server_etag = await crud_server.get_etag(server_profiles, dc_server_id)
+            return versions.etag(result["_id"], result.get(versions.FIELD, 0), server_etag.strip('"'))
+        return versions.etag(result["_id"], result.get(versions.FIELD, 0))
+
+    except PyMongoError:
+        raise DatabaseException("Failure processing the request")
+
+
+@coalescing.reads
+async def check_if_exists(user_profiles: Collection, dc_server_id: int, dc_user_id: int) -> schema.UserExists:
+    try:
+        profile = await archive.find_one(user_profiles, {"discord_server_id": dc_server_id,
+                                                         "discord_user_id": dc_user_id}, {"_id": 1})
         if profile:
             return schema.UserExists(exists=True)
         else:
@@ -20,17 +109,20 @@ async def check_if_exists(user_profiles: AgnosticCollection, dc_server_id: int,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def get_word_count(user_profiles: AgnosticCollection, dc_server_id: int, dc_user_id: int,
-                         word: str) -> schema.UserWordCount:
+@coalescing.reads
+async def get_word_count(user_profiles: Collection, server_profiles: Collection, dc_server_id: int,
+                         dc_user_id: int, word: str) -> schema.UserWordCount:
     try:
         projection = {f"words.{word}": 1, "_id": 0}
-        result = await user_profiles.find_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                              projection)
+        result = await _find_user(user_profiles, dc_server_id, dc_user_id, projection)
         if result:
-            if len(result["words"]) == 0:
+            words = result.get("words", {})
+            if word not in words:
+                if config.SPARSE_FLAGS and word in await crud_server.get_flag_set(server_profiles, dc_server_id):
+                    return schema.UserWordCount(words={word: 0})
                 raise DatabaseException("Key not found in the profile")
             else:
-                return schema.UserWordCount(**result)
+                return schema.UserWordCount(words={word: words[word]})
         else:
             raise DatabaseException("Profile not found")
 
@@ -38,28 +130,37 @@ async def get_word_count(user_profiles: AgnosticCollection, dc_server_id: int, d
         raise DatabaseException(f"Database error: {e}")
 
 
-async def get_profile(user_profiles: AgnosticCollection, dc_server_id: int, dc_user_id: int) -> schema.UserProfile:
+@coalescing.reads
+async def get_profile_document(user_profiles: Collection, server_profiles: Collection, dc_server_id: int,
+                               dc_user_id: int) -> dict:
     try:
-        projection = {f"_id": 0}
-        user = await user_profiles.find_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                            projection)
+        projection = {"_id": 0, **{name: 1 for name in schema.UserProfile.model_fields}}
+        user = await _find_user(user_profiles, dc_server_id, dc_user_id, projection)
         if user:
-            return schema.UserProfile(**user)
+            words = await _fill_flags(server_profiles, dc_server_id, user.get("words", {}))
+            return shape({**user, "words": words}, schema.UserProfile)
         else:
             raise DatabaseException("Profile not found")
 
+    except ValidationError as e:
+        raise DatabaseException(f"Error when processing stored data: {e.message}")
     except PyMongoError as e:
         raise DatabaseException(f"Database error: {e}")
 
 
-async def get_total_words(user_profiles: AgnosticCollection, dc_server_id: int,
+async def get_profile(user_profiles: Collection, server_profiles: Collection, dc_server_id: int,
+                      dc_user_id: int) -> schema.UserProfile:
+    return schema.UserProfile(**await get_profile_document(user_profiles, server_profiles, dc_server_id, dc_user_id))
+
+
+@coalescing.reads
+async def get_total_words(user_profiles: Collection, dc_server_id: int,
                           dc_user_id: int) -> schema.UserTotalWords:
     try:
         projection = {f"total_words": 1, "_id": 0}
-        result = await user_profiles.find_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                              projection)
+        result = await _find_user(user_profiles, dc_server_id, dc_user_id, projection)
         if result:
-            return schema.UserTotalWords(**result)
+            return schema.UserTotalWords(total_words=result["total_words"])
         else:
             raise DatabaseException("Profile not found")
 
@@ -67,14 +168,14 @@ async def get_total_words(user_profiles: AgnosticCollection, dc_server_id: int,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def get_total_flagged_words(user_profiles: AgnosticCollection, dc_server_id: int,
+@coalescing.reads
+async def get_total_flagged_words(user_profiles: Collection, dc_server_id: int,
                                   dc_user_id: int) -> schema.UserTotalFlaggedWords:
     try:
         projection = {f"total_flagged_words": 1, "_id": 0}
-        result = await user_profiles.find_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                              projection)
+        result = await _find_user(user_profiles, dc_server_id, dc_user_id, projection)
         if result:
-            return schema.UserTotalFlaggedWords(**result)
+            return schema.UserTotalFlaggedWords(total_flagged_words=result["total_flagged_words"])
         else:
             raise DatabaseException("Profile not found")
 
@@ -82,14 +183,14 @@ async def get_total_flagged_words(user_profiles: AgnosticCollection, dc_server_i
         raise DatabaseException(f"Database error: {e}")
 
 
-async def get_flagged_words(user_profiles: AgnosticCollection, dc_server_id: int,
-                            dc_user_id: int) -> schema.UserFlaggedWords:
+@coalescing.reads
+async def get_flagged_words_document(user_profiles: Collection, server_profiles: Collection,
+                                     dc_server_id: int, dc_user_id: int) -> dict:
     try:
         projection = {"words": 1, "_id": 0}
-        result = await user_profiles.find_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                              projection)
+        result = await _find_user(user_profiles, dc_server_id, dc_user_id, projection)
         if result:
-            return schema.UserFlaggedWords(**result)
+            return {"words": await _fill_flags(server_profiles, dc_server_id, result.get("words", {}))}
 
         else:
             raise DatabaseException("Profile not found")
@@ -98,20 +199,86 @@ async def get_flagged_words(user_profiles: AgnosticCollection, dc_server_id: int
         raise DatabaseException(f"Database error: {e}")
 
 
-async def create_profile(user_profiles: AgnosticCollection,
-                         server_profiles: AgnosticCollection,
+async def get_flagged_words(user_profiles: Collection, server_profiles: Collection,
+                            dc_server_id: int, dc_user_id: int) -> schema.UserFlaggedWords:
+    return schema.UserFlaggedWords(**await get_flagged_words_document(user_profiles, server_profiles,
+                                                                      dc_server_id, dc_user_id))
+
+
+@coalescing.reads
+async def check_if_multiple_exist(user_profiles: Collection, dc_server_id: int,
+                                  dc_user_ids: list[int]) -> schema.UserMultipleExists:
+    try:
+        found = set()
+        async for user in _find_members(user_profiles, dc_server_id, dc_user_ids, {"_id": 0, "discord_user_id": 1}):
+            found.add(user["discord_user_id"])
+
+        exists = {dc_user_id: dc_user_id in found for dc_user_id in dc_user_ids}
+        missing = [dc_user_id for dc_user_id, value in exists.items() if not value]
+        return schema.UserMultipleExists(exists=exists, missing=missing)
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+@coalescing.reads
+async def get_multiple_profiles(user_profiles: Collection, server_profiles: Collection,
+                                dc_server_id: int, dc_user_ids: list[int]) -> schema.UserMultipleProfiles:
+    try:
+        profiles = {}
+        async for user in _find_members(user_profiles, dc_server_id, dc_user_ids, {"_id": 0}):
+            user["words"] = await _fill_flags(server_profiles, dc_server_id, user.get("words", {}))
+            profiles[user["discord_user_id"]] = schema.UserProfile(**user)
+
+        missing = [dc_user_id for dc_user_id in dict.fromkeys(dc_user_ids) if dc_user_id not in profiles]
+        return schema.UserMultipleProfiles(profiles=profiles, missing=missing)
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+@coalescing.reads
+async def get_multiple_word_counts(user_profiles: Collection, server_profiles: Collection,
+                                   dc_server_id: int, dc_user_ids: list[int],
+                                   words: list[str]) -> schema.UserMultipleWordCounts:
+    if len(words) == 0:
+        raise DatabaseException("List of words must not be empty")
+
+    try:
+        flags = await crud_server.get_flag_set(server_profiles, dc_server_id) if config.SPARSE_FLAGS else frozenset()
+
+        projection = {"_id": 0, "discord_user_id": 1}
+        projection.update({f"words.{word}": 1 for word in words})
+
+        counts = {}
+        async for user in _find_members(user_profiles, dc_server_id, dc_user_ids, projection):
+            user_words = user.get("words", {})
+            counts[user["discord_user_id"]] = {word: user_words[word] if word in user_words else 0
+                                               for word in words if word in user_words or word in flags}
+
+        missing = [dc_user_id for dc_user_id in dict.fromkeys(dc_user_ids) if dc_user_id not in counts]
+        return schema.UserMultipleWordCounts(counts=counts, missing=missing)
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+@coalescing.writes
+async def create_profile(user_profiles: Collection,
+                         server_profiles: Collection,
                          dc_server_id: int,
                          dc_user_id: int) -> schema.UserCreateResult:
     try:
-        server = await server_profiles.find_one({"discord_server_id": dc_server_id})
-        if server:
-            flags = server.get("words")
-            for key in flags.keys():
-                flags[key] = 0
+        flag_sets = await crud_server.get_flag_sets(server_profiles, [dc_server_id])
+        if dc_server_id in flag_sets:
+            flags = {} if config.SPARSE_FLAGS else {key: 0 for key in flag_sets[dc_server_id]}
 
             profile = schema.UserProfile(discord_server_id=dc_server_id, discord_user_id=dc_user_id, words=flags)
 
-            result = await user_profiles.insert_one(profile.dict())
+            if archive.enabled():
+                # An archived profile is brought back so that the insert conflicts with it
+                await archive.restore(user_profiles, {dc_server_id: [dc_user_id]})
+            result = await user_profiles.insert_one(archive.initial(versions.initial(profile.dict())))
             if result:
                 return schema.UserCreateResult(success=True)
             else:
@@ -123,44 +290,41 @@ async def create_profile(user_profiles: AgnosticCollection,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def create_multiple_profiles(user_profiles: AgnosticCollection,
-                                   server_profiles: AgnosticCollection,
-                                   dc_server_id: int,
-                                   dc_user_ids: list[int]) -> schema.UserCreateMultipleResult:
-    try:
-        server = await server_profiles.find_one({"discord_server_id": dc_server_id})
-        if server:
-            flags = server.get("words")
-            for key in flags.keys():
-                flags[key] = 0
-
-            bulk_ops = [
-                pymongo.InsertOne(document=schema.UserProfile(discord_server_id=dc_server_id,
-                                                              discord_user_id=user_id,
-                                                              words=flags).dict())
-                for user_id in dc_user_ids]
+async def get_profile_template(server_profiles: Collection, dc_server_id: int) -> dict:
+    flag_sets = await crud_server.get_flag_sets(server_profiles, [dc_server_id])
+    if dc_server_id not in flag_sets:
+        raise DatabaseException("Server profile does not exist")
 
-            cursor = await user_profiles.bulk_write(bulk_ops, ordered=False)
+    flags = {} if config.SPARSE_FLAGS else {key: 0 for key in flag_sets[dc_server_id]}
+    # Validated once and shared by every inserted document, only discord_user_id differs
+    profile = schema.UserProfile(discord_server_id=dc_server_id, discord_user_id=1, words=flags)
+    return archive.initial(versions.initial(profile.dict()))
 
-            if cursor.inserted_count == len(dc_user_ids):
-                return schema.UserCreateMultipleResult(inserted_count=len(dc_user_ids),
-                                                       inserted=dc_user_ids, )
 
-        else:
-            raise DatabaseException("Server profile does not exist")
+@coalescing.writes
+async def insert_profiles(user_profiles: Collection,
+                          template: dict,
+                          dc_user_ids: list[int]) -> schema.UserCreateMultipleResult:
+    try:
+        if archive.enabled():
+            await archive.restore(user_profiles, {template["discord_server_id"]: dc_user_ids})
+        bulk_ops = [pymongo.InsertOne({**template, "discord_user_id": dc_user_id}) for dc_user_id in dc_user_ids]
+        await user_profiles.bulk_write(bulk_ops, ordered=False)
+        return schema.UserCreateMultipleResult(inserted_count=len(dc_user_ids), inserted=dc_user_ids)
 
     except BulkWriteError as bwe:
-        inserted = dc_user_ids
+        failed = set()
         conflicts = []
         errors = []
 
         for err in bwe.details["writeErrors"]:
-            inserted.remove(err["keyValue"]["discord_user_id"])
+            failed.add(err["index"])
             if err["code"] == 11000:
-                conflicts.append(err["keyValue"]["discord_user_id"])
+                conflicts.append(dc_user_ids[err["index"]])
             else:
                 errors.append(err["errmsg"])
 
+        inserted = [dc_user_id for index, dc_user_id in enumerate(dc_user_ids) if index not in failed]
         return schema.UserCreateMultipleResult(inserted_count=len(inserted),
                                                conflicts_count=len(conflicts),
                                                unhandled_errors=len(errors),
@@ -172,8 +336,63 @@ async def create_multiple_profiles(user_profiles: AgnosticCollection,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def flag_words(server_profiles: AgnosticCollection,
-                     user_profiles: AgnosticCollection,
+async def create_multiple_profiles(user_profiles: Collection,
+                                   server_profiles: Collection,
+                                   dc_server_id: int,
+                                   dc_user_ids: list[int]) -> schema.UserCreateMultipleResult:
+    try:
+        template = await get_profile_template(server_profiles, dc_server_id)
+        return await insert_profiles(user_profiles, template, dc_user_ids)
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+async def onboard_profiles(user_profiles: Collection,
+                           template: dict,
+                           batches: AsyncIterator[tuple[list[int], list[str]]],
+                           concurrency: int) -> AsyncIterator[schema.UserOnboardProgress]:
+    progress = schema.UserOnboardProgress()
+    pending: dict[asyncio.Task, list[str]] = {}
+
+    def report(task: asyncio.Task, invalid: list[str]) -> schema.UserOnboardProgress:
+        result = task.result()
+        progress.inserted_count = progress.inserted_count + result.inserted_count
+        progress.conflicts_count = progress.conflicts_count + result.conflicts_count
+        progress.unhandled_errors = progress.unhandled_errors + result.unhandled_errors
+        progress.invalid_count = progress.invalid_count + len(invalid)
+        return progress.model_copy(update={"conflicts": result.conflicts, "errors": result.errors, "invalid": invalid})
+
+    try:
+        async for dc_user_ids, invalid in batches:
+            progress.received = progress.received + len(dc_user_ids) + len(invalid)
+            if len(dc_user_ids) == 0:
+                # A batch of only invalid entries has nothing to insert, and an empty bulk_write is rejected
+                progress.invalid_count = progress.invalid_count + len(invalid)
+                yield progress.model_copy(update={"conflicts": [], "errors": [], "invalid": invalid})
+                continue
+            pending[asyncio.create_task(insert_profiles(user_profiles, template, dc_user_ids))] = invalid
+
+            if len(pending) >= concurrency:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield report(task, pending.pop(task))
+
+        while len(pending) > 0:
+            done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield report(task, pending.pop(task))
+
+        yield progress.model_copy(update={"done": True})
+
+    finally:
+        for task in pending.keys():
+            task.cancel()
+
+
+@coalescing.writes
+async def flag_words(server_profiles: Collection,
+                     user_profiles: Collection,
                      dc_server_id: int,
                      words: list[str]) -> schema.UserFlagWordsResult:
     if len(words) == 0:
@@ -197,7 +416,10 @@ async def flag_words(server_profiles: AgnosticCollection,
         if len(query) == 0:
             raise DatabaseException("Provided data already exists in the server profile")
 
-        await user_profiles.update_many({"discord_server_id": dc_server_id}, {"$set": query})
+        if not config.SPARSE_FLAGS:
+            await user_profiles.update_many({"discord_server_id": dc_server_id}, _flag_pipeline(flagged))
+            user_cache.cache.invalidate_server(dc_server_id)
+            await flag_archived_members(user_profiles, dc_server_id, flagged)
 
         return schema.UserFlagWordsResult(flagged_count=len(flagged),
                                           conflicts_count=len(conflicts),
@@ -210,60 +432,139 @@ async def flag_words(server_profiles: AgnosticCollection,
         raise DatabaseException(f"Error when processing the request: {e}")
 
 
-async def unflag_words(user_profiles: AgnosticCollection,
+@coalescing.writes
+async def unflag_words(server_profiles: Collection,
+                       user_profiles: Collection,
                        dc_server_id: int,
                        words: list[str]) -> schema.UserUnflagWordsResult:
     if len(words) == 0:
         raise DatabaseException("List of words must not be empty")
 
     try:
-        bulk_ops = []
-        input_words = [validate_and_transform(word) for word in words]
+        input_words = list(dict.fromkeys(validate_and_transform(word) for word in words))
 
-        unflagged = []
-        ignored = []
+        # Member counters of a word are only dropped once the server no longer flags it
+        flags = await crud_server.get_flag_set(server_profiles, dc_server_id)
+        unflagged = [word for word in input_words if word not in flags]
+        ignored = [word for word in input_words if word in flags]
 
-        async for user in user_profiles.find({"discord_server_id": dc_server_id}):
-            flags = user.get("words")
-            unset_data = {}
-            flagged_count_remove = 0
+        if len(unflagged) > 0:
+            await user_profiles.update_many({"discord_server_id": dc_server_id}, _unflag_pipeline(unflagged))
+            user_cache.cache.invalidate_server(dc_server_id)
+            await unflag_archived_members(user_profiles, dc_server_id, unflagged)
 
-            for del_word in input_words:
-                if del_word in flags.keys():
-                    unset_data.update({f"words.{del_word}": 0})
-                    flagged_count_remove = flagged_count_remove + flags[del_word]
-                    unflagged.append(del_word)
-                else:
-                    ignored.append(del_word)
+        return schema.UserUnflagWordsResult(unflagged_count=len(unflagged),
+                                            ignored_count=len(ignored),
+                                            unflagged=unflagged,
+                                            ignored=ignored)
 
-            inc_data = {"total_flagged_words": flagged_count_remove * -1}
+    except ValidationError as e:
+        raise DatabaseException(f"Error when processing input data: {e}")
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
 
-            bulk_ops.append(pymongo.UpdateOne(
-                filter={"discord_server_id": dc_server_id, "discord_user_id": user["discord_user_id"]},
-                update={"$unset": unset_data, "$inc": inc_data}
-            ))
 
-        result = await user_profiles.bulk_write(bulk_ops)
-        if result:
-            return schema.UserUnflagWordsResult(unflagged_count=len(unflagged),
-                                                ignored_count=len(ignored),
-                                                unflagged=unflagged,
-                                                ignored=ignored)
+@coalescing.writes
+async def flag_members(user_profiles: Collection,
+                       dc_server_id: int,
+                       dc_user_ids: list[int],
+                       words: list[str]) -> int:
+    try:
+        result = await user_profiles.update_many({"discord_server_id": dc_server_id,
+                                                  "discord_user_id": {"$in": dc_user_ids}},
+                                                 _flag_pipeline(words))
+        return result.matched_count
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
+    finally:
+        for dc_user_id in dc_user_ids:
+            user_cache.cache.invalidate(dc_server_id, dc_user_id)
+
+
+@coalescing.writes
+async def unflag_members(user_profiles: Collection,
+                         dc_server_id: int,
+                         dc_user_ids: list[int],
+                         words: list[str]) -> int:
+    try:
+        result = await user_profiles.update_many({"discord_server_id": dc_server_id,
+                                                  "discord_user_id": {"$in": dc_user_ids}},
+                                                 _unflag_pipeline(words))
+        return result.matched_count
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
+    finally:
+        for dc_user_id in dc_user_ids:
+            user_cache.cache.invalidate(dc_server_id, dc_user_id)
+
+
+@coalescing.writes
+async def flag_archived_members(user_profiles: Collection, dc_server_id: int, words: list[str]) -> int:
+    if not archive.enabled():
+        return 0
+
+    try:
+        # Archived profiles are cold, so they are updated in a single write
+        result = await archive.archive_collection(user_profiles).update_many({"discord_server_id": dc_server_id},
+                                                                             _flag_pipeline(words))
+        return result.matched_count
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
+    finally:
+        user_cache.cache.invalidate_server(dc_server_id)
+
+
+@coalescing.writes
+async def unflag_archived_members(user_profiles: Collection, dc_server_id: int, words: list[str]) -> int:
+    if not archive.enabled():
+        return 0
+
+    try:
+        result = await archive.archive_collection(user_profiles).update_many({"discord_server_id": dc_server_id},
+                                                                             _unflag_pipeline(words))
+        return result.matched_count
 
-    except ValidationError as e:
-        raise DatabaseException(f"Error when processing input data: {e}")
     except PyMongoError as e:
         raise DatabaseException(f"Error when processing the request: {e}")
+    finally:
+        user_cache.cache.invalidate_server(dc_server_id)
 
 
-async def update_total_words_count(user_profiles: AgnosticCollection,
+@coalescing.writes
+async def remove_members(user_profiles: Collection, dc_server_id: int, dc_user_ids: list[int] | None = None) -> int:
+    query = {"discord_server_id": dc_server_id}
+    if dc_user_ids is not None:
+        query.update({"discord_user_id": {"$in": dc_user_ids}})
+
+    try:
+        result = await user_profiles.delete_many(query)
+        if dc_user_ids is None and archive.enabled():
+            archived = await archive.archive_collection(user_profiles).delete_many(query)
+            return result.deleted_count + archived.deleted_count
+        return result.deleted_count
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
+    finally:
+        if dc_user_ids is None:
+            user_cache.cache.invalidate_server(dc_server_id)
+        else:
+            for dc_user_id in dc_user_ids:
+                user_cache.cache.invalidate(dc_server_id, dc_user_id)
+
+
+@coalescing.writes
+async def update_total_words_count(user_profiles: Collection,
                                    dc_server_id: int,
                                    dc_user_id: int,
                                    difference: int) -> schema.UserUpdateTotalWordsResult:
     try:
-        query = {"$inc": {"total_words": difference}}
-        users_result = user_profiles.update_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                                update=query)
+        query = versions.bump({"$inc": {"total_words": difference}})
+        users_result = await _update_user(user_profiles, dc_server_id, dc_user_id, query)
+        user_cache.cache.invalidate(dc_server_id, dc_user_id)
         if users_result:
             return schema.UserUpdateTotalWordsResult(success=True)
 
@@ -271,75 +572,224 @@ async def update_total_words_count(user_profiles: AgnosticCollection,
         raise DatabaseException(f"Database error: {e}")
 
 
-async def update_flags(user_profiles: AgnosticCollection,
+@coalescing.writes
+async def update_flags(user_profiles: Collection,
+                       server_profiles: Collection,
                        dc_server_id: int,
                        dc_user_id: int,
                        data: dict[str, int]) -> schema.UserUpdateFlagsResult:
     try:
-        flags = await get_flagged_words(user_profiles, dc_server_id, dc_user_id)
+        flags = await crud_server.get_flag_set(server_profiles, dc_server_id)
 
         inc_data = {}
         total_count = 0
         for key, val in data.items():
-            if key in flags.words.keys():
+            if key in flags:
                 total_count = total_count + val
                 inc_data.update({f"words.{key}": val})
 
         inc_data.update({"total_flagged_words": total_count})
-        query = {"$inc": inc_data}
-        users_result = user_profiles.update_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                                update=query)
-        if users_result:
-            return schema.UserUpdateFlagsResult(success=True)
+        query = versions.bump({"$inc": inc_data})
+        users_result = await _update_user(user_profiles, dc_server_id, dc_user_id, query)
+        user_cache.cache.invalidate(dc_server_id, dc_user_id)
+        if users_result.matched_count == 0:
+            raise DatabaseException("Profile not found")
+
+        return schema.UserUpdateFlagsResult(success=True)
 
     except PyMongoError as e:
         raise DatabaseException(f"Database error: {e}")
 
 
-async def set_data(user_profiles: AgnosticCollection,
+@coalescing.writes
+async def set_data(user_profiles: Collection,
+                   server_profiles: Collection,
                    dc_server_id: int,
                    dc_user_id: int,
                    total_words: int,
                    data: dict[str, int]) -> schema.UserSetDataResult:
     try:
-        flags = await get_flagged_words(user_profiles, dc_server_id, dc_user_id)
+        flags = await crud_server.get_flag_set(server_profiles, dc_server_id)
 
         new_data = {}
         total_count = 0
         for key, val in data.items():
-            if key in flags.words.keys():
+            if key in flags:
                 total_count = total_count + val
                 new_data.update({f"words.{key}": val})
 
         new_data.update({"total_flagged_words": total_count})
         new_data.update({"total_words": total_words})
 
-        query = {"$set": new_data}
-        users_result = user_profiles.update_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
-                                                update=query)
-        if users_result:
-            return schema.UserSetDataResult(success=True)
+        query = versions.bump({"$set": new_data})
+        users_result = await _update_user(user_profiles, dc_server_id, dc_user_id, query)
+        user_cache.cache.invalidate(dc_server_id, dc_user_id)
+        if users_result.matched_count == 0:
+            raise DatabaseException("Profile not found")
+
+        return schema.UserSetDataResult(success=True)
 
     except PyMongoError as e:
         raise DatabaseException(f"Database error: {e}")
 
 
-async def remove_user(server_profiles: AgnosticCollection,
-                      user_profiles: AgnosticCollection,
+@coalescing.writes
+async def remove_user(server_profiles: Collection,
+                      user_profiles: Collection,
                       dc_server_id: int,
                       dc_user_id: int) -> schema.UserRemoveResult:
     try:
-        user_profile = await get_profile(user_profiles, dc_server_id, dc_user_id)
+        # The counters removed from the server must come from the stored profile, not a cached copy
+        user_cache.cache.invalidate(dc_server_id, dc_user_id)
+        user_profile = await get_profile(user_profiles, server_profiles, dc_server_id, dc_user_id)
         await user_profiles.delete_one({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id})
+        if archive.enabled():
+            await archive.archive_collection(user_profiles).delete_one({"discord_server_id": dc_server_id,
+                                                                        "discord_user_id": dc_user_id})
+        user_cache.cache.invalidate(dc_server_id, dc_user_id)
 
         flags_update = user_profile.words.copy()
         for key, value in flags_update.items():
             flags_update[key] = value * -1
 
-        await crud_server.update_total_words_count(server_profiles, dc_server_id, user_profile.total_words * -1)
-        await crud_server.update_flags(server_profiles, dc_server_id, flags_update)
+        await crud_server.update_total_words_count(server_profiles, dc_server_id, user_profile.total_words * -1,
+                                                   dc_user_id)
+        await crud_server.update_flags(server_profiles, dc_server_id, flags_update, dc_user_id)
 
         return schema.UserRemoveResult(success=True)
 
     except PyMongoError as e:
         raise DatabaseException(f"Database error: {e}")
+
+
+@coalescing.writes
+async def ingest(user_profiles: Collection,
+                 server_profiles: Collection,
+                 events: list[schema.UserIngestEvent]) -> schema.UserIngestResult:
+    try:
+        errors: dict[int, str] = {}
+
+        dc_server_ids = {event.dc_server_id for event in events}
+        flag_sets = await crud_server.get_flag_sets(server_profiles, dc_server_ids)
+
+        members: dict[int, list[int]] = {}
+        for event in events:
+            if event.dc_server_id in flag_sets:
+                members.setdefault(event.dc_server_id, []).append(event.dc_user_id)
+
+        existing = set()
+        if len(members) > 0:
+            query = {"$or": [{"discord_server_id": dc_server_id, "discord_user_id": {"$in": dc_user_ids}}
+                             for dc_server_id, dc_user_ids in members.items()]}
+            projection = {"_id": 0, "discord_server_id": 1, "discord_user_id": 1}
+            async for user in user_profiles.find(query, projection):
+                existing.add((user["discord_server_id"], user["discord_user_id"]))
+
+            if archive.enabled():
+                missing: dict[int, list[int]] = {}
+                for dc_server_id, dc_user_ids in members.items():
+                    for dc_user_id in dc_user_ids:
+                        if (dc_server_id, dc_user_id) not in existing:
+                            missing.setdefault(dc_server_id, []).append(dc_user_id)
+                existing.update(await archive.restore(user_profiles, missing))
+
+        user_events: dict[tuple[int, int], list[int]] = {}
+        user_deltas: dict[tuple[int, int], dict] = {}
+        server_events: dict[int, list[int]] = {}
+        server_deltas: dict[int, dict] = {}
+
+        for index, event in enumerate(events):
+            if event.dc_server_id not in flag_sets:
+                errors[index] = "Server profile does not exist"
+                continue
+            if (event.dc_server_id, event.dc_user_id) not in existing:
+                errors[index] = "Profile not found"
+                continue
+            try:
+                check_int64(event.total_words_delta)
+                for val in event.flags.values():
+                    check_int64(val)
+            except OverflowError as e:
+                errors[index] = str(e)
+                continue
+
+            user_key = (event.dc_server_id, event.dc_user_id)
+            for key, events_map, deltas in ((user_key, user_events, user_deltas),
+                                            (event.dc_server_id, server_events, server_deltas)):
+                events_map.setdefault(key, []).append(index)
+                delta = deltas.setdefault(key, {"total_words": 0, "words": {}})
+                delta["total_words"] = delta["total_words"] + event.total_words_delta
+                for word, val in event.flags.items():
+                    delta["words"][word] = delta["words"].get(word, 0) + val
+
+        user_ops, user_op_events = [], []
+        for (dc_server_id, dc_user_id), delta in user_deltas.items():
+            inc_data = build_increment(flag_sets[dc_server_id], delta["total_words"], delta["words"])
+            if len(inc_data) > 0:
+                user_ops.append(pymongo.UpdateOne({"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
+                                                  archive.touch(versions.bump({"$inc": inc_data}))))
+                user_op_events.append(user_events[(dc_server_id, dc_user_id)])
+
+        server_ops, server_op_events = [], []
+        for dc_server_id, delta in server_deltas.items():
+            inc_data = build_increment(flag_sets[dc_server_id], delta["total_words"], delta["words"])
+            if len(inc_data) > 0:
+                if server_counters.enabled():
+                    # A delta of a single member goes to that member's shard when shards are picked by user
+                    dc_user_ids = {events[index].dc_user_id for index in server_events[dc_server_id]}
+                    dc_user_id = next(iter(dc_user_ids)) if len(dc_user_ids) == 1 else None
+                    server_ops.append(server_counters.increment_op(dc_server_id, inc_data, dc_user_id))
+                else:
+                    server_ops.append(pymongo.UpdateOne({"discord_server_id": dc_server_id},
+                                                        versions.bump({"$inc": inc_data})))
+                server_op_events.append(server_events[dc_server_id])
+
+        server_collection = server_profiles
+        if server_counters.enabled():
+            server_collection = server_counters.shards_collection(server_profiles)
+
+        for collection, ops, op_events in ((user_profiles, user_ops, user_op_events),
+                                           (server_collection, server_ops, server_op_events)):
+            if len(ops) == 0:
+                continue
+            try:
+                await collection.bulk_write(ops, ordered=False)
+            except BulkWriteError as bwe:
+                for err in bwe.details["writeErrors"]:
+                    for index in op_events[err["index"]]:
+                        errors.setdefault(index, err["errmsg"])
+            finally:
+                if collection is user_profiles:
+                    for dc_server_id, dc_user_id in user_deltas.keys():
+                        user_cache.cache.invalidate(dc_server_id, dc_user_id)
+
+        results = [schema.UserIngestEventResult(success=index not in errors, error=errors.get(index))
+                   for index in range(len(events))]
+        return schema.UserIngestResult(success_count=len(events) - len(errors),
+                                       failure_count=len(errors),
+                                       results=results)
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
+
+
+async def match_messages(server_profiles: Collection,
+                         dc_server_id: int,
+                         messages: list[str],
+                         count_total_words: bool = True) -> schema.UserMessagesMatch:
+    try:
+        flag_set = await crud_server.get_flag_set(server_profiles, dc_server_id)
+        automaton = matcher.cache.get(dc_server_id, flag_set)
+
+        total_words = 0
+        flags: dict[str, int] = {}
+        for message in messages:
+            text = message.lower()
+            automaton.match(text, flags)
+            if count_total_words:
+                total_words = total_words + matcher.count_words(text)
+
+        return schema.UserMessagesMatch(total_words=total_words, flags=flags)
+
+    except PyMongoError as e:
+        raise DatabaseException(f"Database error: {e}")
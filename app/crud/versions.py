@@ -0,0 +1,15 @@
+FIELD = "version"
+
+PIPELINE_BUMP = {"$set": {FIELD: {"$add": [{"$ifNull": [f"${FIELD}", 0]}, 1]}}}
+
+
+def bump(update: dict) -> dict:
+    return {**update, "$inc": {**update.get("$inc", {}), FIELD: 1}}
+
+
+def initial(document: dict) -> dict:
+    return {**document, FIELD: 1}
+
+
+def etag(*parts) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
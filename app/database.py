@@ -1,23 +1,46 @@
-from motor.core import AgnosticCollection, AgnosticDatabase
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import dotenv_values
-import os
+import time
 
-client: AgnosticCollection = ...
-database: AgnosticDatabase = ...
-users: AgnosticCollection = ...
-servers: AgnosticCollection = ...
+from app import config, indexes, metrics
+from app.storage.base import Client, Collection, Database
+from app.storage.memory import MemoryClient
+
+client: Client = ...
+database: Database = ...
+users: Collection = ...
+servers: Collection = ...
+jobs: Collection = ...
+
+
+def create_client() -> Client:
+    if config.STORAGE_BACKEND == "memory":
+        return MemoryClient()
+    return AsyncIOMotorClient(config.MONGO.uri, event_listeners=[metrics.command_listener, metrics.pool_listener],
+                              **config.MONGO.client_kwargs())
 
 
 async def connect():
-    global client, database, users, servers
+    global client, database, users, servers, jobs
 
-    client = AsyncIOMotorClient(os.environ.get('URI'))
-    database = client[os.environ.get('NAME')]
+    client = create_client()
+    database = client[config.MONGO.name]
     # client = AsyncIOMotorClient(dotenv_values(".env").get("URI"))
     # database = client[dotenv_values(".env").get("NAME")]
     users = database["user_profiles"]
     servers = database["server_profiles"]
+    jobs = database["jobs"]
+
+    if config.MONGO.warmup:
+        await database.command("ping")
+
+    await indexes.startup(database)
+
+
+async def ping() -> float:
+    start = time.perf_counter()
+    await database.command("ping")
+    return time.perf_counter() - start
 
 
 async def close():
@@ -0,0 +1,24 @@
+from fastapi import status, APIRouter
+from fastapi.responses import JSONResponse
+from pymongo.errors import PyMongoError
+from app import config, database, metrics
+
+router = APIRouter()
+
+
+@router.get("/health")
+async def health():
+    body = {"status": "ok", "backend": config.STORAGE_BACKEND}
+    if config.STORAGE_BACKEND != "memory":
+        body["pool"] = {"max_pool_size": config.MONGO.max_pool_size,
+                        "min_pool_size": config.MONGO.min_pool_size,
+                        "servers": metrics.pool_listener.state()}
+
+    try:
+        body["ping_ms"] = await database.ping() * 1000
+    except PyMongoError as e:
+        body["status"] = "unavailable"
+        body["error"] = str(e)
+        return JSONResponse(body, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return body
@@ -0,0 +1,16 @@
+from fastapi import HTTPException, status, APIRouter
+from app import database
+from app.Exceptions.database_exceptions import DatabaseException
+from app.crud import jobs
+from app.schemas import job_schemas as model
+
+router = APIRouter()
+
+
+@router.get("/{job_id}", response_model=model.Job)
+async def get_job(job_id: str):
+    try:
+        return await jobs.get_job(database.jobs, job_id)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
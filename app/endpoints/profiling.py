@@ -0,0 +1,19 @@
+from fastapi import HTTPException, status, APIRouter
+from fastapi.responses import PlainTextResponse
+from app import profiling
+
+router = APIRouter()
+
+
+@router.get("/profiles")
+async def list_profiles():
+    return [profile.summary() for profile in profiling.store.list()]
+
+
+@router.get("/profiles/{id}", response_class=PlainTextResponse)
+async def get_profile(id: int):
+    profile = profiling.store.get(id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+
+    return PlainTextResponse(profile.folded())
@@ -1,10 +1,13 @@
-from fastapi import HTTPException, status, APIRouter
-from app import database
+from datetime import timedelta
+
+from fastapi import HTTPException, status, APIRouter, Header, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from app import config, database, jobs
 from app.Exceptions.database_exceptions import DatabaseException
-from app.crud import servers as server
+from app.crud import jobs as crud_jobs, servers as server
 from app.crud import users as users
 from app.schemas import server_schemas as model
-from app.utility import RESERVED_KEYS
+from app.utility import RESERVED_KEYS, check_int64, etag_matches
 
 router = APIRouter()
 
@@ -37,8 +40,19 @@ async def get_word_count(dc_server_id: int, word: str):
 
 
 @router.get("/get_profile", response_model=model.ServerProfile)
-async def get_profile(dc_server_id: int):
+async def get_profile(dc_server_id: int,
+                      response: Response,
+                      if_none_match: str | None = Header(default=None)):
     try:
+        etag = await server.get_etag(database.servers, dc_server_id)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        if config.FAST_RESPONSES:
+            document = await server.get_profile_document(database.servers, dc_server_id)
+            return ORJSONResponse(document, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
         return await server.get_profile(database.servers, dc_server_id)
 
     except DatabaseException as e:
@@ -70,8 +84,19 @@ async def get_total_flagged_words(dc_server_id: int):
 
 
 @router.get("/get_flagged_words", response_model=model.ServerFlaggedWords)
-async def get_flagged_words(dc_server_id: int):
+async def get_flagged_words(dc_server_id: int,
+                            response: Response,
+                            if_none_match: str | None = Header(default=None)):
     try:
+        etag = await server.get_etag(database.servers, dc_server_id)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        if config.FAST_RESPONSES:
+            document = await server.get_flagged_words_document(database.servers, dc_server_id)
+            return ORJSONResponse(document, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
         return await server.get_flagged_words(database.servers, dc_server_id)
 
     except DatabaseException as e:
@@ -91,10 +116,17 @@ async def create_profile(dc_server_id: int):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
 
 
-@router.patch("/flag_words", response_model=model.ServerFlagWordsResult)
-async def flag_words(dc_server_id: int, words: list[str]):
+@router.patch("/flag_words", response_model=model.ServerFlagWordsResult, response_model_exclude_none=True)
+async def flag_words(dc_server_id: int, words: list[str], response: Response, background: bool = False):
     try:
         res_server = await server.flag_words(database.servers, dc_server_id, words)
+        if background:
+            if not config.SPARSE_FLAGS:
+                job = await jobs.submit("flag_words", dc_server_id, {"words": res_server.flagged})
+                res_server.job_id = str(job["_id"])
+                response.status_code = status.HTTP_202_ACCEPTED
+            return res_server
+
         res_users = await users.flag_words(database.servers, database.users, dc_server_id, words)
 
         if res_server and res_users:
@@ -106,11 +138,17 @@ async def flag_words(dc_server_id: int, words: list[str]):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
 
 
-@router.patch("/unflag_words", response_model=model.ServerUnflagWordsResult)
-async def unflag_words(dc_server_id: int, words: list[str]):
+@router.patch("/unflag_words", response_model=model.ServerUnflagWordsResult, response_model_exclude_none=True)
+async def unflag_words(dc_server_id: int, words: list[str], response: Response, background: bool = False):
     try:
         res_server = await server.unflag_words(database.servers, dc_server_id, words)
-        res_users = await users.unflag_words(database.users, dc_server_id, words)
+        if background:
+            job = await jobs.submit("unflag_words", dc_server_id, {"words": res_server.unflagged})
+            res_server.job_id = str(job["_id"])
+            response.status_code = status.HTTP_202_ACCEPTED
+            return res_server
+
+        res_users = await users.unflag_words(database.servers, database.users, dc_server_id, words)
 
         if res_server and res_users:
             return res_server
@@ -122,9 +160,65 @@ async def unflag_words(dc_server_id: int, words: list[str]):
 
 
 @router.get("/get_members_ids", response_model=model.ServerGetMembersIds)
-async def get_members_ids(dc_server_id: int):
+async def get_members_ids(dc_server_id: int, after_id: int | None = None, limit: int | None = None):
+    try:
+        return await server.get_members_ids(database.users, dc_server_id, after_id, limit)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
+@router.get("/stream_members_ids")
+async def stream_members_ids(dc_server_id: int, after_id: int | None = None):
+    async def lines():
+        async for dc_user_id in server.iter_members_ids(database.users, dc_server_id, after_id):
+            yield f'{{"id": "{dc_user_id}"}}\n'
+
     try:
-        return await server.get_members_ids(database.users, dc_server_id)
+        check_int64(dc_server_id)
+        if after_id is not None:
+            check_int64(after_id)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.delete("/remove_profile", response_model=model.ServerRemoveResult, status_code=status.HTTP_202_ACCEPTED)
+async def remove_profile(dc_server_id: int, grace_period: float | None = Query(default=None, ge=0)):
+    if grace_period is None:
+        grace_period = config.SERVER_REMOVAL_GRACE_PERIOD
+
+    try:
+        check_int64(dc_server_id)
+        delete_after = crud_jobs.now() + timedelta(seconds=grace_period)
+        await server.schedule_removal(database.servers, dc_server_id, delete_after)
+        try:
+            job = await jobs.submit("remove_server", dc_server_id, {}, run_after=delete_after)
+        except DatabaseException:
+            await server.cancel_removal(database.servers, dc_server_id)
+            raise
+        await server.set_removal_job(database.servers, dc_server_id, job["_id"])
+
+        return model.ServerRemoveResult(job_id=str(job["_id"]), delete_after=delete_after)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
+@router.post("/restore_profile", response_model=model.ServerRestoreResult)
+async def restore_profile(dc_server_id: int):
+    try:
+        pending_removal = await server.get_pending_removal(database.servers, dc_server_id)
+        if pending_removal["job_id"] is None or not await crud_jobs.cancel(database.jobs, pending_removal["job_id"]):
+            raise DatabaseException("Server removal has already started")
+        await server.cancel_removal(database.servers, dc_server_id)
+
+        return model.ServerRestoreResult(restored=True)
 
     except DatabaseException as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
@@ -1,10 +1,12 @@
-from fastapi import HTTPException, status, APIRouter
-from app import database
+from fastapi import HTTPException, status, APIRouter, Header, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+from app import config, database, jobs, write_buffer
 from app.Exceptions.database_exceptions import DatabaseException
-from app.crud import servers as server
+from app.crud import archive, jobs as crud_jobs, servers as server
 from app.crud import users as user
 from app.schemas import user_schemas as model
-from app.utility import RESERVED_KEYS
+from app.utility import RESERVED_KEYS, DuplexStreamingResponse, check_int64, etag_matches, \
+    iter_id_batches
 
 router = APIRouter()
 
@@ -28,7 +30,7 @@ async def get_word_count(dc_server_id: int, dc_user_id: int, word: str):
         raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail="Cannot get reserved keys. Use dedicated request instead")
 
     try:
-        return await user.get_word_count(database.users, dc_server_id, dc_user_id, word)
+        return await user.get_word_count(database.users, database.servers, dc_server_id, dc_user_id, word)
 
     except DatabaseException as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
@@ -37,9 +39,20 @@ async def get_word_count(dc_server_id: int, dc_user_id: int, word: str):
 
 
 @router.get("/get_profile", response_model=model.UserProfile)
-async def get_profile(dc_server_id: int, dc_user_id: int):
+async def get_profile(dc_server_id: int, dc_user_id: int,
+                      response: Response,
+                      if_none_match: str | None = Header(default=None)):
     try:
-        return await user.get_profile(database.users, dc_server_id, dc_user_id)
+        etag = await user.get_etag(database.users, database.servers, dc_server_id, dc_user_id)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        if config.FAST_RESPONSES:
+            document = await user.get_profile_document(database.users, database.servers, dc_server_id, dc_user_id)
+            return ORJSONResponse(document, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
+        return await user.get_profile(database.users, database.servers, dc_server_id, dc_user_id)
 
     except DatabaseException as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
@@ -70,9 +83,57 @@ async def get_total_flagged_words(dc_server_id: int, dc_user_id: int):
 
 
 @router.get("/get_flagged_words", response_model=model.UserFlaggedWords)
-async def get_flagged_words(dc_server_id: int, dc_user_id: int):
+async def get_flagged_words(dc_server_id: int, dc_user_id: int,
+                            response: Response,
+                            if_none_match: str | None = Header(default=None)):
+    try:
+        etag = await user.get_etag(database.users, database.servers, dc_server_id, dc_user_id)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        if config.FAST_RESPONSES:
+            document = await user.get_flagged_words_document(database.users, database.servers, dc_server_id, dc_user_id)
+            return ORJSONResponse(document, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
+        return await user.get_flagged_words(database.users, database.servers, dc_server_id, dc_user_id)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
+@router.post("/check_if_multiple_exist", response_model=model.UserMultipleExists)
+async def check_if_multiple_exist(dc_server_id: int, dc_user_ids: list[int]):
     try:
-        return await user.get_flagged_words(database.users, dc_server_id, dc_user_id)
+        return await user.check_if_multiple_exist(database.users, dc_server_id, dc_user_ids)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
+@router.post("/get_multiple_profiles", response_model=model.UserMultipleProfiles)
+async def get_multiple_profiles(dc_server_id: int, dc_user_ids: list[int]):
+    try:
+        return await user.get_multiple_profiles(database.users, database.servers, dc_server_id, dc_user_ids)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
+@router.post("/get_multiple_word_counts", response_model=model.UserMultipleWordCounts)
+async def get_multiple_word_counts(dc_server_id: int, dc_user_ids: list[int], words: list[str]):
+    for word in words:
+        if word in RESERVED_KEYS:
+            raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail="Cannot get reserved keys. Use dedicated request instead")
+
+    try:
+        return await user.get_multiple_word_counts(database.users, database.servers, dc_server_id, dc_user_ids, words)
 
     except DatabaseException as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
@@ -102,11 +163,40 @@ async def create_multiple_profiles(dc_server_id: int, dc_user_ids: list[int]):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
 
 
+@router.post("/onboard")
+async def onboard(dc_server_id: int, request: Request, chunk_size: int | None = None, concurrency: int | None = None):
+    chunk_size = min(chunk_size or config.ONBOARD_CHUNK_SIZE, config.ONBOARD_CHUNK_SIZE)
+    concurrency = min(concurrency or config.ONBOARD_CONCURRENCY, config.ONBOARD_CONCURRENCY)
+
+    try:
+        check_int64(dc_server_id)
+        template = await user.get_profile_template(database.servers, dc_server_id)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+    async def lines():
+        batches = iter_id_batches(request.stream(), max(1, chunk_size))
+        try:
+            async for progress in user.onboard_profiles(database.users, template, batches, max(1, concurrency)):
+                yield progress.model_dump_json() + "\n"
+        except DatabaseException as e:
+            yield model.UserOnboardProgress(done=True, error=e.message).model_dump_json() + "\n"
+
+    return DuplexStreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.put("/update_user_flags", response_model=model.UserUpdateFlagsResult)
 async def update_user_flags(dc_server_id: int, dc_user_id: int, data: dict[str, int]):
     try:
-        res_server = await server.update_flags(database.servers, dc_server_id, data)
-        res_user = await user.update_flags(database.users, dc_server_id, dc_user_id, data)
+        if write_buffer.buffer is not None:
+            await write_buffer.buffer.add_flags(dc_server_id, dc_user_id, data)
+            return model.UserUpdateFlagsResult(success=True)
+
+        res_server = await server.update_flags(database.servers, dc_server_id, data, dc_user_id)
+        res_user = await user.update_flags(database.users, database.servers, dc_server_id, dc_user_id, data)
         if res_user and res_server:
             return model.UserUpdateFlagsResult(success=True)
 
@@ -119,7 +209,11 @@ async def update_user_flags(dc_server_id: int, dc_user_id: int, data: dict[str,
 @router.put("/update_user_total_words", response_model=model.UserUpdateTotalWordsResult)
 async def update_user_total_words(dc_server_id: int, dc_user_id: int, count: int):
     try:
-        res_server = await server.update_total_words_count(database.servers, dc_server_id, count)
+        if write_buffer.buffer is not None:
+            await write_buffer.buffer.add_total_words(dc_server_id, dc_user_id, count)
+            return model.UserUpdateTotalWordsResult(success=True)
+
+        res_server = await server.update_total_words_count(database.servers, dc_server_id, count, dc_user_id)
         res_user = await user.update_total_words_count(database.users, dc_server_id, dc_user_id, count)
         if res_user and res_server:
             return model.UserUpdateTotalWordsResult(success=True)
@@ -130,10 +224,44 @@ async def update_user_total_words(dc_server_id: int, dc_user_id: int, count: int
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
 
 
+@router.post("/ingest", response_model=model.UserIngestResult)
+async def ingest(events: list[model.UserIngestEvent]):
+    try:
+        return await user.ingest(database.users, database.servers, events)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
+@router.post("/ingest_messages", response_model=model.UserIngestMessagesResult)
+async def ingest_messages(dc_server_id: int, dc_user_id: int, messages: list[str], count_total_words: bool = True):
+    try:
+        match = await user.match_messages(database.servers, dc_server_id, messages, count_total_words)
+
+        if write_buffer.buffer is not None:
+            await write_buffer.buffer.add_total_words(dc_server_id, dc_user_id, match.total_words)
+            await write_buffer.buffer.add_flags(dc_server_id, dc_user_id, match.flags)
+        else:
+            event = model.UserIngestEvent(dc_server_id=dc_server_id, dc_user_id=dc_user_id,
+                                          total_words_delta=match.total_words, flags=match.flags)
+            result = await user.ingest(database.users, database.servers, [event])
+            if not result.results[0].success:
+                raise DatabaseException(result.results[0].error)
+
+        return model.UserIngestMessagesResult(success=True, total_words=match.total_words, flags=match.flags)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+    except OverflowError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
 @router.put("/set_user_data", response_model=model.UserSetDataResult)
 async def set_user_data(dc_server_id: int, dc_user_id: int, total_words: int, data: dict[str, int]):
     try:
-        user_data = await user.get_profile(database.users, dc_server_id, dc_user_id)
+        user_data = await user.get_profile(database.users, database.servers, dc_server_id, dc_user_id)
 
         total_flagged = 0
         diff_flags = user_data.words.copy()
@@ -145,9 +273,10 @@ async def set_user_data(dc_server_id: int, dc_user_id: int, total_words: int, da
 
         diff_total_words = total_words - user_data.total_words
 
-        res_user = await user.set_data(database.users, dc_server_id, dc_user_id, total_words, data)
-        res_server_1 = await server.update_total_words_count(database.servers, dc_server_id, diff_total_words)
-        res_server_2 = await server.update_flags(database.servers, dc_server_id, diff_flags)
+        res_user = await user.set_data(database.users, database.servers, dc_server_id, dc_user_id, total_words, data)
+        res_server_1 = await server.update_total_words_count(database.servers, dc_server_id, diff_total_words,
+                                                             dc_user_id)
+        res_server_2 = await server.update_flags(database.servers, dc_server_id, diff_flags, dc_user_id)
 
         if res_user and res_server_1 and res_server_2:
             return model.UserUpdateFlagsResult(success=True)
@@ -167,3 +296,19 @@ async def remove_profile(dc_server_id: int, dc_user_id: int):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
     except OverflowError:
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Over 8-byte ints are not allowed")
+
+
+@router.post("/archive_inactive", response_model=model.UserArchiveResult, status_code=status.HTTP_202_ACCEPTED)
+async def archive_inactive(inactive_days: float | None = Query(default=None, gt=0)):
+    try:
+        if not archive.enabled():
+            raise DatabaseException("Archival is disabled")
+        if await crud_jobs.has_unfinished(database.jobs, "archive_users"):
+            raise DatabaseException("Archival is already running")
+
+        before = archive.cutoff(inactive_days or config.ARCHIVE_INACTIVE_DAYS)
+        job = await jobs.submit("archive_users", None, {"before": before})
+        return model.UserArchiveResult(job_id=str(job["_id"]), before=before)
+
+    except DatabaseException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+from app import config
+from app.storage.base import Database
+
+logger = logging.getLogger(__name__)
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "user_profiles": [
+        IndexModel([("discord_server_id", ASCENDING), ("discord_user_id", ASCENDING)],
+                   name="discord_server_id_discord_user_id_unique", unique=True),
+        # Only the archival job looks profiles up by activity
+        *([IndexModel([("last_active", ASCENDING)], name="last_active")] if config.ARCHIVE_INACTIVE_DAYS > 0 else []),
+    ],
+    "user_profiles_archive": [
+        IndexModel([("discord_server_id", ASCENDING), ("discord_user_id", ASCENDING)],
+                   name="discord_server_id_discord_user_id_unique", unique=True),
+    ],
+    "server_profiles": [
+        IndexModel([("discord_server_id", ASCENDING)],
+                   name="discord_server_id_unique", unique=True),
+    ],
+    "server_counter_shards": [
+        IndexModel([("discord_server_id", ASCENDING), ("shard", ASCENDING)],
+                   name="discord_server_id_shard_unique", unique=True),
+    ],
+    "jobs": [
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+        IndexModel([("discord_server_id", ASCENDING), ("created_at", ASCENDING)], name="discord_server_id_created_at"),
+    ],
+}
+
+
+def _signature(keys, unique) -> tuple:
+    return tuple((field, direction) for field, direction in keys), bool(unique)
+
+
+async def check_indexes(database: Database) -> dict[str, dict[str, list[str]]]:
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        existing = await database[collection_name].index_information()
+        existing_signatures = {_signature(info["key"], info.get("unique")): name for name, info in existing.items()}
+
+        expected_signatures = set()
+        missing = []
+        for index in indexes:
+            document = index.document
+            signature = _signature(document["key"].items(), document.get("unique"))
+            expected_signatures.add(signature)
+            if signature not in existing_signatures:
+                missing.append(document["name"])
+
+        extra = [name for signature, name in existing_signatures.items()
+                 if signature not in expected_signatures and name != "_id_"]
+
+        report[collection_name] = {"missing": missing, "extra": extra}
+
+    return report
+
+
+async def ensure_indexes(database: Database) -> dict[str, list[str]]:
+    report = await check_indexes(database)
+
+    created = {}
+    for collection_name, indexes in INDEXES.items():
+        missing = report[collection_name]["missing"]
+        to_create = []
+        for index in indexes:
+            if index.document["name"] in missing:
+                options = {key: value for key, value in index.document.items() if key not in ("key", "name")}
+                to_create.append(IndexModel(list(index.document["key"].items()), name=index.document["name"],
+                                            **options))
+
+        if len(to_create) > 0:
+            created[collection_name] = await database[collection_name].create_indexes(to_create)
+
+    return created
+
+
+async def startup(database: Database):
+    if config.INDEX_MODE == "off":
+        return
+
+    try:
+        if config.INDEX_MODE == "create":
+            created = await ensure_indexes(database)
+            for collection_name, names in created.items():
+                logger.info("Created indexes on %s: %s", collection_name, ", ".join(names))
+        else:
+            report = await check_indexes(database)
+            for collection_name, result in report.items():
+                if len(result["missing"]) > 0:
+                    logger.warning("Missing indexes on %s: %s", collection_name, ", ".join(result["missing"]))
+
+    except PyMongoError:
+        logger.exception("Index check failed")
+
+
+async def _main(command: str) -> int:
+    from app.database import create_client
+
+    client = create_client()
+    database = client[config.MONGO.name]
+    try:
+        if command == "check":
+            report = await check_indexes(database)
+            status = 0
+            for collection_name, result in report.items():
+                print(f"{collection_name}: missing={result['missing']} extra={result['extra']}")
+                if len(result["missing"]) > 0:
+                    status = 1
+            return status
+        else:
+            created = await ensure_indexes(database)
+            for collection_name, names in created.items():
+                print(f"{collection_name}: created {names}")
+            if len(created) == 0:
+                print("All indexes are present")
+            return 0
+
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check or build the indexes required by the API")
+    parser.add_argument("command", choices=["check", "build"])
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_main(args.command)))
@@ -0,0 +1,265 @@
+import abc
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from app import config, database
+from app.Exceptions.database_exceptions import DatabaseException
+from app.crud import archive, jobs as crud_jobs, servers as crud_servers, users as crud_users
+from app.storage.base import Collection
+
+logger = logging.getLogger(__name__)
+
+
+class JobType(abc.ABC):
+    name = ""
+    key = "discord_user_id"
+    batch_size: int | None = None
+    concurrency: int | None = None
+    delay = 0.0
+
+    def collection(self) -> Collection:
+        return database.users
+
+    def filter(self, job: dict) -> dict:
+        return {"discord_server_id": job["discord_server_id"]}
+
+    @abc.abstractmethod
+    async def process(self, job: dict, keys: list) -> int:
+        ...
+
+    async def complete(self, job: dict):
+        pass
+
+
+class FlagWordsJob(JobType):
+    name = "flag_words"
+
+    async def process(self, job: dict, keys: list) -> int:
+        return await crud_users.flag_members(database.users, job["discord_server_id"], keys, job["params"]["words"])
+
+    async def complete(self, job: dict):
+        await crud_users.flag_archived_members(database.users, job["discord_server_id"], job["params"]["words"])
+
+
+class UnflagWordsJob(JobType):
+    name = "unflag_words"
+
+    async def process(self, job: dict, keys: list) -> int:
+        return await crud_users.unflag_members(database.users, job["discord_server_id"], keys, job["params"]["words"])
+
+    async def complete(self, job: dict):
+        await crud_users.unflag_archived_members(database.users, job["discord_server_id"], job["params"]["words"])
+
+
+class RemoveServerJob(JobType):
+    name = "remove_server"
+    # Deletes are spread out so that removing a large guild does not flood the primary and its replication
+    batch_size = config.SERVER_REMOVAL_BATCH_SIZE
+    concurrency = 1
+    delay = config.SERVER_REMOVAL_BATCH_DELAY
+
+    async def process(self, job: dict, keys: list) -> int:
+        return await crud_users.remove_members(database.users, job["discord_server_id"], keys)
+
+    async def complete(self, job: dict):
+        await crud_servers.remove_profile(database.servers, job["discord_server_id"])
+        # Sweep members created after their batch was deleted, none can be created once the server profile is gone
+        await crud_users.remove_members(database.users, job["discord_server_id"])
+
+
+class ArchiveUsersJob(JobType):
+    name = "archive_users"
+    # A profile written to while it is copied stays in the hot collection and still matches the filter, the cursor
+    # moves past it and the next archival run picks it up again
+    key = "_id"
+    batch_size = config.ARCHIVE_BATCH_SIZE
+    concurrency = 1
+    delay = config.ARCHIVE_BATCH_DELAY
+
+    def filter(self, job: dict) -> dict:
+        return archive.inactive_filter(job["params"]["before"])
+
+    async def process(self, job: dict, keys: list) -> int:
+        return await archive.archive_profiles(database.users, keys, job["params"]["before"])
+
+
+TYPES: dict[str, JobType] = {job_type.name: job_type
+                             for job_type in (FlagWordsJob(), UnflagWordsJob(), RemoveServerJob(), ArchiveUsersJob())}
+
+
+class JobRunner:
+    def __init__(self,
+                 jobs: Collection,
+                 batch_size: int,
+                 concurrency: int,
+                 max_running: int,
+                 lease: float,
+                 poll_interval: float,
+                 max_attempts: int):
+        self.jobs = jobs
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_running = max_running
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self._running: dict = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _process(self, job: dict):
+        job_type = TYPES[job["type"]]
+        cursor = job["cursor"]
+        batch_size = job_type.batch_size or self.batch_size
+        wave = batch_size * (job_type.concurrency or self.concurrency)
+
+        if job.get("total") is None:
+            total = await job_type.collection().count_documents(job_type.filter(job))
+            await crud_jobs.set_total(self.jobs, job["_id"], self.owner, job["processed"] + total)
+
+        while True:
+            query = job_type.filter(job)
+            if cursor is not None:
+                query[job_type.key] = {"$gt": cursor}
+            documents = job_type.collection().find(query, {job_type.key: 1}).sort(job_type.key, 1)
+            documents = await documents.limit(wave).to_list(wave)
+            keys = [document[job_type.key] for document in documents]
+
+            if len(keys) > 0:
+                batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+                processed = await asyncio.gather(*(job_type.process(job, batch) for batch in batches))
+                cursor = keys[-1]
+                # Progress is saved after every wave, so a restarted job repeats at most one wave
+                if not await crud_jobs.save_progress(self.jobs, job["_id"], self.owner, cursor, sum(processed),
+                                                     self.lease):
+                    logger.warning("Lost the lease of job %s", job["_id"])
+                    return
+
+            if len(keys) < wave:
+                await job_type.complete(job)
+                await crud_jobs.finish(self.jobs, job["_id"], self.owner, crud_jobs.DONE)
+                return
+            if job_type.delay > 0:
+                await asyncio.sleep(job_type.delay)
+
+    async def _execute(self, job: dict):
+        try:
+            if job["type"] not in TYPES:
+                await crud_jobs.finish(self.jobs, job["_id"], self.owner, crud_jobs.FAILED,
+                                       f"Unknown job type {job['type']}")
+                return
+            await self._process(job)
+
+        except asyncio.CancelledError:
+            # Shutting down, let another worker pick the job up from its last saved cursor right away
+            await crud_jobs.release(self.jobs, job["_id"], self.owner)
+            raise
+        except (DatabaseException, PyMongoError) as e:
+            error = e.message if isinstance(e, DatabaseException) else str(e)
+            logger.warning("Job %s failed on attempt %d: %s", job["_id"], job["attempts"], error)
+            try:
+                if job["attempts"] >= self.max_attempts:
+                    await crud_jobs.finish(self.jobs, job["_id"], self.owner, crud_jobs.FAILED, error)
+                else:
+                    await crud_jobs.release(self.jobs, job["_id"], self.owner,
+                                            delay=self.poll_interval * job["attempts"], error=error)
+            except PyMongoError:
+                logger.exception("Could not record the failure of job %s", job["_id"])
+
+    async def _claim(self):
+        free = self.max_running - len(self._running)
+        if free <= 0:
+            return
+
+        for job in await crud_jobs.find_claimable(self.jobs, free + len(self._running)):
+            if free <= 0:
+                break
+            if job["_id"] in self._running or await crud_jobs.has_earlier_job(self.jobs, job):
+                continue
+            if not await crud_jobs.claim(self.jobs, job, self.owner, self.lease):
+                continue
+
+            job["attempts"] = job["attempts"] + 1
+            task = asyncio.create_task(self._execute(job))
+            self._running[job["_id"]] = task
+            task.add_done_callback(lambda _, job_id=job["_id"]: self._finished(job_id))
+            free = free - 1
+
+    def _finished(self, job_id):
+        self._running.pop(job_id, None)
+        # The next job of the same server may be waiting for this one
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._claim()
+            except PyMongoError:
+                logger.exception("Claiming jobs failed")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, *self._running.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+
+runner: JobRunner | None = None
+
+
+async def submit(job_type: str, dc_server_id: int | None, params: dict, run_after: datetime | None = None) -> dict:
+    try:
+        job = await crud_jobs.create_job(database.jobs, job_type, dc_server_id, params, run_after)
+    except PyMongoError as e:
+        raise DatabaseException(f"Error when processing the request: {e}")
+
+    if runner is not None:
+        runner.wake()
+    return job
+
+
+async def start():
+    global runner
+
+    runner = JobRunner(database.jobs,
+                       batch_size=config.JOBS_BATCH_SIZE,
+                       concurrency=config.JOBS_CONCURRENCY,
+                       max_running=config.JOBS_MAX_RUNNING,
+                       lease=config.JOBS_LEASE,
+                       poll_interval=config.JOBS_POLL_INTERVAL,
+                       max_attempts=config.JOBS_MAX_ATTEMPTS)
+    runner.start()
+
+
+async def stop():
+    global runner
+
+    if runner is not None:
+        await runner.stop()
+        runner = None
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+from app import config
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+class Automaton:
+    def __init__(self, words):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[tuple[str, ...]] = [()]
+
+        for word in words:
+            if len(word) > 0:
+                self._add(word)
+        self._link()
+
+    def _add(self, word: str):
+        state = 0
+        for char in word:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] = self.output[state] + (word,)
+
+    def _link(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback != 0 and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def match(self, text: str, counts: dict[str, int] | None = None) -> dict[str, int]:
+        if counts is None:
+            counts = {}
+
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        length = len(text)
+        for end, char in enumerate(text):
+            while state != 0 and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for word in output[state]:
+                start = end - len(word) + 1
+                if _is_word_char(word[0]) and start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if _is_word_char(word[-1]) and end + 1 < length and _is_word_char(text[end + 1]):
+                    continue
+                counts[word] = counts.get(word, 0) + 1
+
+        return counts
+
+
+class AutomatonCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[int, tuple[frozenset[str], Automaton]] = OrderedDict()
+
+    def get(self, dc_server_id: int, flag_set: frozenset[str]) -> Automaton:
+        entry = self._entries.get(dc_server_id)
+        if entry is not None:
+            if entry[0] is flag_set:
+                self._entries.move_to_end(dc_server_id)
+                return entry[1]
+            if entry[0] == flag_set:
+                # A refreshed flag cache entry holds an equal copy, keeping it lets later calls match by identity
+                self._entries[dc_server_id] = (flag_set, entry[1])
+                self._entries.move_to_end(dc_server_id)
+                return entry[1]
+
+        automaton = Automaton(flag_set)
+        if self.max_size > 0:
+            self._entries[dc_server_id] = (flag_set, automaton)
+            self._entries.move_to_end(dc_server_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return automaton
+
+    def clear(self):
+        self._entries.clear()
+
+
+cache = AutomatonCache(max_size=config.MATCHER_CACHE_SIZE)
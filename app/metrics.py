@@ -0,0 +1,275 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...], read):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.read = read
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.read().items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] = series[0][index] + 1
+                    break
+            series[1] = series[1] + value
+            series[2] = series[2] + 1
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    cumulative = cumulative + bucket
+                    bucket_labels = _labels(self.label_names, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _labels(self.label_names, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "wordbot_http_requests_total", "HTTP requests by route, method and status code",
+    ("route", "method", "status")))
+http_duration = registry.register(Histogram(
+    "wordbot_http_request_duration_seconds", "HTTP request latency by route",
+    ("route", "method")))
+mongo_commands = registry.register(Counter(
+    "wordbot_mongo_commands_total", "MongoDB commands by command name and outcome",
+    ("command", "outcome")))
+mongo_duration = registry.register(Histogram(
+    "wordbot_mongo_command_duration_seconds", "MongoDB command round-trip time by command name",
+    ("command",)))
+route_mongo_duration = registry.register(Histogram(
+    "wordbot_route_mongo_command_duration_seconds", "MongoDB command round-trip time by HTTP route and command",
+    ("route", "command")))
+coalesced_reads = registry.register(Counter(
+    "wordbot_coalesced_reads_total",
+    "Reads in app/crud that ran a query (leader) or shared a query already in flight (joined)",
+    ("function", "outcome")))
+route_round_trips = registry.register(Histogram(
+    "wordbot_route_mongo_round_trips", "MongoDB round trips made while handling one request, by HTTP route",
+    ("route",), buckets=ROUND_TRIP_BUCKETS))
+
+
+class RequestStats:
+    def __init__(self):
+        self.route = "unmatched"
+        self.commands: list[tuple[str, float]] = []
+
+
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+class CommandListener(monitoring.CommandListener):
+    def _record(self, event, outcome: str):
+        seconds = event.duration_micros / 1_000_000
+        mongo_commands.inc(event.command_name, outcome)
+        mongo_duration.observe(seconds, event.command_name)
+
+        stats = current_request.get()
+        if stats is not None:
+            stats.commands.append((event.command_name, seconds))
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._record(event, "success")
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._record(event, "failure")
+
+
+command_listener = CommandListener()
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.pools: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _update(self, event, key: str, amount: int = 1):
+        address = f"{event.address[0]}:{event.address[1]}"
+        with self._lock:
+            pool = self.pools.setdefault(address, {"open": 0, "checked_out": 0, "created": 0, "closed": 0,
+                                                   "checkout_failures": 0, "cleared": 0, "ready": False})
+            if key == "ready":
+                pool["ready"] = amount > 0
+                return
+            pool[key] = pool[key] + amount
+            if key == "created":
+                pool["open"] = pool["open"] + 1
+            elif key == "closed":
+                pool["open"] = pool["open"] - 1
+
+    def state(self) -> dict[str, dict]:
+        with self._lock:
+            return {address: dict(pool) for address, pool in self.pools.items()}
+
+    def connections(self) -> dict[tuple, int]:
+        values = {}
+        for address, pool in self.state().items():
+            values[(address, "open")] = pool["open"]
+            values[(address, "checked_out")] = pool["checked_out"]
+        return values
+
+    def pool_created(self, event):
+        self._update(event, "ready", 0)
+
+    def pool_ready(self, event):
+        self._update(event, "ready", 1)
+
+    def pool_cleared(self, event):
+        self._update(event, "cleared")
+        self._update(event, "ready", 0)
+
+    def pool_closed(self, event):
+        self._update(event, "ready", 0)
+
+    def connection_created(self, event):
+        self._update(event, "created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, "closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._update(event, "checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._update(event, "checked_out")
+
+    def connection_checked_in(self, event):
+        self._update(event, "checked_out", -1)
+
+
+pool_listener = PoolListener()
+
+registry.register(Gauge(
+    "wordbot_mongo_pool_connections", "MongoDB connections by server address and state",
+    ("address", "state"), pool_listener.connections))
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+
+            route = scope.get("route")
+            stats.route = getattr(route, "path", "unmatched")
+            method = scope["method"]
+
+            http_requests.inc(stats.route, method, status)
+            http_duration.observe(elapsed, stats.route, method)
+            route_round_trips.observe(len(stats.commands), stats.route)
+            for command, seconds in stats.commands:
+                route_mongo_duration.observe(seconds, stats.route, command)
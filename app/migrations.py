@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+
+from app import config
+from app.crud import server_counters, versions
+from app.storage.base import Collection
+
+ZERO_FLAGS_FILTER = {"$expr": {"$in": [0, {"$map": {"input": {"$objectToArray": {"$ifNull": ["$words", {}]}},
+                                                     "in": "$$this.v"}}]}}
+
+STRIP_ZERO_FLAGS = [
+    {"$set": {"words": {"$arrayToObject": {"$filter": {"input": {"$objectToArray": "$words"},
+                                                       "cond": {"$ne": ["$$this.v", 0]}}}}}},
+    versions.PIPELINE_BUMP,
+]
+
+
+async def strip_zero_flags(user_profiles: Collection, dc_server_id: int | None = None) -> int:
+    query = dict(ZERO_FLAGS_FILTER)
+    if dc_server_id is not None:
+        query.update({"discord_server_id": dc_server_id})
+
+    result = await user_profiles.update_many(query, STRIP_ZERO_FLAGS)
+    return result.modified_count
+
+
+async def _main(command: str, dc_server_id: int | None):
+    from app.database import create_client
+
+    client = create_client()
+    database = client[config.MONGO.name]
+    try:
+        if command == "strip-zero-flags":
+            modified = await strip_zero_flags(database["user_profiles"], dc_server_id)
+            print(f"Stripped zero counters from {modified} user profiles")
+        elif command == "compact-server-counters":
+            compacted = await server_counters.compact(database["server_profiles"], dc_server_id)
+            print(f"Merged {compacted} counter shards into server profiles")
+
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data migrations for the WordBot database")
+    parser.add_argument("command", choices=["strip-zero-flags", "compact-server-counters"])
+    parser.add_argument("--server", type=int, default=None, help="Only process this Discord server")
+    args = parser.parse_args()
+    asyncio.run(_main(args.command, args.server))
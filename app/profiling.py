@@ -0,0 +1,147 @@
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+from app import config
+
+WAITING = "[waiting: event loop idle]"
+OTHER_TASKS = "[waiting: other tasks]"
+
+
+@dataclass
+class Profile:
+    id: int
+    route: str
+    method: str
+    status: int
+    started_at: float
+    duration: float
+    interval: float
+    stacks: Counter = field(default_factory=Counter)
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def summary(self) -> dict:
+        return {"id": self.id, "route": self.route, "method": self.method, "status": self.status,
+                "started_at": self.started_at, "duration": self.duration, "samples": self.samples}
+
+    def folded(self) -> str:
+        root = f"{self.method} {self.route}"
+        return "".join(f"{root};{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    def __init__(self, thread_id: int, request_frame, interval: float):
+        self.thread_id = thread_id
+        self.request_frame = request_frame
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        leaf = frame
+        labels = []
+        while frame is not None and frame is not self.request_frame:
+            labels.append(_label(frame))
+            frame = frame.f_back
+
+        if frame is None:
+            # The request's task is suspended: the loop is either idle in select() or running another task
+            self.stacks[WAITING if leaf.f_code.co_name in ("select", "poll", "_run_once") else OTHER_TASKS] += 1
+        else:
+            self.stacks[";".join(reversed(labels)) or "[middleware]"] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+
+class ProfileStore:
+    def __init__(self, size: int):
+        self._profiles: deque[Profile] = deque(maxlen=max(1, size))
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def list(self) -> list[Profile]:
+        with self._lock:
+            return list(reversed(self._profiles))
+
+    def get(self, id: int) -> Profile | None:
+        with self._lock:
+            for profile in self._profiles:
+                if profile.id == id:
+                    return profile
+        return None
+
+
+store = ProfileStore(config.PROFILING_RING_SIZE)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.header = config.PROFILING_HEADER.encode()
+
+    def _requested(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == self.header:
+                return value.strip().lower() in (b"1", b"true", b"yes", b"on")
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        id = store.next_id()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", str(id).encode())]
+            await send(message)
+
+        sampler = Sampler(threading.get_ident(), sys._getframe(), config.PROFILING_INTERVAL)
+        started_at = time.time()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            stacks = sampler.stop()
+            route = getattr(scope.get("route"), "path", scope["path"])
+            store.add(Profile(id, route, scope["method"], status, started_at, time.perf_counter() - start,
+                              config.PROFILING_INTERVAL, stacks))
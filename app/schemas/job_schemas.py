@@ -0,0 +1,19 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class Job(BaseModel):
+    id: str = Field()
+    type: str = Field()
+    status: str = Field()
+    discord_server_id: int | None = Field(default=None)
+    params: dict = Field(default={})
+    processed: int = Field(default=0)
+    total: int | None = Field(default=None)
+    attempts: int = Field(default=0)
+    error: str | None = Field(default=None)
+    run_after: datetime | None = Field(default=None)
+    created_at: datetime = Field()
+    updated_at: datetime = Field()
+    finished_at: datetime | None = Field(default=None)
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel, Field
 
 
@@ -37,6 +39,7 @@ class ServerFlagWordsResult(BaseModel):
     conflicts_count: int = Field()
     flagged: list[str] = Field()
     conflicts: list[str] = Field()
+    job_id: str | None = Field(default=None)
 
 
 class ServerUnflagWordsResult(BaseModel):
@@ -44,6 +47,7 @@ class ServerUnflagWordsResult(BaseModel):
     ignored_count: int = Field()
     unflagged: list[str] = Field()
     ignored: list[str] = Field()
+    job_id: str | None = Field(default=None)
 
 
 class ServerUpdateTotalWordsResult(BaseModel):
@@ -56,3 +60,13 @@ class ServerUpdateFlagsResult(BaseModel):
 
 class ServerGetMembersIds(BaseModel):
     ids: list[str] = Field()
+    next_after_id: str | None = Field(default=None)
+
+
+class ServerRemoveResult(BaseModel):
+    job_id: str = Field()
+    delete_after: datetime = Field()
+
+
+class ServerRestoreResult(BaseModel):
+    restored: bool = Field()
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel, Field
 
 
@@ -29,6 +31,21 @@ class UserWordCount(BaseModel):
     words: dict = Field()
 
 
+class UserMultipleExists(BaseModel):
+    exists: dict[int, bool] = Field()
+    missing: list[int] = Field(default=[])
+
+
+class UserMultipleProfiles(BaseModel):
+    profiles: dict[int, UserProfile] = Field()
+    missing: list[int] = Field(default=[])
+
+
+class UserMultipleWordCounts(BaseModel):
+    counts: dict[int, dict[str, int]] = Field()
+    missing: list[int] = Field(default=[])
+
+
 class UserCreateResult(BaseModel):
     success: bool = Field()
 
@@ -42,6 +59,19 @@ class UserCreateMultipleResult(BaseModel):
     errors: list = Field(default=[])
 
 
+class UserOnboardProgress(BaseModel):
+    done: bool = Field(default=False)
+    received: int = Field(default=0)
+    inserted_count: int = Field(default=0)
+    conflicts_count: int = Field(default=0)
+    unhandled_errors: int = Field(default=0)
+    invalid_count: int = Field(default=0)
+    conflicts: list[int] = Field(default=[])
+    errors: list = Field(default=[])
+    invalid: list[str] = Field(default=[])
+    error: str | None = Field(default=None)
+
+
 class UserFlagWordsResult(BaseModel):
     flagged_count: int = Field()
     conflicts_count: int = Field()
@@ -69,4 +99,38 @@ class UserRemoveResult(BaseModel):
 
 
 class UserSetDataResult(BaseModel):
-    success: bool = Field()
\ No newline at end of file
+    success: bool = Field()
+
+
+class UserIngestEvent(BaseModel):
+    dc_server_id: int = Field(default=..., gt=0, le=2 ** 63 - 1)
+    dc_user_id: int = Field(default=..., gt=0, le=2 ** 63 - 1)
+    total_words_delta: int = Field(default=0)
+    flags: dict[str, int] = Field(default={})
+
+
+class UserIngestEventResult(BaseModel):
+    success: bool = Field()
+    error: str | None = Field(default=None)
+
+
+class UserIngestResult(BaseModel):
+    success_count: int = Field(default=0)
+    failure_count: int = Field(default=0)
+    results: list[UserIngestEventResult] = Field(default=[])
+
+
+class UserMessagesMatch(BaseModel):
+    total_words: int = Field(default=0)
+    flags: dict[str, int] = Field(default={})
+
+
+class UserIngestMessagesResult(BaseModel):
+    success: bool = Field()
+    total_words: int = Field(default=0)
+    flags: dict[str, int] = Field(default={})
+
+
+class UserArchiveResult(BaseModel):
+    job_id: str = Field()
+    before: datetime = Field()
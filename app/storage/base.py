@@ -0,0 +1,62 @@
+from typing import Any, AsyncIterator, Protocol
+
+
+class Cursor(Protocol):
+    def sort(self, key_or_list, direction: int | None = None) -> "Cursor": ...
+
+    def limit(self, limit: int) -> "Cursor": ...
+
+    def batch_size(self, batch_size: int) -> "Cursor": ...
+
+    def __aiter__(self) -> AsyncIterator[dict]: ...
+
+    async def to_list(self, length: int | None) -> list[dict]: ...
+
+
+class Collection(Protocol):
+    @property
+    def name(self) -> str: ...
+
+    @property
+    def database(self) -> "Database": ...
+
+    async def find_one(self, filter: dict | None = None, projection: dict | None = None) -> dict | None: ...
+
+    def find(self, filter: dict | None = None, projection: dict | None = None) -> Cursor: ...
+
+    async def count_documents(self, filter: dict, **kwargs) -> int: ...
+
+    async def insert_one(self, document: dict) -> Any: ...
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True) -> Any: ...
+
+    async def update_one(self, filter: dict, update: dict | list, upsert: bool = False) -> Any: ...
+
+    async def update_many(self, filter: dict, update: dict | list, upsert: bool = False) -> Any: ...
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> Any: ...
+
+    async def delete_one(self, filter: dict) -> Any: ...
+
+    async def delete_many(self, filter: dict) -> Any: ...
+
+    async def find_one_and_delete(self, filter: dict) -> dict | None: ...
+
+    async def index_information(self) -> dict: ...
+
+    async def create_indexes(self, indexes: list) -> list[str]: ...
+
+
+class Database(Protocol):
+    @property
+    def name(self) -> str: ...
+
+    def __getitem__(self, name: str) -> Collection: ...
+
+    async def command(self, command, **kwargs) -> dict: ...
+
+
+class Client(Protocol):
+    def __getitem__(self, name: str) -> Database: ...
+
+    def close(self): ...
@@ -0,0 +1,713 @@
+import itertools
+from dataclasses import dataclass, field
+
+import pymongo
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, WriteError
+
+_MISSING = object()
+
+
+@dataclass
+class InsertOneResult:
+    inserted_id: ObjectId
+    acknowledged: bool = True
+
+
+@dataclass
+class InsertManyResult:
+    inserted_ids: list
+    acknowledged: bool = True
+
+
+@dataclass
+class UpdateResult:
+    matched_count: int = 0
+    modified_count: int = 0
+    upserted_id: ObjectId | None = None
+    acknowledged: bool = True
+
+
+@dataclass
+class DeleteResult:
+    deleted_count: int = 0
+    acknowledged: bool = True
+
+
+@dataclass
+class BulkWriteResult:
+    inserted_count: int = 0
+    matched_count: int = 0
+    modified_count: int = 0
+    deleted_count: int = 0
+    upserted_count: int = 0
+    upserted_ids: dict = field(default_factory=dict)
+    acknowledged: bool = True
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [_copy(val) for val in value]
+    return value
+
+
+def _get(document, path: str):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _set(document: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        child = document.get(part)
+        if not isinstance(child, dict):
+            child = document[part] = {}
+        document = child
+    document[parts[-1]] = value
+
+
+def _unset(document: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def _hashable(value):
+    if value is _MISSING:
+        return None
+    if isinstance(value, dict):
+        return tuple((key, _hashable(val)) for key, val in value.items())
+    if isinstance(value, list):
+        return tuple(_hashable(val) for val in value)
+    return value
+
+
+def _is_operator_dict(value) -> bool:
+    return isinstance(value, dict) and len(value) > 0 and all(key.startswith("$") for key in value.keys())
+
+
+def _compare(op: str, value, cond) -> bool:
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > cond
+        if op == "$gte":
+            return value >= cond
+        if op == "$lt":
+            return value < cond
+        return value <= cond
+    except TypeError:
+        return False
+
+
+def _match_condition(value, cond) -> bool:
+    if not _is_operator_dict(cond):
+        if value is _MISSING:
+            return cond is None
+        if isinstance(value, list) and not isinstance(cond, list):
+            return cond in value
+        return value == cond
+
+    for op, arg in cond.items():
+        if op == "$eq":
+            matched = _match_condition(value, arg)
+        elif op == "$ne":
+            matched = not _match_condition(value, arg)
+        elif op == "$in":
+            matched = any(_match_condition(value, item) for item in arg)
+        elif op == "$nin":
+            matched = not any(_match_condition(value, item) for item in arg)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            matched = _compare(op, value, arg)
+        elif op == "$exists":
+            matched = (value is not _MISSING) == bool(arg)
+        else:
+            raise OperationFailure(f"Unsupported query operator in the memory backend: {op}")
+        if not matched:
+            return False
+
+    return True
+
+
+def match(document: dict, query: dict | None) -> bool:
+    for key, cond in (query or {}).items():
+        if key == "$and":
+            if not all(match(document, sub) for sub in cond):
+                return False
+        elif key == "$or":
+            if not any(match(document, sub) for sub in cond):
+                return False
+        elif key == "$nor":
+            if any(match(document, sub) for sub in cond):
+                return False
+        elif key == "$expr":
+            if not evaluate(cond, document):
+                return False
+        elif not _match_condition(_get(document, key), cond):
+            return False
+
+    return True
+
+
+def evaluate(expr, document: dict, variables: dict | None = None):
+    variables = variables or {}
+
+    if isinstance(expr, str):
+        if expr.startswith("$$"):
+            name, _, path = expr[2:].partition(".")
+            value = document if name in ("ROOT", "CURRENT") else variables.get(name, _MISSING)
+            return _get(value, path) if path else value
+        if expr.startswith("$"):
+            return _get(document, expr[1:])
+        return expr
+
+    if isinstance(expr, list):
+        return [_value(evaluate(item, document, variables)) for item in expr]
+
+    if not isinstance(expr, dict):
+        return expr
+
+    if not _is_operator_dict(expr):
+        values = {key: evaluate(val, document, variables) for key, val in expr.items()}
+        return {key: val for key, val in values.items() if val is not _MISSING}
+
+    (op, arg), = expr.items()
+    if op == "$literal":
+        return arg
+
+    def args():
+        return [_value(evaluate(item, document, variables)) for item in (arg if isinstance(arg, list) else [arg])]
+
+    # Arithmetic on a null or missing operand gives null, as in MongoDB
+    if op == "$add":
+        values = args()
+        return None if None in values else sum(values)
+    if op == "$subtract":
+        left, right = args()
+        return None if left is None or right is None else left - right
+    if op == "$multiply":
+        values = args()
+        if None in values:
+            return None
+        result = 1
+        for value in values:
+            result = result * value
+        return result
+    if op == "$ifNull":
+        values = args()
+        for value in values[:-1]:
+            if value is not None:
+                return value
+        return values[-1]
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        left, right = args()
+        if op == "$eq":
+            return left == right
+        if op == "$ne":
+            return left != right
+        return _compare(op, left, right)
+    if op == "$in":
+        item, array = args()
+        return item in (array or [])
+    if op == "$and":
+        return all(args())
+    if op == "$or":
+        return any(args())
+    if op == "$not":
+        return not args()[0]
+    if op == "$cond":
+        if isinstance(arg, dict):
+            condition, then, otherwise = arg["if"], arg["then"], arg["else"]
+        else:
+            condition, then, otherwise = arg
+        chosen = then if evaluate(condition, document, variables) else otherwise
+        return _value(evaluate(chosen, document, variables))
+    if op == "$objectToArray":
+        value = args()[0]
+        return [{"k": key, "v": val} for key, val in (value or {}).items()]
+    if op == "$arrayToObject":
+        value = args()[0]
+        return {item["k"]: item["v"] for item in (value or [])}
+    if op in ("$filter", "$map"):
+        name = arg.get("as", "this")
+        items = _value(evaluate(arg["input"], document, variables)) or []
+        result = []
+        for item in items:
+            scope = {**variables, name: item}
+            if op == "$filter":
+                if evaluate(arg["cond"], document, scope):
+                    result.append(item)
+            else:
+                result.append(_value(evaluate(arg["in"], document, scope)))
+        return result
+    if op == "$getField":
+        source = _value(evaluate(arg.get("input", "$$CURRENT"), document, variables)) or {}
+        name = _value(evaluate(arg["field"], document, variables))
+        return source.get(name) if isinstance(source, dict) else None
+
+    raise OperationFailure(f"Unsupported expression operator in the memory backend: {op}")
+
+
+def _value(value):
+    return None if value is _MISSING else value
+
+
+def project(document: dict, projection: dict | None) -> dict:
+    if not projection:
+        return _copy(document)
+
+    include_id = bool(projection.get("_id", 1))
+    fields = {key: val for key, val in projection.items() if key != "_id"}
+
+    if any(fields.values()) or (len(fields) == 0 and "_id" in projection and include_id):
+        result = {}
+        for path in fields.keys():
+            value = _get(document, path)
+            if value is not _MISSING:
+                _set(result, path, _copy(value))
+    else:
+        result = _copy(document)
+        for path in fields.keys():
+            _unset(result, path)
+        result.pop("_id", None)
+
+    if include_id and "_id" in document:
+        result = {"_id": document["_id"], **result}
+    return result
+
+
+def apply_update(document: dict, update: dict | list, inserting: bool = False) -> dict:
+    document = _copy(document)
+
+    if isinstance(update, list):
+        for stage in update:
+            (name, arg), = stage.items()
+            if name in ("$set", "$addFields"):
+                current = _copy(document)
+                for path, expr in arg.items():
+                    value = evaluate(expr, current)
+                    if value is _MISSING:
+                        _unset(document, path)
+                    else:
+                        _set(document, path, value)
+            elif name == "$unset":
+                for path in [arg] if isinstance(arg, str) else arg:
+                    _unset(document, path)
+            else:
+                raise OperationFailure(f"Unsupported pipeline stage in the memory backend: {name}")
+        return document
+
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for path, value in fields.items():
+                _set(document, path, _copy(value))
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for path in fields.keys():
+                _unset(document, path)
+        elif op == "$inc":
+            for path, value in fields.items():
+                current = _get(document, path)
+                if current is _MISSING:
+                    current = 0
+                if not isinstance(current, (int, float)) or isinstance(current, bool):
+                    raise WriteError(f"Cannot apply $inc to a value of non-numeric type at '{path}'", 14)
+                _set(document, path, current + value)
+        elif op in ("$max", "$min"):
+            for path, value in fields.items():
+                current = _get(document, path)
+                if current is _MISSING or (value > current if op == "$max" else value < current):
+                    _set(document, path, _copy(value))
+        else:
+            raise OperationFailure(f"Unsupported update operator in the memory backend: {op}")
+
+    return document
+
+
+class _Index:
+    def __init__(self, name: str, keys: list[tuple[str, int]], unique: bool):
+        self.name = name
+        self.keys = keys
+        self.fields = [field_name for field_name, _ in keys]
+        self.unique = unique
+        self.entries: dict[tuple, set] = {}
+        self.prefix: dict = {}
+
+    def key(self, document: dict) -> tuple:
+        return tuple(_hashable(_get(document, field_name)) for field_name in self.fields)
+
+    def add(self, document: dict):
+        key = self.key(document)
+        self.entries.setdefault(key, set()).add(document["_id"])
+        self.prefix.setdefault(key[0], set()).add(document["_id"])
+
+    def remove(self, document: dict):
+        key = self.key(document)
+        for store, store_key in ((self.entries, key), (self.prefix, key[0])):
+            ids = store.get(store_key)
+            if ids is not None:
+                ids.discard(document["_id"])
+                if len(ids) == 0:
+                    del store[store_key]
+
+    def conflict(self, document: dict):
+        if not self.unique:
+            return None
+        for other_id in self.entries.get(self.key(document), ()):
+            if other_id != document["_id"]:
+                return other_id
+        return None
+
+    def info(self) -> dict:
+        info = {"v": 2, "key": list(self.keys)}
+        if self.unique:
+            info.update({"unique": True})
+        return info
+
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query: dict | None, projection: dict | None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: list[tuple[str, int]] = []
+        self._limit = 0
+        self._skip = 0
+
+    def sort(self, key_or_list, direction: int | None = None) -> "MemoryCursor":
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction or pymongo.ASCENDING)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def skip(self, skip: int) -> "MemoryCursor":
+        self._skip = skip
+        return self
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+    def _documents(self) -> list[dict]:
+        documents = self._collection._select(self._query)
+        for path, direction in reversed(self._sort):
+            documents.sort(key=lambda document: _sort_key(_get(document, path)),
+                           reverse=direction == pymongo.DESCENDING)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [project(document, self._projection) for document in documents]
+
+    async def to_list(self, length: int | None = None) -> list[dict]:
+        documents = self._documents()
+        return documents if length is None else documents[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._documents():
+            yield document
+
+
+def _sort_key(value):
+    if value is _MISSING or value is None:
+        return 0, 0
+    if isinstance(value, (int, float)):
+        return 1, value
+    if isinstance(value, str):
+        return 2, value
+    return 3, str(value)
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self._database = database
+        self._name = name
+        self._documents: dict = {}
+        self._order: dict = {}
+        self._sequence = itertools.count()
+        self._indexes: dict[str, _Index] = {"_id_": _Index("_id_", [("_id", pymongo.ASCENDING)], unique=True)}
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def database(self) -> "MemoryDatabase":
+        return self._database
+
+    def _candidates(self, query: dict | None) -> set | None:
+        query = query or {}
+        if set(query.keys()) == {"$or"}:
+            ids = set()
+            for sub_query in query["$or"]:
+                sub_ids = self._candidates(sub_query)
+                if sub_ids is None:
+                    return None
+                ids.update(sub_ids)
+            return ids
+
+        choices = {}
+        for key, val in query.items():
+            if key.startswith("$"):
+                continue
+            if _is_operator_dict(val):
+                if set(val.keys()) == {"$in"}:
+                    choices[key] = [_hashable(item) for item in val["$in"]]
+            elif not isinstance(val, (dict, list)):
+                choices[key] = [_hashable(val)]
+
+        for index in self._indexes.values():
+            if all(field_name in choices for field_name in index.fields):
+                ids = set()
+                for key in itertools.product(*(choices[field_name] for field_name in index.fields)):
+                    ids.update(index.entries.get(key, ()))
+                return ids
+        for index in self._indexes.values():
+            if index.fields[0] in choices:
+                ids = set()
+                for key in choices[index.fields[0]]:
+                    ids.update(index.prefix.get(key, ()))
+                return ids
+        return None
+
+    def _select(self, query: dict | None) -> list[dict]:
+        ids = self._candidates(query)
+        if ids is None:
+            ids = self._documents.keys()
+        ids = sorted(ids, key=lambda document_id: self._order[document_id])
+        return [self._documents[document_id] for document_id in ids if match(self._documents[document_id], query)]
+
+    def _check_unique(self, document: dict):
+        for index in self._indexes.values():
+            if index.conflict(document) is not None:
+                key_value = {field_name: _value(_get(document, field_name)) for field_name in index.fields}
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self._database.name}.{self._name} "
+                                        f"index: {index.name} dup key: {key_value}", 11000,
+                                        {"code": 11000, "keyPattern": dict(index.keys), "keyValue": key_value,
+                                         "errmsg": "E11000 duplicate key error"})
+
+    def _store(self, document: dict, previous: dict | None = None):
+        self._check_unique(document)
+        if previous is not None:
+            for index in self._indexes.values():
+                index.remove(previous)
+        else:
+            self._order[document["_id"]] = next(self._sequence)
+        self._documents[document["_id"]] = document
+        for index in self._indexes.values():
+            index.add(document)
+
+    def _remove(self, document: dict):
+        for index in self._indexes.values():
+            index.remove(document)
+        del self._documents[document["_id"]]
+        del self._order[document["_id"]]
+
+    def _insert(self, document: dict) -> ObjectId:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        stored = _copy(document)
+        self._store(stored)
+        return stored["_id"]
+
+    def _update(self, query: dict, update: dict | list, upsert: bool, multi: bool) -> UpdateResult:
+        if not isinstance(update, list) and not _is_operator_dict(update):
+            raise ValueError("update only works with $ operators")
+
+        result = UpdateResult()
+        documents = self._select(query)
+        if not multi:
+            documents = documents[:1]
+
+        for document in documents:
+            updated = apply_update(document, update)
+            result.matched_count = result.matched_count + 1
+            if updated != document:
+                self._store(updated, previous=document)
+                result.modified_count = result.modified_count + 1
+
+        if result.matched_count == 0 and upsert:
+            seed = {key: _copy(val) for key, val in (query or {}).items()
+                    if not key.startswith("$") and not _is_operator_dict(val)}
+            document = {}
+            for path, val in seed.items():
+                _set(document, path, val)
+            document = apply_update(document, update, inserting=True)
+            result.upserted_id = self._insert(document)
+
+        return result
+
+    async def find_one(self, filter: dict | None = None, projection: dict | None = None, **kwargs) -> dict | None:
+        documents = self._select(filter)
+        return project(documents[0], projection) if documents else None
+
+    def find(self, filter: dict | None = None, projection: dict | None = None, **kwargs) -> MemoryCursor:
+        return MemoryCursor(self, filter, projection)
+
+    async def count_documents(self, filter: dict, limit: int = 0, **kwargs) -> int:
+        count = len(self._select(filter))
+        return min(count, limit) if limit else count
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        return InsertOneResult(inserted_id=self._insert(document))
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        result = await self.bulk_write([pymongo.InsertOne(document) for document in documents], ordered=ordered)
+        return InsertManyResult(inserted_ids=[document["_id"] for document in documents][:result.inserted_count])
+
+    async def update_one(self, filter: dict, update: dict | list, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=False)
+
+    async def update_many(self, filter: dict, update: dict | list, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=True)
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        documents = self._select(filter)[:1]
+        for document in documents:
+            self._remove(document)
+        return DeleteResult(deleted_count=len(documents))
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        documents = self._select(filter)
+        for document in documents:
+            self._remove(document)
+        return DeleteResult(deleted_count=len(documents))
+
+    async def find_one_and_delete(self, filter: dict, projection: dict | None = None, **kwargs) -> dict | None:
+        documents = self._select(filter)[:1]
+        for document in documents:
+            self._remove(document)
+        return project(documents[0], projection) if documents else None
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = BulkWriteResult()
+        write_errors = []
+
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, pymongo.InsertOne):
+                    self._insert(request._doc)
+                    result.inserted_count = result.inserted_count + 1
+                elif isinstance(request, (pymongo.UpdateOne, pymongo.UpdateMany)):
+                    update = self._update(request._filter, request._doc, request._upsert,
+                                          multi=isinstance(request, pymongo.UpdateMany))
+                    result.matched_count = result.matched_count + update.matched_count
+                    result.modified_count = result.modified_count + update.modified_count
+                    if update.upserted_id is not None:
+                        result.upserted_count = result.upserted_count + 1
+                        result.upserted_ids[index] = update.upserted_id
+                elif isinstance(request, (pymongo.DeleteOne, pymongo.DeleteMany)):
+                    method = self.delete_one if isinstance(request, pymongo.DeleteOne) else self.delete_many
+                    deleted = await method(request._filter)
+                    result.deleted_count = result.deleted_count + deleted.deleted_count
+                else:
+                    raise TypeError(f"{request!r} is not a supported write operation")
+
+            except (DuplicateKeyError, WriteError) as e:
+                error = dict(e.details or {})
+                error.update({"index": index, "code": e.code, "errmsg": str(e)})
+                if isinstance(request, pymongo.InsertOne):
+                    error.update({"op": request._doc})
+                write_errors.append(error)
+                if ordered:
+                    break
+
+        if len(write_errors) > 0:
+            raise BulkWriteError({"writeErrors": write_errors,
+                                  "writeConcernErrors": [],
+                                  "nInserted": result.inserted_count,
+                                  "nUpserted": result.upserted_count,
+                                  "nMatched": result.matched_count,
+                                  "nModified": result.modified_count,
+                                  "nRemoved": result.deleted_count,
+                                  "upserted": [{"index": index, "_id": upserted_id}
+                                               for index, upserted_id in result.upserted_ids.items()]})
+
+        return result
+
+    async def index_information(self) -> dict:
+        return {name: index.info() for name, index in self._indexes.items()}
+
+    async def create_indexes(self, indexes: list, **kwargs) -> list[str]:
+        names = []
+        for model in indexes:
+            document = model.document
+            keys = list(document["key"].items())
+            index = _Index(document["name"], keys, bool(document.get("unique")))
+            for stored in self._documents.values():
+                if index.conflict(stored) is not None:
+                    raise OperationFailure(f"Index build failed: duplicate key in {self._name} for {index.name}", 11000)
+                index.add(stored)
+            self._indexes[index.name] = index
+            names.append(index.name)
+        return names
+
+    async def drop(self):
+        self._database.drop_collection(self._name)
+
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self._client = client
+        self._name = name
+        self._collections: dict[str, MemoryCollection] = {}
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def client(self) -> "MemoryClient":
+        return self._client
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def drop_collection(self, name: str):
+        self._collections.pop(name, None)
+
+    async def command(self, command, **kwargs) -> dict:
+        if command == "ping" or command == {"ping": 1}:
+            return {"ok": 1.0}
+        raise OperationFailure(f"Unsupported command in the memory backend: {command}")
+
+
+class MemoryClient:
+    def __init__(self):
+        self._databases: dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    def close(self):
+        pass
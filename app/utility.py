@@ -1,4 +1,8 @@
+import json
+from typing import AsyncIterator
+
 from pydantic import BaseModel
+from starlette.responses import StreamingResponse
 
 
 class ValidationError(Exception):
@@ -48,8 +52,101 @@ def conv(document, include_id=False) -> dict:
         raise TypeError("Document must not be null")
 
 
+def shape(document: dict, model: type[BaseModel]) -> dict:
+    shaped = {}
+    for name, field in model.model_fields.items():
+        if name in document:
+            shaped[name] = document[name]
+        elif field.is_required():
+            raise ValidationError(f"Stored document is missing the required field '{name}'")
+        else:
+            # get_default copies mutable defaults, so a caller changing the result can not change the model
+            shaped[name] = field.get_default(call_default_factory=True)
+    return shaped
+
+
 def validate_and_transform(string: str) -> str:
     if 0 < len(string) < 255:
         return string.strip().lower()
     else:
         raise ValidationError(f"String parameter length must be between 1 and 255 characters: '{string}'")
+
+
+def check_int64(value: int) -> int:
+    if not -2 ** 63 <= value < 2 ** 63:
+        raise OverflowError("Over 8-byte ints are not allowed")
+    return value
+
+
+def build_increment(flag_set, total_words: int, words: dict[str, int]) -> dict[str, int]:
+    inc_data = {}
+    total_count = 0
+    for key, val in words.items():
+        if key in flag_set and val != 0:
+            total_count = total_count + val
+            inc_data.update({f"words.{key}": val})
+
+    if total_count != 0:
+        inc_data.update({"total_flagged_words": total_count})
+    if total_words != 0:
+        inc_data.update({"total_words": total_words})
+
+    return inc_data
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _parse_ids(line: bytes, ids: list[int], invalid: list[str]):
+    try:
+        value = json.loads(line)
+    except ValueError:
+        invalid.append(line.decode(errors="replace")[:64])
+        return
+
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, int) and not isinstance(item, bool) and 0 < item < 2 ** 63:
+            ids.append(item)
+        else:
+            invalid.append(json.dumps(item)[:64])
+
+
+async def iter_id_batches(stream: AsyncIterator[bytes],
+                          batch_size: int) -> AsyncIterator[tuple[list[int], list[str]]]:
+    ids: list[int] = []
+    invalid: list[str] = []
+    rest = b""
+
+    async for data in stream:
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            if line.strip() != b"":
+                _parse_ids(line, ids, invalid)
+            # Invalid entries are flushed on their own limit too, otherwise a stream of bad lines would pile up
+            while len(ids) >= batch_size or len(invalid) >= batch_size:
+                yield ids[:batch_size], invalid
+                ids, invalid = ids[batch_size:], []
+
+    if rest.strip() != b"":
+        _parse_ids(rest, ids, invalid)
+    while len(ids) > batch_size:
+        yield ids[:batch_size], invalid
+        ids, invalid = ids[batch_size:], []
+    if len(ids) > 0 or len(invalid) > 0:
+        yield ids, invalid
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    # StreamingResponse watches receive() for a disconnect, which would swallow a request body that is still being read
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+
+import pymongo
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app import config, database
+from app.Exceptions.database_exceptions import DatabaseException
+from app.crud import archive, coalescing, server_counters, servers as crud_server, user_cache, versions
+from app.storage.base import Collection
+from app.utility import build_increment, check_int64
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    def __init__(self,
+                 user_profiles: Collection,
+                 server_profiles: Collection,
+                 flush_interval: float,
+                 max_keys: int,
+                 max_retry_delay: float):
+        self.user_profiles = user_profiles
+        self.server_profiles = server_profiles
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.max_retry_delay = max_retry_delay
+
+        self._users: dict[tuple[int, int], dict] = {}
+        self._servers: dict[int, dict] = {}
+        self._flush_lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def _entry(store: dict, key) -> dict:
+        entry = store.get(key)
+        if entry is None:
+            entry = store[key] = {"total_words": 0, "words": {}}
+        return entry
+
+    @staticmethod
+    def _merge(store: dict, key, entry: dict):
+        target = WriteBuffer._entry(store, key)
+        target["total_words"] = target["total_words"] + entry["total_words"]
+        words = target["words"]
+        for word, val in entry["words"].items():
+            words[word] = words.get(word, 0) + val
+
+    def _requeue(self, users: dict, servers: dict):
+        # Increments that arrived during the flush are already in the live buffer, failed ones are added on top
+        for key, entry in users.items():
+            self._merge(self._users, key, entry)
+        for key, entry in servers.items():
+            self._merge(self._servers, key, entry)
+
+    async def add_total_words(self, dc_server_id: int, dc_user_id: int, difference: int):
+        check_int64(difference)
+        for entry in (self._entry(self._users, (dc_server_id, dc_user_id)), self._entry(self._servers, dc_server_id)):
+            entry["total_words"] = entry["total_words"] + difference
+
+        self._signal_if_full()
+
+    async def add_flags(self, dc_server_id: int, dc_user_id: int, data: dict[str, int]):
+        for val in data.values():
+            check_int64(val)
+
+        for entry in (self._entry(self._users, (dc_server_id, dc_user_id)), self._entry(self._servers, dc_server_id)):
+            words = entry["words"]
+            for key, val in data.items():
+                words[key] = words.get(key, 0) + val
+
+        self._signal_if_full()
+
+    def _signal_if_full(self):
+        # The background task flushes, so the request that fills the buffer does not wait for the bulk writes
+        if len(self._users) >= self.max_keys:
+            self._full.set()
+
+    @staticmethod
+    async def _bulk_write(collection: Collection, keys: list, ops: list) -> tuple[set, int]:
+        try:
+            result = await collection.bulk_write(ops, ordered=False)
+            return set(), result.matched_count
+        except BulkWriteError as bwe:
+            return {keys[error["index"]] for error in bwe.details["writeErrors"]}, bwe.details["nMatched"]
+        except PyMongoError:
+            # Whether any operation was applied is unknown, they are retried rather than lost
+            logger.exception("Write buffer bulk write failed")
+            return set(keys), 0
+
+    async def _write_users(self, user_ops: dict) -> set:
+        keys = list(user_ops.keys())
+        failed, matched = await self._bulk_write(self.user_profiles, keys, list(user_ops.values()))
+        if matched + len(failed) == len(keys) or not archive.enabled():
+            return failed
+
+        # Increments of archived members matched nothing, so they are applied again once restored
+        members: dict[int, list[int]] = {}
+        for dc_server_id, dc_user_id in keys:
+            if (dc_server_id, dc_user_id) not in failed:
+                members.setdefault(dc_server_id, []).append(dc_user_id)
+        try:
+            restored = await archive.restore(self.user_profiles, members)
+        except PyMongoError:
+            logger.exception("Restoring archived members failed, their buffered increments were dropped")
+            return failed
+        retry = [key for key in keys if key in restored]
+        if len(retry) > 0:
+            retry_failed, _ = await self._bulk_write(self.user_profiles, retry, [user_ops[key] for key in retry])
+            failed = failed | retry_failed
+        return failed
+
+    @coalescing.writes
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            users, self._users = self._users, {}
+            servers, self._servers = self._servers, {}
+            if len(users) == 0 and len(servers) == 0:
+                return True
+
+            try:
+                # Retried user increments can be buffered without their server's increment
+                dc_server_ids = servers.keys() | {dc_server_id for dc_server_id, _ in users.keys()}
+                flag_sets = await crud_server.get_flag_sets(self.server_profiles, dc_server_ids)
+            except (DatabaseException, PyMongoError):
+                self._requeue(users, servers)
+                raise
+
+            user_ops = {}
+            for (dc_server_id, dc_user_id), entry in users.items():
+                if dc_server_id not in flag_sets:
+                    continue
+                inc_data = build_increment(flag_sets[dc_server_id], entry["total_words"], entry["words"])
+                if len(inc_data) > 0:
+                    user_ops[(dc_server_id, dc_user_id)] = pymongo.UpdateOne(
+                        {"discord_server_id": dc_server_id, "discord_user_id": dc_user_id},
+                        archive.touch(versions.bump({"$inc": inc_data})))
+
+            server_ops = {}
+            for dc_server_id, entry in servers.items():
+                if dc_server_id not in flag_sets:
+                    continue
+                inc_data = build_increment(flag_sets[dc_server_id], entry["total_words"], entry["words"])
+                if len(inc_data) > 0:
+                    if server_counters.enabled():
+                        server_ops[dc_server_id] = server_counters.increment_op(dc_server_id, inc_data)
+                    else:
+                        server_ops[dc_server_id] = pymongo.UpdateOne({"discord_server_id": dc_server_id},
+                                                                     versions.bump({"$inc": inc_data}))
+
+            failed_users = set()
+            if len(user_ops) > 0:
+                try:
+                    failed_users = await self._write_users(user_ops)
+                finally:
+                    for dc_server_id, dc_user_id in users.keys():
+                        user_cache.cache.invalidate(dc_server_id, dc_user_id)
+
+            failed_servers = set()
+            if len(server_ops) > 0:
+                collection = self.server_profiles
+                if server_counters.enabled():
+                    collection = server_counters.shards_collection(self.server_profiles)
+                failed_servers, _ = await self._bulk_write(collection, list(server_ops.keys()),
+                                                           list(server_ops.values()))
+
+            # User and server increments are retried separately, so one side failing does not repeat the other
+            self._requeue({key: users[key] for key in failed_users}, {key: servers[key] for key in failed_servers})
+            return len(failed_users) == 0 and len(failed_servers) == 0
+
+    async def _run(self):
+        retry_delay = 0.0
+        while True:
+            if retry_delay == 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # A full buffer must not cut the backoff short while MongoDB is failing
+                await asyncio.sleep(retry_delay)
+            self._full.clear()
+
+            try:
+                flushed = await self.flush()
+            except (DatabaseException, PyMongoError):
+                logger.exception("Write buffer flush failed, buffered increments are kept for the next attempt")
+                flushed = False
+
+            if flushed:
+                retry_delay = 0.0
+            else:
+                retry_delay = min(max(retry_delay * 2, self.flush_interval), self.max_retry_delay)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if not await self.flush():
+            logger.error("Write buffer could not be flushed on shutdown, buffered increments were dropped")
+
+
+buffer: WriteBuffer | None = None
+
+
+async def start():
+    global buffer
+
+    if config.WRITE_BUFFER_ENABLED:
+        buffer = WriteBuffer(database.users, database.servers,
+                             flush_interval=config.WRITE_BUFFER_FLUSH_INTERVAL,
+                             max_keys=config.WRITE_BUFFER_MAX_KEYS,
+                             max_retry_delay=config.WRITE_BUFFER_MAX_RETRY_DELAY)
+        buffer.start()
+
+
+async def stop():
+    global buffer
+
+    if buffer is not None:
+        await buffer.stop()
+        buffer = None
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from app import indexes
+from app.crud import flag_cache, servers as crud_server, users as crud_user
+from app.schemas import user_schemas
+from app.storage.memory import MemoryClient
+
+DC_SERVER_ID = 1
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    position = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[position]
+
+
+def summarize(samples: list[float]) -> dict:
+    total = sum(samples)
+    return {"iterations": len(samples),
+            "p50_ms": percentile(samples, 0.50) * 1000,
+            "p95_ms": percentile(samples, 0.95) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000,
+            "mean_ms": statistics.fmean(samples) * 1000,
+            "ops_per_sec": len(samples) / total if total > 0 else 0.0}
+
+
+async def measure(func, iterations: int) -> dict:
+    samples = []
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        await func(iteration)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def create_database(backend: str):
+    if backend == "memory":
+        client = MemoryClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ.get("URI", "mongodb://localhost:27017"))
+    return client, client[os.environ.get("BENCH_NAME", "wordbot_bench")]
+
+
+async def seed(database, members: int, words: int, batch: int):
+    for name in ("user_profiles", "server_profiles"):
+        await database[name].delete_many({})
+    await indexes.ensure_indexes(database)
+    flag_cache.cache.clear()
+
+    users, servers = database["user_profiles"], database["server_profiles"]
+    await crud_server.create_profile(servers, DC_SERVER_ID)
+    await crud_server.flag_words(servers, DC_SERVER_ID, [f"word{i}" for i in range(words)])
+    for start in range(1, members + 1, batch):
+        ids = list(range(start, min(start + batch, members + 1)))
+        await crud_user.create_multiple_profiles(users, servers, DC_SERVER_ID, ids)
+
+
+def cases(users, servers, args) -> list[tuple[str, int, object]]:
+    members, words, iterations, heavy = args.members, args.words, args.iterations, args.heavy_iterations
+    member = lambda i: i % members + 1
+    word = lambda i: f"word{i % words}"
+    counts = {f"word{i}": 1 for i in range(0, words, max(1, words // 5))}
+    new_users = members + 1
+
+    async def create_multiple(i):
+        start = new_users + iterations + i * args.batch
+        await crud_user.create_multiple_profiles(users, servers, DC_SERVER_ID, list(range(start, start + args.batch)))
+
+    templates = {}
+
+    async def insert_profiles(i):
+        # Onboarding builds the template once per guild, so only the inserts are timed after the first iteration
+        if "template" not in templates:
+            templates["template"] = await crud_user.get_profile_template(servers, DC_SERVER_ID)
+        template = templates["template"]
+        start = new_users + iterations + (args.heavy_iterations + i) * args.batch
+        await crud_user.insert_profiles(users, template, list(range(start, start + args.batch)))
+
+    async def iter_members(i):
+        async for _ in crud_server.iter_members_ids(users, DC_SERVER_ID):
+            pass
+
+    async def flag_and_unflag(i):
+        await crud_server.flag_words(servers, DC_SERVER_ID, [f"extra{i}"])
+        await crud_user.flag_words(servers, users, DC_SERVER_ID, [f"extra{i}"])
+
+    async def unflag(i):
+        await crud_server.unflag_words(servers, DC_SERVER_ID, [f"extra{i}"])
+        await crud_user.unflag_words(servers, users, DC_SERVER_ID, [f"extra{i}"])
+
+    messages = [" ".join(f"{word(i + j)} filler text" for j in range(10)) for i in range(20)]
+
+    events = [user_schemas.UserIngestEvent(dc_server_id=DC_SERVER_ID, dc_user_id=member(i), total_words_delta=3,
+                                           flags={word(i): 1}) for i in range(100)]
+
+    return [
+        ("users.check_if_exists", iterations,
+         lambda i: crud_user.check_if_exists(users, DC_SERVER_ID, member(i))),
+        ("users.get_word_count", iterations,
+         lambda i: crud_user.get_word_count(users, servers, DC_SERVER_ID, member(i), word(i))),
+        ("users.get_profile", iterations,
+         lambda i: crud_user.get_profile(users, servers, DC_SERVER_ID, member(i))),
+        ("users.get_total_words", iterations,
+         lambda i: crud_user.get_total_words(users, DC_SERVER_ID, member(i))),
+        ("users.get_total_flagged_words", iterations,
+         lambda i: crud_user.get_total_flagged_words(users, DC_SERVER_ID, member(i))),
+        ("users.get_flagged_words", iterations,
+         lambda i: crud_user.get_flagged_words(users, servers, DC_SERVER_ID, member(i))),
+        ("users.get_etag", iterations,
+         lambda i: crud_user.get_etag(users, servers, DC_SERVER_ID, member(i))),
+        ("users.check_if_multiple_exist", iterations,
+         lambda i: crud_user.check_if_multiple_exist(users, DC_SERVER_ID, [member(i + j) for j in range(100)])),
+        ("users.get_multiple_profiles", iterations,
+         lambda i: crud_user.get_multiple_profiles(users, servers, DC_SERVER_ID, [member(i + j) for j in range(100)])),
+        ("users.get_multiple_word_counts", iterations,
+         lambda i: crud_user.get_multiple_word_counts(users, servers, DC_SERVER_ID,
+                                                      [member(i + j) for j in range(100)], [word(i), word(i + 1)])),
+        ("users.update_flags", iterations,
+         lambda i: crud_user.update_flags(users, servers, DC_SERVER_ID, member(i), counts)),
+        ("users.update_total_words_count", iterations,
+         lambda i: crud_user.update_total_words_count(users, DC_SERVER_ID, member(i), 5)),
+        ("users.set_data", iterations,
+         lambda i: crud_user.set_data(users, servers, DC_SERVER_ID, member(i), 100, counts)),
+        ("users.ingest", iterations,
+         lambda i: crud_user.ingest(users, servers, events)),
+        ("users.match_messages", iterations,
+         lambda i: crud_user.match_messages(servers, DC_SERVER_ID, messages)),
+        ("users.create_profile", iterations,
+         lambda i: crud_user.create_profile(users, servers, DC_SERVER_ID, new_users + i)),
+        ("users.remove_user", iterations,
+         lambda i: crud_user.remove_user(servers, users, DC_SERVER_ID, new_users + i)),
+        ("users.create_multiple_profiles", heavy, create_multiple),
+        ("users.insert_profiles", heavy, insert_profiles),
+        ("servers.check_if_exists", iterations,
+         lambda i: crud_server.check_if_exists(servers, DC_SERVER_ID)),
+        ("servers.get_word_count", iterations,
+         lambda i: crud_server.get_word_count(servers, DC_SERVER_ID, word(i))),
+        ("servers.get_profile", iterations,
+         lambda i: crud_server.get_profile(servers, DC_SERVER_ID)),
+        ("servers.get_total_words", iterations,
+         lambda i: crud_server.get_total_words(servers, DC_SERVER_ID)),
+        ("servers.get_total_flagged_words", iterations,
+         lambda i: crud_server.get_total_flagged_words(servers, DC_SERVER_ID)),
+        ("servers.get_flagged_words", iterations,
+         lambda i: crud_server.get_flagged_words(servers, DC_SERVER_ID)),
+        ("servers.get_etag", iterations,
+         lambda i: crud_server.get_etag(servers, DC_SERVER_ID)),
+        ("servers.get_flag_set", iterations,
+         lambda i: crud_server.get_flag_set(servers, DC_SERVER_ID)),
+        ("servers.update_flags", iterations,
+         lambda i: crud_server.update_flags(servers, DC_SERVER_ID, counts)),
+        ("servers.update_total_words_count", iterations,
+         lambda i: crud_server.update_total_words_count(servers, DC_SERVER_ID, 5)),
+        ("servers.create_profile", iterations,
+         lambda i: crud_server.create_profile(servers, DC_SERVER_ID + 1 + i)),
+        ("servers.get_members_ids", heavy,
+         lambda i: crud_server.get_members_ids(users, DC_SERVER_ID)),
+        ("servers.iter_members_ids", heavy, iter_members),
+        ("flag_words", heavy, flag_and_unflag),
+        ("unflag_words", heavy, unflag),
+    ]
+
+
+async def run(args) -> dict:
+    client, database = create_database(args.backend)
+    users, servers = database["user_profiles"], database["server_profiles"]
+
+    try:
+        start = time.perf_counter()
+        await seed(database, args.members, args.words, args.batch)
+        print(f"Seeded {args.members} members with {args.words} flagged words in {time.perf_counter() - start:.2f}s",
+              file=sys.stderr)
+
+        results = {}
+        for name, iterations, func in cases(users, servers, args):
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            results[name] = await measure(func, iterations)
+            print(f"{name:<34} p50={results[name]['p50_ms']:9.3f}ms p95={results[name]['p95_ms']:9.3f}ms "
+                  f"p99={results[name]['p99_ms']:9.3f}ms {results[name]['ops_per_sec']:10.1f} ops/s", file=sys.stderr)
+
+        return {"meta": {"backend": args.backend, "members": args.members, "words": args.words,
+                         "iterations": args.iterations, "heavy_iterations": args.heavy_iterations,
+                         "python": platform.python_version(), "timestamp": time.time()},
+                "results": results}
+
+    finally:
+        client.close()
+
+
+def compare(report: dict, baseline: dict, threshold: float, metric: str) -> list[str]:
+    regressions = []
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        change = (result[metric] - previous[metric]) / previous[metric] if previous[metric] > 0 else 0.0
+        marker = "REGRESSION" if change > threshold else ""
+        print(f"{name:<34} {previous[metric]:9.3f}ms -> {result[metric]:9.3f}ms {change * 100:+7.1f}% {marker}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for every function in app/crud")
+    parser.add_argument("--backend", choices=["memory", "motor"], default="memory")
+    parser.add_argument("--members", type=int, default=10000, help="Members in the synthetic guild")
+    parser.add_argument("--words", type=int, default=50, help="Flagged words in the synthetic guild")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--heavy-iterations", type=int, default=5,
+                        help="Iterations for guild-wide operations such as flag_words and get_members_ids")
+    parser.add_argument("--batch", type=int, default=1000, help="Profiles per create_multiple_profiles call")
+    parser.add_argument("--only", nargs="*", help="Only run benchmarks whose name contains one of these strings")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare the results with a baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.20, help="Relative slowdown reported as a regression")
+    parser.add_argument("--metric", default="p95_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.threshold, args.metric)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlencode, urlsplit
+
+from app import config
+from benchmarks.crud import percentile
+
+DEFAULT_MIX = {
+    "update_user_flags": 45,
+    "update_user_total_words": 45,
+    "get_profile": 5,
+    "create_multiple_profiles": 3,
+    "flag_words": 1,
+    "unflag_words": 1,
+}
+
+
+class Response:
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.body = body
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def start(self):
+        await self.app.router.startup()
+
+    async def close(self):
+        await self.app.router.shutdown()
+
+    async def request(self, method: str, path: str, params: dict | None = None, body=None) -> Response:
+        payload = b"" if body is None else json.dumps(body).encode()
+        headers = [(b"host", b"loadgen"), (b"content-length", str(len(payload)).encode())]
+        if body is not None:
+            headers.append((b"content-type", b"application/json"))
+
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+                 "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+                 "query_string": urlencode(params or {}).encode(), "headers": headers,
+                 "client": ("127.0.0.1", 0), "server": ("loadgen", 80)}
+
+        sent = False
+        status = 500
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return Response(status, b"".join(chunks))
+
+
+class HttpClient:
+    def __init__(self, url: str, connections: int):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self._pool: asyncio.Queue = asyncio.Queue()
+        self._connections = connections
+
+    async def start(self):
+        for _ in range(self._connections):
+            self._pool.put_nowait(None)
+
+    async def close(self):
+        while not self._pool.empty():
+            connection = self._pool.get_nowait()
+            if connection is not None:
+                connection[1].close()
+
+    async def _open(self):
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method: str, path: str, params: dict | None = None, body=None) -> Response:
+        connection = await self._pool.get()
+        try:
+            if connection is None:
+                connection = await self._open()
+            reader, writer = connection
+
+            payload = b"" if body is None else json.dumps(body).encode()
+            target = self.prefix + path + ("?" + urlencode(params) if params else "")
+            head = (f"{method} {target} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n"
+                    f"Content-Type: application/json\r\nConnection: keep-alive\r\n\r\n")
+            writer.write(head.encode() + payload)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionError("Connection closed by the server")
+            status = int(status_line.split()[1])
+
+            length, chunked, keep_alive = 0, False, True
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if line == "":
+                    break
+                name, _, value = line.partition(":")
+                name, value = name.strip().lower(), value.strip().lower()
+                if name == "content-length":
+                    length = int(value)
+                elif name == "transfer-encoding" and "chunked" in value:
+                    chunked = True
+                elif name == "connection" and value == "close":
+                    keep_alive = False
+
+            if chunked:
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).strip(), 16)
+                    if size == 0:
+                        await reader.readline()
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readline()
+                data = b"".join(chunks)
+            else:
+                data = await reader.readexactly(length)
+
+            if not keep_alive:
+                writer.close()
+                connection = None
+            return Response(status, data)
+
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            if connection is not None:
+                connection[1].close()
+            connection = None
+            raise
+
+        finally:
+            self._pool.put_nowait(connection)
+
+
+class Traffic:
+    def __init__(self, guilds: int, mean_size: int, distribution: str, words: int, seed: int):
+        self.random = random.Random(seed)
+        self.words = words
+        self.guilds = []
+        for index in range(guilds):
+            if distribution == "fixed":
+                size = mean_size
+            elif distribution == "uniform":
+                size = self.random.randint(1, 2 * mean_size)
+            else:
+                size = max(1, int(mean_size * 0.5 * self.random.paretovariate(1.5)))
+            self.guilds.append({"id": 1_000_000 + index, "size": size, "next_user": size + 1, "next_word": 0})
+        self.weights = [guild["size"] for guild in self.guilds]
+
+    def setup(self) -> list[dict]:
+        requests = []
+        for guild in self.guilds:
+            requests.append({"route": "setup", "method": "POST", "path": "/servers/create_profile",
+                             "params": {"dc_server_id": guild["id"]}})
+            requests.append({"route": "setup", "method": "PATCH", "path": "/servers/flag_words",
+                             "params": {"dc_server_id": guild["id"]},
+                             "json": [f"word{i}" for i in range(self.words)]})
+            for start in range(1, guild["size"] + 1, 1000):
+                requests.append({"route": "setup", "method": "POST", "path": "/users/create_multiple_profiles",
+                                 "params": {"dc_server_id": guild["id"]},
+                                 "json": list(range(start, min(start + 1000, guild["size"] + 1)))})
+        return requests
+
+    def _member(self, guild: dict) -> int:
+        rank = int(self.random.paretovariate(1.2)) - 1
+        return rank % guild["size"] + 1
+
+    def next(self, mix: dict[str, int]) -> dict:
+        route = self.random.choices(list(mix.keys()), weights=list(mix.values()))[0]
+        guild = self.random.choices(self.guilds, weights=self.weights)[0]
+        server = {"dc_server_id": guild["id"]}
+
+        if route == "update_user_flags":
+            flags = {f"word{self.random.randrange(self.words)}": self.random.randint(1, 3)
+                     for _ in range(self.random.randint(1, 3))}
+            return {"route": route, "method": "PUT", "path": "/users/update_user_flags",
+                    "params": {**server, "dc_user_id": self._member(guild)}, "json": flags}
+        if route == "update_user_total_words":
+            return {"route": route, "method": "PUT", "path": "/users/update_user_total_words",
+                    "params": {**server, "dc_user_id": self._member(guild), "count": self.random.randint(1, 40)}}
+        if route == "get_profile":
+            return {"route": route, "method": "GET", "path": "/users/get_profile",
+                    "params": {**server, "dc_user_id": self._member(guild)}}
+        if route == "create_multiple_profiles":
+            burst = self.random.randint(10, 200)
+            ids = list(range(guild["next_user"], guild["next_user"] + burst))
+            guild["next_user"] = guild["next_user"] + burst
+            return {"route": route, "method": "POST", "path": "/users/create_multiple_profiles",
+                    "params": server, "json": ids}
+        if route == "flag_words":
+            guild["next_word"] = guild["next_word"] + 1
+            return {"route": route, "method": "PATCH", "path": "/servers/flag_words", "params": server,
+                    "json": [f"extra{guild['next_word']}"]}
+        if route == "unflag_words":
+            return {"route": route, "method": "PATCH", "path": "/servers/unflag_words", "params": server,
+                    "json": [f"extra{self.random.randint(1, max(1, guild['next_word']))}"]}
+        raise ValueError(f"Unknown route in the traffic mix: {route}")
+
+
+async def run_step(client, source, concurrency: int, duration: float | None, count: int | None) -> dict:
+    stats: dict[str, dict] = {}
+    deadline = time.perf_counter() + duration if duration else None
+    issued = 0
+
+    def take():
+        nonlocal issued
+        if (deadline is not None and time.perf_counter() >= deadline) or (count is not None and issued >= count):
+            return None
+        issued = issued + 1
+        return source()
+
+    async def worker():
+        while True:
+            request = take()
+            if request is None:
+                return
+            route = stats.setdefault(request["route"], {"latencies": [], "errors": 0, "statuses": {}})
+            start = time.perf_counter()
+            try:
+                response = await client.request(request["method"], request["path"], request.get("params"),
+                                                request.get("json"))
+                status = response.status
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                status = 0
+            route["latencies"].append(time.perf_counter() - start)
+            route["statuses"][status] = route["statuses"].get(status, 0) + 1
+            if status == 0 or status >= 500:
+                route["errors"] = route["errors"] + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    report = {"concurrency": concurrency, "elapsed_s": elapsed, "routes": {}}
+    all_latencies, all_errors = [], 0
+    for name, route in stats.items():
+        latencies = route["latencies"]
+        all_latencies.extend(latencies)
+        all_errors = all_errors + route["errors"]
+        report["routes"][name] = {"requests": len(latencies),
+                                  "rps": len(latencies) / elapsed,
+                                  "p50_ms": percentile(latencies, 0.50) * 1000,
+                                  "p95_ms": percentile(latencies, 0.95) * 1000,
+                                  "p99_ms": percentile(latencies, 0.99) * 1000,
+                                  "error_rate": route["errors"] / len(latencies),
+                                  "statuses": {str(key): val for key, val in route["statuses"].items()}}
+    if len(all_latencies) > 0:
+        report["total"] = {"requests": len(all_latencies),
+                           "rps": len(all_latencies) / elapsed,
+                           "p50_ms": percentile(all_latencies, 0.50) * 1000,
+                           "p95_ms": percentile(all_latencies, 0.95) * 1000,
+                           "p99_ms": percentile(all_latencies, 0.99) * 1000,
+                           "error_rate": all_errors / len(all_latencies)}
+    return report
+
+
+def print_step(step: dict):
+    print(f"\nconcurrency={step['concurrency']} elapsed={step['elapsed_s']:.2f}s")
+    print(f"{'route':<28}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    rows = sorted(step["routes"].items())
+    if "total" in step:
+        rows.append(("total", step["total"]))
+    for name, route in rows:
+        print(f"{name:<28}{route['requests']:>10}{route['rps']:>10.1f}{route['p50_ms']:>10.2f}"
+              f"{route['p95_ms']:>10.2f}{route['p99_ms']:>10.2f}{route['error_rate'] * 100:>8.2f}%")
+
+
+def find_knee(steps: list[dict], factor: float) -> dict | None:
+    previous = None
+    for step in steps:
+        if "total" not in step:
+            continue
+        if previous is not None:
+            latency_growth = step["total"]["p99_ms"] / max(previous["total"]["p99_ms"], 1e-9)
+            throughput_growth = step["total"]["rps"] / max(previous["total"]["rps"], 1e-9)
+            if latency_growth >= factor and throughput_growth < 1.1:
+                return {"concurrency": step["concurrency"], "previous_concurrency": previous["concurrency"],
+                        "p99_growth": latency_growth, "throughput_growth": throughput_growth}
+        previous = step
+    return None
+
+
+def load_trace(path: str) -> list[dict]:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+async def main_async(args) -> dict:
+    if args.url:
+        client = HttpClient(args.url, connections=max(args.concurrency))
+    else:
+        if "STORAGE_BACKEND" not in os.environ:
+            config.STORAGE_BACKEND = "memory"
+        from main import app
+        client = InProcessClient(app)
+
+    traffic = Traffic(args.guilds, args.mean_guild_size, args.guild_size_dist, args.words, args.seed)
+    mix = dict(DEFAULT_MIX)
+    for item in args.mix or []:
+        route, _, weight = item.partition("=")
+        mix[route] = int(weight)
+    mix = {route: weight for route, weight in mix.items() if weight > 0}
+
+    trace = load_trace(args.trace) if args.trace else None
+    recorded = [] if args.record else None
+    position = 0
+
+    def source() -> dict:
+        nonlocal position
+        if trace is not None:
+            request = trace[position % len(trace)]
+            position = position + 1
+        else:
+            request = traffic.next(mix)
+        if recorded is not None:
+            recorded.append(request)
+        return request
+
+    await client.start()
+    try:
+        if not args.skip_setup and trace is None:
+            setup = traffic.setup()
+            step = await run_step(client, iter(setup).__next__, min(8, max(args.concurrency)), None, len(setup))
+            print(f"Setup: {step.get('total', {}).get('requests', 0)} requests in {step['elapsed_s']:.2f}s",
+                  file=sys.stderr)
+
+        steps = []
+        for concurrency in args.concurrency:
+            step = await run_step(client, source, concurrency, args.duration, args.requests)
+            print_step(step)
+            steps.append(step)
+
+    finally:
+        await client.close()
+
+    if recorded is not None:
+        with open(args.record, "w") as file:
+            for request in recorded:
+                file.write(json.dumps(request) + "\n")
+
+    knee = find_knee(steps, args.knee_factor)
+    if knee is not None:
+        print(f"\nLatency climbs at concurrency {knee['concurrency']}: p99 grew {knee['p99_growth']:.1f}x over "
+              f"concurrency {knee['previous_concurrency']} while throughput grew {knee['throughput_growth']:.2f}x")
+    else:
+        print("\nNo saturation point found in the tested concurrency range")
+
+    return {"target": args.url or "in-process", "mix": mix, "steps": steps, "knee": knee}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Traffic replay load generator for the WordBot API")
+    parser.add_argument("--url", help="Base URL of a running API, the app is driven in-process when omitted")
+    parser.add_argument("--concurrency", type=lambda value: [int(item) for item in value.split(",")],
+                        default=[1, 8, 32, 128], help="Comma separated concurrency levels to sweep")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+    parser.add_argument("--requests", type=int, default=None, help="Requests per concurrency level instead")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--mean-guild-size", type=int, default=2000)
+    parser.add_argument("--guild-size-dist", choices=["pareto", "uniform", "fixed"], default="pareto")
+    parser.add_argument("--words", type=int, default=30, help="Flagged words per guild")
+    parser.add_argument("--mix", nargs="*", help="Route weight overrides such as update_user_flags=60")
+    parser.add_argument("--trace", help="Replay requests from an NDJSON trace instead of synthesizing them")
+    parser.add_argument("--record", help="Write the issued requests to an NDJSON trace")
+    parser.add_argument("--skip-setup", action="store_true", help="Do not create the synthetic guilds first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--knee-factor", type=float, default=2.0,
+                        help="p99 growth between levels, without throughput growth, reported as saturation")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    if args.requests is not None:
+        args.duration = None
+
+    report = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    failed = any(step.get("total", {}).get("error_rate", 0) > 0 for step in report["steps"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from app import config
+from benchmarks.crud import summarize
+from benchmarks.loadgen import InProcessClient
+
+DC_SERVER_ID = 1
+DC_USER_ID = 1
+
+ROUTES = {
+    "users.get_profile": ("/users/get_profile", {"dc_server_id": DC_SERVER_ID, "dc_user_id": DC_USER_ID}),
+    "users.get_flagged_words": ("/users/get_flagged_words", {"dc_server_id": DC_SERVER_ID, "dc_user_id": DC_USER_ID}),
+    "servers.get_profile": ("/servers/get_profile", {"dc_server_id": DC_SERVER_ID}),
+    "servers.get_flagged_words": ("/servers/get_flagged_words", {"dc_server_id": DC_SERVER_ID}),
+}
+
+
+async def seed(client: InProcessClient, words: int):
+    from app import database
+    from app.crud import flag_cache
+
+    for collection in (database.users, database.servers):
+        await collection.delete_many({})
+    flag_cache.cache.clear()
+
+    await client.request("POST", "/servers/create_profile", {"dc_server_id": DC_SERVER_ID})
+    for start in range(0, words, 1000):
+        batch = [f"word{i}" for i in range(start, min(start + 1000, words))]
+        await client.request("PATCH", "/servers/flag_words", {"dc_server_id": DC_SERVER_ID}, batch)
+    await client.request("POST", "/users/create_profile", {"dc_server_id": DC_SERVER_ID, "dc_user_id": DC_USER_ID})
+    await client.request("PUT", "/users/update_user_flags", {"dc_server_id": DC_SERVER_ID, "dc_user_id": DC_USER_ID},
+                         {f"word{i}": i + 1 for i in range(words)})
+
+
+async def measure(client: InProcessClient, path: str, params: dict, iterations: int) -> tuple[dict, bytes]:
+    samples = []
+    body = b""
+    for _ in range(iterations):
+        start = time.process_time()
+        response = await client.request("GET", path, params)
+        samples.append(time.process_time() - start)
+        body = response.body
+    return summarize(samples), body
+
+
+async def run(args):
+    from main import app
+
+    client = InProcessClient(app)
+    await client.start()
+    try:
+        print(f"{'route':<26} {'words':>6} {'model cpu':>12} {'fast cpu':>12} {'saved':>7}")
+        for words in args.words:
+            await seed(client, words)
+            for name, (path, params) in ROUTES.items():
+                if args.only and not any(pattern in name for pattern in args.only):
+                    continue
+
+                config.FAST_RESPONSES = False
+                model, model_body = await measure(client, path, params, args.iterations)
+                config.FAST_RESPONSES = True
+                fast, fast_body = await measure(client, path, params, args.iterations)
+
+                if model_body.replace(b" ", b"") != fast_body.replace(b" ", b""):
+                    print(f"{name}: response bodies differ with {words} words", file=sys.stderr)
+                    return 1
+
+                saved = 1 - fast["mean_ms"] / model["mean_ms"] if model["mean_ms"] > 0 else 0.0
+                print(f"{name:<26} {words:>6} {model['mean_ms']:>10.3f}ms {fast['mean_ms']:>10.3f}ms "
+                      f"{saved * 100:>6.1f}%")
+
+    finally:
+        await client.close()
+
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CPU time per request of model-validated and fast-path responses")
+    parser.add_argument("--words", type=int, nargs="*", default=[10, 100, 1000, 10000],
+                        help="Sizes of the words map to benchmark")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", nargs="*", help="Only run routes whose name contains one of these strings")
+    args = parser.parse_args()
+
+    if "STORAGE_BACKEND" not in os.environ:
+        config.STORAGE_BACKEND = "memory"
+
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
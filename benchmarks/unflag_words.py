@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import os
+import time
+
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app import indexes
+from app.crud import users as crud_user
+from app.utility import validate_and_transform
+
+DC_SERVER_ID = 1
+
+
+async def legacy_unflag_words(server_profiles, user_profiles, dc_server_id: int, words: list[str]):
+    bulk_ops = []
+    input_words = [validate_and_transform(word) for word in words]
+
+    async for user in user_profiles.find({"discord_server_id": dc_server_id}):
+        flags = user.get("words")
+        unset_data = {}
+        flagged_count_remove = 0
+
+        for del_word in input_words:
+            if del_word in flags.keys():
+                unset_data.update({f"words.{del_word}": 0})
+                flagged_count_remove = flagged_count_remove + flags[del_word]
+
+        bulk_ops.append(pymongo.UpdateOne(
+            filter={"discord_server_id": dc_server_id, "discord_user_id": user["discord_user_id"]},
+            update={"$unset": unset_data, "$inc": {"total_flagged_words": flagged_count_remove * -1}}
+        ))
+
+    await user_profiles.bulk_write(bulk_ops)
+
+
+async def seed(server_profiles, user_profiles, members: int, words: int, unflag: int):
+    await user_profiles.delete_many({"discord_server_id": DC_SERVER_ID})
+    # The server no longer flags the removed words, as after PATCH /servers/unflag_words
+    await server_profiles.delete_many({"discord_server_id": DC_SERVER_ID})
+    await server_profiles.insert_one({"discord_server_id": DC_SERVER_ID, "total_words": 0, "total_flagged_words": 0,
+                                      "words": {f"word{i}": 0 for i in range(unflag, words)}})
+
+    flags = {f"word{i}": 1 for i in range(words)}
+    batch = []
+    for user_id in range(1, members + 1):
+        batch.append({"discord_server_id": DC_SERVER_ID,
+                      "discord_user_id": user_id,
+                      "total_words": words * 10,
+                      "total_flagged_words": words,
+                      "words": flags})
+        if len(batch) == 10000:
+            await user_profiles.insert_many(batch)
+            batch = []
+    if len(batch) > 0:
+        await user_profiles.insert_many(batch)
+
+
+async def run(members: int, words: int, unflag: int):
+    client = AsyncIOMotorClient(os.environ.get("URI", "mongodb://localhost:27017"))
+    database = client[os.environ.get("BENCH_NAME", "wordbot_bench")]
+    user_profiles = database["user_profiles"]
+    server_profiles = database["server_profiles"]
+    removed = [f"word{i}" for i in range(unflag)]
+
+    try:
+        await indexes.ensure_indexes(database)
+        for name, implementation in (("legacy", legacy_unflag_words), ("pipeline", crud_user.unflag_words)):
+            await seed(server_profiles, user_profiles, members, words, unflag)
+            start = time.perf_counter()
+            await implementation(server_profiles, user_profiles, DC_SERVER_ID, removed)
+            elapsed = time.perf_counter() - start
+
+            sample = await user_profiles.find_one({"discord_server_id": DC_SERVER_ID}, {"_id": 0, "words": 0})
+            print(f"{name:>8}: {elapsed:8.3f}s  ({members / elapsed:10.0f} members/s)  sample={sample}")
+
+        await user_profiles.delete_many({"discord_server_id": DC_SERVER_ID})
+        await server_profiles.delete_many({"discord_server_id": DC_SERVER_ID})
+
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the legacy and pipeline unflag_words on a synthetic guild")
+    parser.add_argument("--members", type=int, default=200000)
+    parser.add_argument("--words", type=int, default=50)
+    parser.add_argument("--unflag", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.members, args.words, args.unflag))
@@ -1,11 +1,29 @@
 from fastapi import FastAPI
+from app import change_streams, config, counter_compaction, jobs, metrics, profiling, write_buffer
 from app.database import connect, close
-from app.endpoints import user_profiles, server_profiles
+from app.endpoints import user_profiles, server_profiles, health, jobs as jobs_endpoint, \
+    metrics as metrics_endpoint, profiling as profiling_endpoint
 
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
+if config.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
 
 app.add_event_handler("startup", connect)
+app.add_event_handler("startup", change_streams.start)
+app.add_event_handler("startup", write_buffer.start)
+app.add_event_handler("startup", counter_compaction.start)
+app.add_event_handler("startup", jobs.start)
+app.add_event_handler("shutdown", jobs.stop)
+app.add_event_handler("shutdown", write_buffer.stop)
+app.add_event_handler("shutdown", counter_compaction.stop)
+app.add_event_handler("shutdown", change_streams.stop)
 app.add_event_handler("shutdown", close)
 
 app.include_router(user_profiles.router, prefix='/users', tags=['Users'])
 app.include_router(server_profiles.router, prefix='/servers', tags=['Servers'])
+app.include_router(jobs_endpoint.router, prefix='/jobs', tags=['Jobs'])
+app.include_router(metrics_endpoint.router, tags=['Metrics'])
+app.include_router(health.router, tags=['Health'])
+if config.PROFILING_ENABLED:
+    app.include_router(profiling_endpoint.router, prefix='/admin', tags=['Admin'])
@@ -0,0 +1,32 @@
+import pytest
+
+from app import indexes, matcher
+from app.crud import flag_cache, user_cache
+from app.storage.memory import MemoryClient
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def database():
+    database = MemoryClient()["wordbot_test"]
+    await indexes.ensure_indexes(database)
+    yield database
+
+    # The caches are module singletons and would leak documents into the next test's fresh database
+    flag_cache.cache.clear()
+    user_cache.cache.clear()
+    matcher.cache.clear()
+
+
+@pytest.fixture
+def users(database):
+    return database["user_profiles"]
+
+
+@pytest.fixture
+def servers(database):
+    return database["server_profiles"]
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from app import change_streams, database
+from app.crud import flag_cache, user_cache
+
+# Change streams need a replica set, e.g. MONGO_REPLSET_URI=mongodb://localhost:27017/?directConnection=true
+REPLSET_URI = os.environ.get("MONGO_REPLSET_URI")
+
+pytestmark = [pytest.mark.anyio,
+              pytest.mark.skipif(not REPLSET_URI, reason="MONGO_REPLSET_URI is not set to a replica set")]
+
+
+@pytest.fixture
+async def mongo(monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(REPLSET_URI)
+    name = f"wordbot_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(database, "users", client[name]["user_profiles"])
+    monkeypatch.setattr(database, "servers", client[name]["server_profiles"])
+    monkeypatch.setattr(user_cache, "cache", user_cache.UserProfileCache(max_bytes=1_000_000, ttl=60))
+    monkeypatch.setattr(flag_cache, "cache", flag_cache.FlagSetCache(max_size=100, ttl=60))
+    yield client[name]
+
+    await client.drop_database(name)
+    client.close()
+
+
+async def watch(watcher: change_streams.Watcher):
+    events = []
+    handler = watcher.handler
+
+    async def record(change: dict):
+        await handler(change)
+        events.append(change)
+
+    watcher.handler = record
+    task = asyncio.create_task(watcher.run())
+    # The token is only set once the first batch came back, so every later write is seen by the stream
+    await wait_until(lambda: watcher.resume_token is not None)
+    return task, events
+
+
+def seen(events: list[dict], id) -> bool:
+    return any(change["documentKey"]["_id"] == id for change in events)
+
+
+async def wait_until(condition, timeout: float = 10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.05)
+
+
+async def stop(task: asyncio.Task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def test_user_change_invalidates_cached_profile(mongo):
+    users = mongo["user_profiles"]
+    await users.insert_many([{"discord_server_id": 1, "discord_user_id": user_id, "total_words": 0}
+                             for user_id in (1, 2)])
+    cached = await users.find_one({"discord_user_id": 1}, user_cache.PROJECTION)
+    user_cache.cache.put(1, 1, cached, user_cache.cache.generation_of(1, 1))
+
+    task, events = await watch(change_streams.Watcher(users, change_streams.USER_PIPELINE,
+                                                      change_streams.on_user_change, retry_delay=0.1))
+    try:
+        await users.update_one({"discord_user_id": 1}, {"$inc": {"total_words": 1}})
+        await wait_until(lambda: seen(events, cached["_id"]))
+        assert user_cache.cache.get(1, 1) is None
+        assert set(events[0]) <= {"_id", "operationType", "documentKey"}
+
+        # A profile cached after the stream was opened is covered as well
+        cached = await users.find_one({"discord_user_id": 2}, user_cache.PROJECTION)
+        user_cache.cache.put(1, 2, cached, user_cache.cache.generation_of(1, 2))
+        assert user_cache.cache.get(1, 2) is not None
+        await users.update_one({"discord_user_id": 2}, {"$inc": {"total_words": 1}})
+        await wait_until(lambda: seen(events, cached["_id"]))
+        assert user_cache.cache.get(1, 2) is None
+    finally:
+        await stop(task)
+
+
+async def test_flag_change_invalidates_server(mongo):
+    servers = mongo["server_profiles"]
+    result = await servers.insert_one({"discord_server_id": 1, "total_words": 0, "words": {}})
+    flag_cache.cache.put(1, frozenset(), flag_cache.cache.generation)
+
+    task, events = await watch(change_streams.Watcher(servers, change_streams.SERVER_PIPELINE,
+                                                      change_streams.on_server_change, retry_delay=0.1))
+    try:
+        await servers.update_one({"discord_server_id": 1}, {"$inc": {"total_words": 1}})
+        await servers.update_one({"discord_server_id": 1}, {"$set": {"words.foo": 0}})
+        await wait_until(lambda: seen(events, result.inserted_id))
+        assert len(events) == 1
+        assert flag_cache.cache.get(1) is None
+    finally:
+        await stop(task)
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from app.crud import coalescing
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_invalidated_server_starts_a_new_flight():
+    flights = coalescing.SingleFlight(enabled=True)
+    release = asyncio.Event()
+    calls = []
+
+    async def read(dc_server_id: int):
+        calls.append(dc_server_id)
+        await release.wait()
+
+    def run(dc_server_id: int) -> asyncio.Future:
+        return asyncio.ensure_future(flights.run("read", (dc_server_id,), dc_server_id, lambda: read(dc_server_id)))
+
+    started = [run(1), run(2)]
+    await asyncio.sleep(0)
+    flights.invalidate(1)
+    started.extend([run(1), run(2)])
+    await asyncio.sleep(0)
+    release.set()
+
+    await asyncio.gather(*started)
+    assert calls == [1, 2, 1]
+
+
+def test_server_generations_stay_bounded():
+    flights = coalescing.SingleFlight(enabled=True)
+    for dc_server_id in range(1, 3 * coalescing.SERVER_GENERATION_SLOTS):
+        flights.invalidate(dc_server_id)
+
+    assert len(flights.server_generations) == coalescing.SERVER_GENERATION_SLOTS
@@ -0,0 +1,138 @@
+import pytest
+
+from app import config
+from app.Exceptions.database_exceptions import DatabaseException
+from app.crud import server_counters, servers as crud_servers, users as crud_users
+from app.schemas.user_schemas import UserIngestEvent
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_create_profile(servers):
+    assert (await crud_servers.check_if_exists(servers, 1)).exists is False
+
+    await crud_servers.create_profile(servers, 1)
+
+    assert (await crud_servers.check_if_exists(servers, 1)).exists is True
+    profile = await crud_servers.get_profile(servers, 1)
+    assert profile.total_words == 0
+    assert profile.words == {}
+
+
+async def test_flag_and_unflag_words(servers):
+    await crud_servers.create_profile(servers, 1)
+
+    flagged = await crud_servers.flag_words(servers, 1, ["Foo", "bar"])
+    assert flagged.flagged == ["foo", "bar"]
+    conflicts = await crud_servers.flag_words(servers, 1, ["foo", "baz"])
+    assert conflicts.conflicts == ["foo"]
+
+    await crud_servers.update_flags(servers, 1, {"foo": 3, "bar": 2, "other": 7})
+    unflagged = await crud_servers.unflag_words(servers, 1, ["foo", "nope"])
+
+    assert unflagged.unflagged == ["foo"]
+    assert unflagged.ignored == ["nope"]
+    profile = await crud_servers.get_profile(servers, 1)
+    assert profile.words == {"bar": 2, "baz": 0}
+    assert profile.total_flagged_words == 2
+
+
+async def test_unflag_unknown_words_fails(servers):
+    await crud_servers.create_profile(servers, 1)
+
+    with pytest.raises(DatabaseException):
+        await crud_servers.unflag_words(servers, 1, ["foo"])
+
+
+async def test_etag_changes_on_write(servers):
+    await crud_servers.create_profile(servers, 1)
+    before = await crud_servers.get_etag(servers, 1)
+
+    await crud_servers.update_total_words_count(servers, 1, 5)
+
+    assert await crud_servers.get_etag(servers, 1) != before
+
+
+async def test_sharded_counters(servers, monkeypatch):
+    monkeypatch.setattr(config, "SERVER_COUNTER_SHARDS", 4)
+    await crud_servers.create_profile(servers, 1)
+    await crud_servers.flag_words(servers, 1, ["foo"])
+
+    etags = [await crud_servers.get_etag(servers, 1)]
+    for _ in range(10):
+        await crud_servers.update_total_words_count(servers, 1, 2)
+        await crud_servers.update_flags(servers, 1, {"foo": 1})
+        etags.append(await crud_servers.get_etag(servers, 1))
+
+    await server_counters.compact(servers)
+    etags.append(await crud_servers.get_etag(servers, 1))
+
+    profile = await crud_servers.get_profile(servers, 1)
+    assert profile.total_words == 20
+    assert profile.total_flagged_words == 10
+    assert profile.words == {"foo": 10}
+    versions = [int(etag.strip('"').rsplit("-", 1)[1]) for etag in etags]
+    assert versions == sorted(set(versions))
+
+
+async def test_get_members_ids_pages(servers, users):
+    await crud_servers.create_profile(servers, 1)
+    await crud_users.create_multiple_profiles(users, servers, 1, [5, 1, 4, 2, 3])
+
+    first = await crud_servers.get_members_ids(users, 1, limit=2)
+    second = await crud_servers.get_members_ids(users, 1, after_id=int(first.next_after_id), limit=10)
+
+    assert first.ids == ["1", "2"]
+    assert second.ids == ["3", "4", "5"]
+    assert second.next_after_id is None
+
+
+async def test_get_members_ids_of_empty_server(servers, users):
+    await crud_servers.create_profile(servers, 1)
+
+    with pytest.raises(DatabaseException):
+        await crud_servers.get_members_ids(users, 1)
+
+
+async def test_hashed_shards_follow_the_user(servers, users, monkeypatch):
+    monkeypatch.setattr(config, "SERVER_COUNTER_SHARDS", 4)
+    monkeypatch.setattr(config, "SERVER_COUNTER_SHARD_MODE", "hash")
+    await crud_servers.create_profile(servers, 1)
+    await crud_servers.flag_words(servers, 1, ["foo"])
+    await crud_users.create_profile(users, servers, 1, 10)
+
+    for _ in range(5):
+        await crud_servers.update_total_words_count(servers, 1, 2, 10)
+        await crud_servers.update_flags(servers, 1, {"foo": 1}, 10)
+    await crud_users.ingest(users, servers, [UserIngestEvent(dc_server_id=1, dc_user_id=10, total_words_delta=1)])
+
+    shards = await server_counters.shards_collection(servers).find({}, {"_id": 0, "shard": 1}).to_list(None)
+    assert shards == [{"shard": server_counters.pick_shard(10)}]
+    assert (await crud_servers.get_profile(servers, 1)).total_words == 11
+
+
+@pytest.mark.parametrize("compact_first", [True, False])
+async def test_compaction_during_read_counts_once(servers, monkeypatch, compact_first):
+    monkeypatch.setattr(config, "SERVER_COUNTER_SHARDS", 4)
+    await crud_servers.create_profile(servers, 1)
+    for _ in range(5):
+        await crud_servers.update_total_words_count(servers, 1, 2)
+
+    sum_shards = server_counters.sum_shards
+    compactions = []
+
+    async def interleaved(server_profiles, dc_server_id, applied):
+        # The first read overlaps a compaction that runs after the profile was read
+        if len(compactions) > 0:
+            return await sum_shards(server_profiles, dc_server_id, applied)
+        if compact_first:
+            compactions.append(await server_counters.compact(servers))
+            return await sum_shards(server_profiles, dc_server_id, applied)
+        totals = await sum_shards(server_profiles, dc_server_id, applied)
+        compactions.append(await server_counters.compact(servers))
+        return totals
+
+    monkeypatch.setattr(server_counters, "sum_shards", interleaved)
+
+    assert (await crud_servers.get_total_words(servers, 1)).total_words == 10
+    assert compactions[0] > 0
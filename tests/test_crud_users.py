@@ -0,0 +1,217 @@
+import datetime
+
+import pytest
+from pydantic import ValidationError
+
+from app import config
+from app.Exceptions.database_exceptions import DatabaseException
+from app.crud import archive, servers as crud_servers, users as crud_users
+from app.schemas.user_schemas import UserIngestEvent
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def server(servers):
+    await crud_servers.create_profile(servers, 1)
+    await crud_servers.flag_words(servers, 1, ["foo", "bar"])
+    return 1
+
+
+async def test_create_profile(servers, users, server):
+    await crud_users.create_profile(users, servers, server, 10)
+
+    profile = await crud_users.get_profile(users, servers, server, 10)
+    assert profile.words == {"foo": 0, "bar": 0}
+    with pytest.raises(DatabaseException):
+        await crud_users.create_profile(users, servers, server, 10)
+
+
+async def test_create_profile_without_server(servers, users):
+    with pytest.raises(DatabaseException):
+        await crud_users.create_profile(users, servers, 1, 10)
+
+
+async def test_create_multiple_profiles_reports_conflicts(servers, users, server):
+    await crud_users.create_profile(users, servers, server, 10)
+
+    result = await crud_users.create_multiple_profiles(users, servers, server, [10, 11, 12])
+
+    assert result.inserted == [11, 12]
+    assert result.conflicts == [10]
+
+
+async def test_update_flags_counts_only_flagged_words(servers, users, server):
+    await crud_users.create_profile(users, servers, server, 10)
+
+    await crud_users.update_flags(users, servers, server, 10, {"foo": 2, "other": 5})
+    await crud_users.update_total_words_count(users, server, 10, 7)
+
+    profile = await crud_users.get_profile(users, servers, server, 10)
+    assert profile.words == {"foo": 2, "bar": 0}
+    assert profile.total_flagged_words == 2
+    assert profile.total_words == 7
+
+
+async def test_update_flags_of_missing_profile(servers, users, server):
+    with pytest.raises(DatabaseException):
+        await crud_users.update_flags(users, servers, server, 10, {"foo": 1})
+
+
+async def test_flag_and_unflag_words(servers, users, server):
+    await crud_users.create_profile(users, servers, server, 10)
+    await crud_users.update_flags(users, servers, server, 10, {"foo": 2, "bar": 3})
+
+    await crud_servers.flag_words(servers, server, ["baz"])
+    await crud_users.flag_words(servers, users, server, ["baz", "foo"])
+    await crud_servers.unflag_words(servers, server, ["bar"])
+    result = await crud_users.unflag_words(servers, users, server, ["bar"])
+
+    assert (result.unflagged, result.ignored) == (["bar"], [])
+    profile = await crud_users.get_profile(users, servers, server, 10)
+    assert profile.words == {"foo": 2, "baz": 0}
+    assert profile.total_flagged_words == 2
+
+
+async def test_unflag_words_ignores_words_the_server_still_flags(servers, users, server):
+    await crud_users.create_profile(users, servers, server, 10)
+    await crud_users.update_flags(users, servers, server, 10, {"foo": 2, "bar": 3})
+    await crud_servers.unflag_words(servers, server, ["bar"])
+
+    result = await crud_users.unflag_words(servers, users, server, ["foo", "bar", "bar"])
+
+    assert (result.unflagged_count, result.ignored_count) == (1, 1)
+    assert (result.unflagged, result.ignored) == (["bar"], ["foo"])
+    profile = await crud_users.get_profile(users, servers, server, 10)
+    assert profile.words == {"foo": 2}
+    assert profile.total_flagged_words == 2
+
+
+async def test_remove_user_updates_server(servers, users, server):
+    await crud_users.create_profile(users, servers, server, 10)
+    await crud_users.update_flags(users, servers, server, 10, {"foo": 2})
+    await crud_servers.update_flags(servers, server, {"foo": 2})
+    await crud_users.update_total_words_count(users, server, 10, 4)
+    await crud_servers.update_total_words_count(servers, server, 4)
+
+    await crud_users.remove_user(servers, users, server, 10)
+
+    assert (await crud_users.check_if_exists(users, server, 10)).exists is False
+    profile = await crud_servers.get_profile(servers, server)
+    assert profile.total_words == 0
+    assert profile.words == {"foo": 0, "bar": 0}
+
+
+async def test_ingest(servers, users, server):
+    await crud_users.create_profile(users, servers, server, 10)
+
+    result = await crud_users.ingest(users, servers, [
+        UserIngestEvent(dc_server_id=server, dc_user_id=10, total_words_delta=3, flags={"foo": 1}),
+        UserIngestEvent(dc_server_id=server, dc_user_id=10, total_words_delta=2, flags={"foo": 1, "other": 1}),
+        UserIngestEvent(dc_server_id=server, dc_user_id=11, total_words_delta=1),
+        UserIngestEvent(dc_server_id=2, dc_user_id=10, total_words_delta=1),
+    ])
+
+    assert [item.success for item in result.results] == [True, True, False, False]
+    profile = await crud_users.get_profile(users, servers, server, 10)
+    assert profile.total_words == 5
+    assert profile.words["foo"] == 2
+    assert (await crud_servers.get_profile(servers, server)).total_words == 5
+
+
+def test_ingest_event_ids_fit_int64():
+    UserIngestEvent(dc_server_id=2 ** 63 - 1, dc_user_id=1)
+    with pytest.raises(ValidationError):
+        UserIngestEvent(dc_server_id=1, dc_user_id=2 ** 63)
+
+
+async def test_match_messages(servers, server):
+    result = await crud_users.match_messages(servers, server, ["Foo foobar bar!", "FOO"])
+
+    assert result.flags == {"foo": 2, "bar": 1}
+    assert result.total_words == 4
+
+
+async def test_sparse_profiles_read_flags_as_zero(servers, users, server, monkeypatch):
+    monkeypatch.setattr(config, "SPARSE_FLAGS", True)
+    await crud_users.create_profile(users, servers, server, 10)
+
+    assert (await users.find_one({"discord_user_id": 10}))["words"] == {}
+    profile = await crud_users.get_profile(users, servers, server, 10)
+    assert profile.words == {"foo": 0, "bar": 0}
+
+
+async def test_archived_profiles_stay_readable(servers, users, server, monkeypatch):
+    monkeypatch.setattr(config, "ARCHIVE_INACTIVE_DAYS", 30.0)
+    await crud_users.create_multiple_profiles(users, servers, server, [10, 11])
+    await crud_users.update_flags(users, servers, server, 10, {"foo": 2})
+
+    moved = await archive.archive_profiles(users, [document["_id"] async for document in users.find({})],
+                                           archive.now() + datetime.timedelta(seconds=1))
+
+    assert moved == 2
+    assert await users.count_documents({}) == 0
+    assert (await crud_users.get_profile(users, servers, server, 10)).words["foo"] == 2
+    assert (await crud_servers.get_members_ids(users, server)).ids == ["10", "11"]
+
+    await crud_users.update_total_words_count(users, server, 10, 1)
+
+    assert await users.count_documents({}) == 1
+    assert (await crud_users.get_profile(users, servers, server, 10)).total_words == 1
+
+
+async def archive_all(users) -> int:
+    return await archive.archive_profiles(users, [document["_id"] async for document in users.find({})],
+                                          archive.now() + datetime.timedelta(seconds=1))
+
+
+async def test_write_restores_archived_profile(servers, users, server, monkeypatch):
+    monkeypatch.setattr(config, "ARCHIVE_INACTIVE_DAYS", 30.0)
+    await crud_users.create_profile(users, servers, server, 10)
+    await archive_all(users)
+
+    await crud_users.update_flags(users, servers, server, 10, {"foo": 2})
+
+    assert await archive.archive_collection(users).count_documents({}) == 0
+    assert (await users.find_one({"discord_user_id": 10}))["words"]["foo"] == 2
+
+
+async def test_write_after_concurrent_restore(servers, users, server, monkeypatch):
+    monkeypatch.setattr(config, "ARCHIVE_INACTIVE_DAYS", 30.0)
+    await crud_users.create_profile(users, servers, server, 10)
+    await archive_all(users)
+
+    restore = archive.restore
+
+    async def restored_by_another_write(user_profiles, members):
+        await restore(user_profiles, members)
+        return await restore(user_profiles, members)
+
+    monkeypatch.setattr(archive, "restore", restored_by_another_write)
+    await crud_users.update_total_words_count(users, server, 10, 5)
+
+    assert (await users.find_one({"discord_user_id": 10}))["total_words"] == 5
+
+
+async def test_flag_words_reaches_archived_profiles(servers, users, server, monkeypatch):
+    monkeypatch.setattr(config, "ARCHIVE_INACTIVE_DAYS", 30.0)
+    await crud_users.create_profile(users, servers, server, 10)
+    await archive_all(users)
+
+    await crud_servers.flag_words(servers, server, ["baz"])
+    await crud_users.flag_words(servers, users, server, ["baz"])
+
+    assert (await crud_users.get_profile(users, servers, server, 10)).words["baz"] == 0
+    await crud_users.update_flags(users, servers, server, 10, {"baz": 1})
+    assert (await users.find_one({"discord_user_id": 10}))["words"] == {"foo": 0, "bar": 0, "baz": 1}
+
+
+async def test_archive_is_left_alone_when_disabled(servers, users, server):
+    await archive.archive_collection(users).insert_one({"discord_server_id": server, "discord_user_id": 10,
+                                                        "total_words": 0, "words": {}})
+
+    await crud_users.flag_archived_members(users, server, ["foo"])
+    await crud_users.remove_members(users, server)
+
+    assert await archive.archive_collection(users).find_one({"discord_user_id": 10}, {"_id": 0}) == {
+        "discord_server_id": server, "discord_user_id": 10, "total_words": 0, "words": {}}
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app import database as app_database, jobs
+from app.crud import jobs as crud_jobs, servers as crud_servers, users as crud_users
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def queue(database, users, servers, monkeypatch):
+    monkeypatch.setattr(app_database, "users", users)
+    monkeypatch.setattr(app_database, "servers", servers)
+    await crud_servers.create_profile(servers, 1)
+    await crud_users.create_multiple_profiles(users, servers, 1, [1, 2, 3, 4, 5])
+    return database["jobs"]
+
+
+def runner(queue, lease: float = 60.0) -> jobs.JobRunner:
+    return jobs.JobRunner(queue, batch_size=2, concurrency=1, max_running=10, lease=lease, poll_interval=60.0,
+                          max_attempts=3)
+
+
+async def test_claim_is_exclusive(queue):
+    await crud_jobs.create_job(queue, "flag_words", 1, {"words": ["foo"]})
+    job, = await crud_jobs.find_claimable(queue, 10)
+
+    assert await crud_jobs.claim(queue, job, "a", 60.0)
+    assert not await crud_jobs.claim(queue, job, "b", 60.0)
+    assert await crud_jobs.find_claimable(queue, 10) == []
+
+
+async def test_expired_lease_is_taken_over(queue):
+    await crud_jobs.create_job(queue, "flag_words", 1, {"words": ["foo"]})
+    job, = await crud_jobs.find_claimable(queue, 10)
+    assert await crud_jobs.claim(queue, job, "a", 0.0)
+
+    job, = await crud_jobs.find_claimable(queue, 10)
+    assert job["owner"] == "a"
+    assert await crud_jobs.claim(queue, job, "b", 60.0)
+
+    # The previous owner can no longer record progress or finish the job
+    assert not await crud_jobs.save_progress(queue, job["_id"], "a", 3, 3, 60.0)
+    await crud_jobs.finish(queue, job["_id"], "a", crud_jobs.DONE)
+    job = await queue.find_one({"_id": job["_id"]})
+    assert (job["owner"], job["status"], job["attempts"]) == ("b", crud_jobs.RUNNING, 2)
+
+
+async def test_job_resumes_from_saved_cursor(queue, users, servers):
+    await crud_servers.flag_words(servers, 1, ["foo"])
+    await crud_jobs.create_job(queue, "flag_words", 1, {"words": ["foo"]})
+    job, = await crud_jobs.find_claimable(queue, 10)
+    assert await crud_jobs.claim(queue, job, "a", 0.0)
+    # The first owner stopped after saving the progress of its first wave
+    await crud_jobs.save_progress(queue, job["_id"], "a", 2, 2, 0.0)
+
+    job_runner = runner(queue)
+    await job_runner._claim()
+    await asyncio.gather(*job_runner._running.values())
+
+    flagged = {document["discord_user_id"] async for document in users.find({"words.foo": 0})}
+    assert flagged == {3, 4, 5}
+    job = await queue.find_one({"_id": job["_id"]})
+    assert (job["status"], job["cursor"], job["processed"]) == (crud_jobs.DONE, 5, 5)
+
+
+async def test_jobs_of_a_server_run_in_order(queue, monkeypatch):
+    first = await crud_jobs.create_job(queue, "flag_words", 1, {"words": ["foo"]})
+    second = await crud_jobs.create_job(queue, "unflag_words", 1, {"words": ["foo"]})
+    other = await crud_jobs.create_job(queue, "flag_words", 2, {"words": ["foo"]})
+    assert await crud_jobs.has_earlier_job(queue, second)
+    assert not await crud_jobs.has_earlier_job(queue, other)
+
+    done = asyncio.Event()
+    started = []
+
+    async def execute(job: dict):
+        started.append(job["_id"])
+        await done.wait()
+        await crud_jobs.finish(queue, job["_id"], job_runner.owner, crud_jobs.DONE)
+
+    job_runner = runner(queue)
+    monkeypatch.setattr(job_runner, "_execute", execute)
+    await job_runner._claim()
+    await asyncio.sleep(0)
+    assert started == [first["_id"], other["_id"]]
+
+    done.set()
+    await asyncio.gather(*job_runner._running.values())
+    await job_runner._claim()
+    await asyncio.gather(*job_runner._running.values())
+    assert started == [first["_id"], other["_id"], second["_id"]]
@@ -0,0 +1,28 @@
+import pytest
+
+from app.storage.memory import MemoryClient, evaluate
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("expr, expected", [
+    ({"$add": [1, 2, 3]}, 6),
+    ({"$add": [1, None]}, None),
+    ({"$add": [1, "$missing"]}, None),
+    ({"$subtract": ["$value", 2]}, 3),
+    ({"$subtract": ["$missing", 2]}, None),
+    ({"$multiply": ["$value", 2]}, 10),
+    ({"$multiply": ["$value", None]}, None),
+    ({"$ifNull": ["$missing", 0]}, 0),
+])
+def test_arithmetic(expr, expected):
+    assert evaluate(expr, {"value": 5}) == expected
+
+
+async def test_pipeline_update_with_null_operand():
+    collection = MemoryClient()["test"]["documents"]
+    await collection.insert_one({"_id": 1, "count": 1})
+
+    await collection.update_one({"_id": 1}, [{"$set": {"count": {"$add": ["$count", "$missing"]}}}])
+
+    assert await collection.find_one({"_id": 1}) == {"_id": 1, "count": None}
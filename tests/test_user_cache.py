@@ -0,0 +1,40 @@
+from app.crud import user_cache
+
+
+def document(id: str) -> dict:
+    return {"_id": id, "discord_server_id": 1, "discord_user_id": 2, "total_words": 0, "words": {}}
+
+
+def test_invalidate_id_drops_cached_profile():
+    cache = user_cache.UserProfileCache(max_bytes=1_000_000, ttl=60)
+    cache.put(1, 2, document("a"), cache.generation_of(1, 2))
+
+    cache.invalidate_id("b")
+    assert cache.get(1, 2) is not None
+    cache.invalidate_id("a")
+    assert cache.get(1, 2) is None
+
+
+def test_invalidate_id_during_read_skips_put():
+    cache = user_cache.UserProfileCache(max_bytes=1_000_000, ttl=60)
+    generation = cache.generation_of(1, 2)
+    # The profile is not cached yet when another worker's write of it is streamed in
+    cache.invalidate_id("a")
+    cache.put(1, 2, document("a"), generation)
+    assert cache.get(1, 2) is None
+
+    # Unrelated ids do not hold back reads of other profiles
+    generation = cache.generation_of(1, 2)
+    cache.invalidate_id("b")
+    cache.put(1, 2, document("a"), generation)
+    assert cache.get(1, 2) is not None
+
+
+def test_forgotten_invalidations_skip_put(monkeypatch):
+    monkeypatch.setattr(user_cache, "RECENT_IDS_SIZE", 2)
+    cache = user_cache.UserProfileCache(max_bytes=1_000_000, ttl=60)
+    generation = cache.generation_of(1, 2)
+    for id in ("a", "b", "c"):
+        cache.invalidate_id(id)
+    cache.put(1, 2, document("a"), generation)
+    assert cache.get(1, 2) is None
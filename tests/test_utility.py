@@ -0,0 +1,46 @@
+import pytest
+
+from app.schemas.server_schemas import ServerProfile
+from app.schemas.user_schemas import UserProfile
+from app.utility import ValidationError, iter_id_batches, shape
+
+pytestmark = pytest.mark.anyio
+
+
+async def collect(lines: list[bytes], batch_size: int) -> list[tuple[list[int], list[str]]]:
+    async def stream():
+        for line in lines:
+            yield line
+
+    return [batch async for batch in iter_id_batches(stream(), batch_size)]
+
+
+async def test_iter_id_batches_splits_ids():
+    batches = await collect([b"1\n2\n", b"[3, 4]\n5"], 2)
+
+    assert batches == [([1, 2], []), ([3, 4], []), ([5], [])]
+
+
+async def test_iter_id_batches_reports_invalid_with_the_next_batch():
+    batches = await collect([b"1\nfoo\n3\n"], 2)
+
+    assert batches == [([1, 3], ["foo"])]
+
+
+async def test_iter_id_batches_flushes_invalid_on_its_own():
+    batches = await collect([b"foo\n" * 5], 2)
+
+    assert batches == [([], ["foo", "foo"]), ([], ["foo", "foo"]), ([], ["foo"])]
+
+
+def test_shape_fills_defaults_with_copies():
+    first = shape({"discord_server_id": 1}, ServerProfile)
+    first["words"]["foo"] = 1
+
+    assert shape({"discord_server_id": 1}, ServerProfile)["words"] == {}
+    assert ServerProfile.model_fields["words"].default == {}
+
+
+def test_shape_rejects_missing_required_fields():
+    with pytest.raises(ValidationError):
+        shape({"discord_server_id": 1}, UserProfile)
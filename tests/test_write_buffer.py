@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+
+import pytest
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app import config
+from app.crud import archive, servers as crud_servers, users as crud_users
+from app.write_buffer import WriteBuffer
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def buffer(servers, users):
+    await crud_servers.create_profile(servers, 1)
+    await crud_servers.flag_words(servers, 1, ["foo"])
+    await crud_users.create_multiple_profiles(users, servers, 1, [10, 11])
+    return WriteBuffer(users, servers, flush_interval=60.0, max_keys=100, max_retry_delay=60.0)
+
+
+async def totals(users, servers) -> tuple[dict, int]:
+    user_totals = {document["discord_user_id"]: document["total_words"] async for document in users.find({})}
+    return user_totals, (await servers.find_one({"discord_server_id": 1}))["total_words"]
+
+
+def fail_once(monkeypatch, collection, error: Exception):
+    bulk_write = collection.bulk_write
+    calls = []
+
+    async def failing(requests, ordered: bool = True, **kwargs):
+        if len(calls) == 0:
+            calls.append(requests)
+            raise error
+        return await bulk_write(requests, ordered=ordered, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", failing)
+    return calls
+
+
+async def test_merged_increments_land_once(buffer, users, servers):
+    await buffer.add_total_words(1, 10, 2)
+    await buffer.add_total_words(1, 10, 3)
+    await buffer.add_flags(1, 10, {"foo": 1})
+    await buffer.add_flags(1, 10, {"foo": 1})
+
+    assert await buffer.flush()
+    assert await buffer.flush()
+
+    assert await totals(users, servers) == ({10: 5, 11: 0}, 5)
+    assert (await users.find_one({"discord_user_id": 10}))["words"]["foo"] == 2
+    assert (await servers.find_one({"discord_server_id": 1}))["words"]["foo"] == 2
+
+
+async def test_failed_server_write_keeps_user_writes_once(buffer, users, servers, monkeypatch):
+    calls = fail_once(monkeypatch, servers, PyMongoError("down"))
+    await buffer.add_total_words(1, 10, 2)
+
+    assert not await buffer.flush()
+    assert len(calls) == 1
+    assert await totals(users, servers) == ({10: 2, 11: 0}, 0)
+
+    await buffer.add_total_words(1, 10, 1)
+    assert await buffer.flush()
+    assert await totals(users, servers) == ({10: 3, 11: 0}, 3)
+
+
+async def test_failed_user_write_is_retried(buffer, users, servers, monkeypatch):
+    fail_once(monkeypatch, users, PyMongoError("down"))
+    await buffer.add_total_words(1, 10, 2)
+
+    assert not await buffer.flush()
+    assert await totals(users, servers) == ({10: 0, 11: 0}, 2)
+
+    assert await buffer.flush()
+    assert await totals(users, servers) == ({10: 2, 11: 0}, 2)
+
+
+async def test_partial_bulk_write_error_retries_failed_writes_only(buffer, users, servers, monkeypatch):
+    bulk_write = users.bulk_write
+
+    async def partial(requests, ordered: bool = True, **kwargs):
+        # The first operation is applied and the second one fails
+        monkeypatch.setattr(users, "bulk_write", bulk_write)
+        result = await bulk_write(requests[:1], ordered=ordered, **kwargs)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 1, "errmsg": "failed"}],
+                              "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                              "nMatched": result.matched_count, "nModified": result.modified_count,
+                              "nRemoved": 0, "upserted": []})
+
+    monkeypatch.setattr(users, "bulk_write", partial)
+    await buffer.add_total_words(1, 10, 2)
+    await buffer.add_total_words(1, 11, 3)
+
+    assert not await buffer.flush()
+    assert await buffer.flush()
+    assert await totals(users, servers) == ({10: 2, 11: 3}, 5)
+
+
+async def test_full_buffer_wakes_the_flush(buffer, users, servers):
+    buffer.max_keys = 2
+    buffer.start()
+    try:
+        await buffer.add_total_words(1, 10, 1)
+        await asyncio.sleep(0.05)
+        assert await totals(users, servers) == ({10: 0, 11: 0}, 0)
+
+        await buffer.add_total_words(1, 11, 1)
+        for _ in range(100):
+            if (await totals(users, servers))[1] == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert await totals(users, servers) == ({10: 1, 11: 1}, 2)
+    finally:
+        await buffer.stop()
+
+
+async def test_failed_flushes_back_off(buffer, monkeypatch):
+    buffer.flush_interval = 0.01
+    buffer.max_retry_delay = 0.03
+    delays = []
+
+    async def flush() -> bool:
+        return False
+
+    async def sleep(delay: float):
+        delays.append(delay)
+        if len(delays) == 4:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(buffer, "flush", flush)
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await buffer._run()
+
+    assert delays == [0.01, 0.02, 0.03, 0.03]
+
+
+async def test_archived_members_are_restored(buffer, users, servers, monkeypatch):
+    monkeypatch.setattr(config, "ARCHIVE_INACTIVE_DAYS", 30.0)
+    await archive.archive_profiles(users, [document["_id"] async for document in users.find({})],
+                                   archive.now() + datetime.timedelta(seconds=1))
+    await buffer.add_total_words(1, 10, 4)
+
+    assert await buffer.flush()
+    assert await totals(users, servers) == ({10: 4}, 4)
+    assert await archive.archive_collection(users).count_documents({}) == 1
+
+
+async def test_stop_flushes(buffer, users, servers):
+    buffer.start()
+    await buffer.add_flags(1, 11, {"foo": 2})
+    await buffer.stop()
+
+    assert (await users.find_one({"discord_user_id": 11}))["words"]["foo"] == 2
+    assert (await servers.find_one({"discord_server_id": 1}))["words"]["foo"] == 2